@@ -0,0 +1,108 @@
+"""
+Load test for the public download path, used to compare a WSGI and an ASGI deployment.
+
+Start the same project twice, for example::
+
+    gunicorn diploma.wsgi -w 4 -b 127.0.0.1:8001
+    ASYNC_VIEWS=True uvicorn diploma.asgi:application --port 8002
+
+and run::
+
+    python benchmarks/loadtest.py --target wsgi=http://127.0.0.1:8001/download/<uuid> \\
+        --target asgi=http://127.0.0.1:8002/download/<uuid> --concurrency 200 --requests 2000 --read-rate 262144
+
+``--read-rate`` limits how fast every client reads the body (bytes per second), which emulates
+slow clients holding connections open. Only the standard library is used.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+async def fetch(url, read_rate, chunk_size=64 * 1024):
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: close\r\n\r\n'.encode())
+    await writer.drain()
+
+    started = time.perf_counter()
+    status_line = await reader.readline()
+    status = int(status_line.split()[1])
+    while (await reader.readline()) not in (b'\r\n', b''):
+        pass
+    first_byte = time.perf_counter() - started
+
+    received = 0
+    while True:
+        data = await reader.read(chunk_size)
+        if not data:
+            break
+        received += len(data)
+        if read_rate:
+            await asyncio.sleep(len(data) / read_rate)
+    writer.close()
+    return status, received, first_byte, time.perf_counter() - started
+
+
+async def run(url, requests, concurrency, read_rate):
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def worker():
+        async with semaphore:
+            try:
+                results.append(await fetch(url, read_rate))
+            except OSError:
+                results.append((0, 0, 0.0, 0.0))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    ok = [result for result in results if 200 <= result[0] < 300]
+    latencies = sorted(result[3] for result in ok) or [0.0]
+    first_bytes = sorted(result[2] for result in ok) or [0.0]
+    return {
+        'url': url,
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': len(results) - len(ok),
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(ok) / elapsed, 1),
+        'megabytes_per_second': round(sum(result[1] for result in ok) / elapsed / 2 ** 20, 2),
+        'ttfb_p50_ms': round(statistics.median(first_bytes) * 1000, 1),
+        'latency_p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'latency_p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', action='append', required=True, help='name=url, may be repeated')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--read-rate', type=int, default=0, help='client read rate in bytes/s, 0 - unlimited')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = {}
+    for target in args.target:
+        name, _, url = target.partition('=')
+        results[name] = asyncio.run(run(url, args.requests, args.concurrency, args.read_rate))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    columns = ['requests_per_second', 'megabytes_per_second', 'ttfb_p50_ms', 'latency_p50_ms', 'latency_p99_ms',
+               'errors']
+    print(f'{"target":<10}' + ''.join(f'{column:>22}' for column in columns))
+    for name, result in results.items():
+        print(f'{name:<10}' + ''.join(f'{result[column]:>22}' for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,7 @@ import os
 from pathlib import Path
 
 import environ
+from django.core.exceptions import ImproperlyConfigured
 
 env = environ.Env(
     DEBUG=(bool, True)
@@ -46,6 +47,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'corsheaders',
     'rest_framework',
@@ -55,6 +57,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'my_cloud.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,6 +91,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'diploma.wsgi.application'
 
+# Serve /download/<uuid> with the async view, enable only when running under ASGI
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', default=False)
+
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
@@ -151,6 +157,93 @@ MEDIA_URL = 'media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_USER_FOLDER = 'user_files/'
 MEDIA_DELETE_FOLDER = 'media/deleted_files/'
+# Days a deleted blob is kept in MEDIA_DELETE_FOLDER before it is removed for good
+TRASH_RETENTION_DAYS = env.int('TRASH_RETENTION_DAYS', default=30)
+# Move deleted blobs to the trash from a thread of the web process,
+# disable when `manage.py run_deletion_worker` runs as a separate service
+DELETION_WORKER_THREAD = env.bool('DELETION_WORKER_THREAD', default=True)
+
+# Store identical uploads once, under their SHA-256 digest
+STORAGE_DEDUPLICATE = env.bool('STORAGE_DEDUPLICATE', default=False)
+# Storage roots besides MEDIA_ROOT as name=path pairs, e.g. STORAGE_VOLUMES=disk2=/mnt/disk2,disk3=/mnt/disk3
+STORAGE_VOLUMES = env.dict('STORAGE_VOLUMES', default={})
+# Volume of new blobs: 'free' - the one with most free space, 'weight' - random by STORAGE_VOLUME_WEIGHTS
+# (name=weight pairs, 1 for volumes not listed; MEDIA_ROOT is called 'default')
+STORAGE_PLACEMENT = env('STORAGE_PLACEMENT', default='free')
+STORAGE_VOLUME_WEIGHTS = env.dict('STORAGE_VOLUME_WEIGHTS', cast={'value': float}, default={})
+# Compress new blobs while they are written: '' - off, 'gzip' or 'zstd' (needs the zstandard package);
+# already compressed formats are stored as they are
+STORAGE_COMPRESSION = env('STORAGE_COMPRESSION', default='')
+# Codec level, unset for the codec default
+STORAGE_COMPRESSION_LEVEL = env.int('STORAGE_COMPRESSION_LEVEL', default=None)
+# Volume of STORAGE_VOLUMES that tier_blobs moves files to when nobody downloaded them for
+# STORAGE_COLD_AFTER_DAYS days; new uploads never go there
+STORAGE_COLD_VOLUME = env('STORAGE_COLD_VOLUME', default='')
+STORAGE_COLD_AFTER_DAYS = env.int('STORAGE_COLD_AFTER_DAYS', default=90)
+# Codec of blobs on the cold volume, '' to store them as they are
+STORAGE_COLD_COMPRESSION = env('STORAGE_COLD_COMPRESSION', default='gzip')
+# Move cold files back to the hot volumes in the background when they are downloaded
+STORAGE_PROMOTE_ON_ACCESS = env.bool('STORAGE_PROMOTE_ON_ACCESS', default=True)
+
+# Default storage quota per user in bytes, 0 - unlimited
+USER_QUOTA_BYTES = env.int('USER_QUOTA_BYTES', default=0)
+
+DOWNLOAD_CHUNK_SIZE = env.int('DOWNLOAD_CHUNK_SIZE', default=64 * 1024)
+# '' - stream from Django, 'x-accel-redirect' - nginx, 'x-sendfile' - Apache/lighttpd
+DOWNLOAD_OFFLOAD = env('DOWNLOAD_OFFLOAD', default='')
+# nginx internal location of MEDIA_ROOT, X-Accel-Redirect sends it followed by the blob name
+DOWNLOAD_OFFLOAD_PREFIX = env('DOWNLOAD_OFFLOAD_PREFIX', default='/protected/')
+if not (DOWNLOAD_OFFLOAD_PREFIX.startswith('/') and DOWNLOAD_OFFLOAD_PREFIX.endswith('/')):
+    raise ImproperlyConfigured('DOWNLOAD_OFFLOAD_PREFIX has to start and end with "/"')
+UPLOAD_CHUNK_MAX_SIZE = env.int('UPLOAD_CHUNK_MAX_SIZE', default=64 * 1024 * 1024)
+# Days an upload session may go without a chunk before the deletion worker removes it with its blob
+UPLOAD_SESSION_MAX_AGE_DAYS = env.int('UPLOAD_SESSION_MAX_AGE_DAYS', default=7)
+# Bounding box sizes of image previews in pixels, the first one is the default
+PREVIEW_SIZES = env.list('PREVIEW_SIZES', cast=int, default=[128, 512])
+if not PREVIEW_SIZES:
+    raise ImproperlyConfigured('PREVIEW_SIZES needs at least one size')
+PREVIEW_WORKERS = env.int('PREVIEW_WORKERS', default=2)
+# Render previews right after upload instead of on the first request
+PREVIEW_ON_UPLOAD = env.bool('PREVIEW_ON_UPLOAD', default=True)
+# Collect download counter increments in memory and write them every N seconds
+DOWNLOAD_COUNTER_BUFFERED = env.bool('DOWNLOAD_COUNTER_BUFFERED', default=False)
+DOWNLOAD_COUNTER_FLUSH_INTERVAL = env.float('DOWNLOAD_COUNTER_FLUSH_INTERVAL', default=5.0)
+# Issue HMAC signed links (/download/s/...), which are checked without a database query, instead of /download/<uuid>
+DOWNLOAD_SIGNED_LINKS = env.bool('DOWNLOAD_SIGNED_LINKS', default=False)
+# Lifetime of signed links in seconds and the longest one a link may be issued for, 0 - no expiry
+DOWNLOAD_LINK_MAX_AGE = env.int('DOWNLOAD_LINK_MAX_AGE', default=7 * 24 * 60 * 60)
+# Bandwidth of public downloads in bytes per second per shared file, per file owner and in total, 0 - unlimited.
+# Limits apply per process; offloaded downloads are left to the proxy
+DOWNLOAD_RATE_PER_LINK = env.int('DOWNLOAD_RATE_PER_LINK', default=0)
+DOWNLOAD_RATE_PER_OWNER = env.int('DOWNLOAD_RATE_PER_OWNER', default=0)
+DOWNLOAD_RATE_GLOBAL = env.int('DOWNLOAD_RATE_GLOBAL', default=0)
+# Concurrent downloads per shared file, 0 - unlimited; more are answered 429 with Retry-After: DOWNLOAD_RETRY_AFTER
+DOWNLOAD_CONCURRENCY_PER_LINK = env.int('DOWNLOAD_CONCURRENCY_PER_LINK', default=0)
+DOWNLOAD_RETRY_AFTER = env.int('DOWNLOAD_RETRY_AFTER', default=10)
+
+
+# Prometheus metrics at /metrics require "Authorization: Bearer METRICS_TOKEN" when it is set. Otherwise they are
+# served to METRICS_ALLOWED_IPS, which only works when gunicorn sees the scraper's address (no proxy in front)
+METRICS_TOKEN = env.str('METRICS_TOKEN', default='')
+METRICS_ALLOWED_IPS = env.list('METRICS_ALLOWED_IPS', default=[])
+# Log this share of requests slower than SLOW_REQUEST_THRESHOLD seconds
+SLOW_REQUEST_THRESHOLD = env.float('SLOW_REQUEST_THRESHOLD', default=1.0)
+SLOW_REQUEST_SAMPLE_RATE = env.float('SLOW_REQUEST_SAMPLE_RATE', default=0.1)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'default': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'default'},
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': env('LOG_LEVEL', default='INFO'),
+    },
+}
 
 
 # Default primary key field type
@@ -160,10 +253,41 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'my_cloud.authentication.CachedTokenAuthentication',
     ],
 }
 
+# Use a shared cache (e.g. CACHE_URL=redis://127.0.0.1:6379/1) when running several workers,
+# empty - memory of each process
+CACHE_URL = env('CACHE_URL', default='')
+CACHES = {
+    'default': env.cache_url_config(CACHE_URL or 'locmemcache://'),
+}
+# Whether all workers see the same default cache
+SHARED_CACHE = bool(CACHE_URL) and not CACHE_URL.startswith(('locmemcache:', 'dummycache:'))
+
+# Resolved auth tokens are kept AUTH_TOKEN_CACHE_TTL seconds, 0 - off. Off by default without a shared cache,
+# as other workers would accept a token for that long after logout
+AUTH_TOKEN_CACHE = 'default'
+AUTH_TOKEN_CACHE_TTL = env.int('AUTH_TOKEN_CACHE_TTL', default=60 if SHARED_CACHE else 0)
+
+# Link revisions of files and download counts of signed links; other processes see a revoked link
+# after at most DOWNLOAD_LINK_CACHE_TTL seconds
+DOWNLOAD_LINK_CACHE = 'default'
+DOWNLOAD_LINK_CACHE_TTL = env.int('DOWNLOAD_LINK_CACHE_TTL', default=60)
+
+# Running download counts for DOWNLOAD_CONCURRENCY_PER_LINK, shared by all processes only with a shared cache.
+# Counts left by a crashed worker expire after DOWNLOAD_CONCURRENCY_TTL seconds
+DOWNLOAD_THROTTLE_CACHE = 'default'
+DOWNLOAD_CONCURRENCY_TTL = env.int('DOWNLOAD_CONCURRENCY_TTL', default=60 * 60)
+
+# File, user and settings lists answer 304 while unchanged and keep their payload for LIST_CACHE_TTL seconds.
+# Off by default without a shared cache, as a change would only reach the worker that made it
+LIST_CACHE = 'default'
+LIST_VERSIONS = env.bool('LIST_VERSIONS', default=SHARED_CACHE)
+LIST_CACHE_TTL = env.int('LIST_CACHE_TTL', default=30 if SHARED_CACHE else 0)
+LIST_VERSION_TTL = env.int('LIST_VERSION_TTL', default=60)
+
 CORS_ORIGIN_WHITELIST = (
     'http://localhost:5173',
     'http://127.0.0.1:8000',
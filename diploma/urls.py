@@ -4,14 +4,24 @@ from django.urls import path, include, re_path
 
 from diploma import settings
 
-from my_cloud.views import issue_token, issue_link_generation, issue_link_download, front
+from my_cloud.metrics import metrics_view
+from my_cloud.views import issue_token, revoke_token, issue_link_generation, issue_link_download, \
+    issue_link_download_async, issue_link_download_archive, signed_link_download, signed_link_download_async, \
+    upload_chunk_async, front
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/logon', issue_token),
+    path('api/logout', revoke_token),
     path('api/link-generation', issue_link_generation),
-    path('download/<uuid>', issue_link_download),
+    path('download/archive', issue_link_download_archive),
+    path('download/s/<str:signed>', signed_link_download_async if settings.ASYNC_VIEWS else signed_link_download,
+         name='signed-download'),
+    path('download/<uuid:uuid>', issue_link_download_async if settings.ASYNC_VIEWS else issue_link_download,
+         name='download'),
+    path('api/upload/<uuid:pk>/chunk', upload_chunk_async),
     path('api/', include('my_cloud.urls')),
+    path('metrics', metrics_view),
     path("", front, name="front"),
     re_path(r'^(?:.*)/?$', front),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
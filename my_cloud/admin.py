@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import File
+from .models import File, UserUsage
 # Register your models here.
 
 admin.site.register(File)
+admin.site.register(UserUsage)
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class MyCloudConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'my_cloud'
+
+    def ready(self):
+        from . import authentication  # connects token cache invalidation signals
+        from . import previews  # connects preview invalidation signals
+        from . import caching  # connects list version signals
+        from . import links  # connects signed link revocation signals
+        from . import metrics  # instruments database connections before the first one is opened
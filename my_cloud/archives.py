@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import os
+import zipfile
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+from .compression import COMPRESSED_EXTENSIONS, open_blob
+from .throttling import release_throttles
+
+logger = logging.getLogger(__name__)
+
+# Members that may come close to 4 GiB need zip64 headers, which have to be chosen before writing
+ZIP64_THRESHOLD = zipfile.ZIP64_LIMIT // 2
+
+
+class ZipStream:
+    """Unseekable sink for ``zipfile``: collects written bytes until the response takes them."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def member_names(files):
+    """Return archive names for ``files``, numbering duplicates as ``name (1).ext``."""
+    used = set()
+    names = []
+    for file in files:
+        name = (file.filename or file.title or str(file.pk)).replace('\\', '/').split('/')[-1] or str(file.pk)
+        stem, ext = os.path.splitext(name)
+        candidate, number = name, 1
+        while candidate.lower() in used:
+            candidate = f'{stem} ({number}){ext}'
+            number += 1
+        used.add(candidate.lower())
+        names.append(candidate)
+    return names
+
+
+def compress_type(file, name):
+    extension = (file.extension or os.path.splitext(name)[1]).lstrip('.').lower()
+    return zipfile.ZIP_STORED if extension in COMPRESSED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def iter_zip(files, chunk_size, throttles=None):
+    """
+    Yield a ZIP archive of the blobs of ``files`` while it is being written.
+
+    Members are written with data descriptors, so the archive never has to be seeked and
+    only one chunk of one member is held in memory at a time. Blobs missing from the
+    storage are left out: the response status is already sent when they are reached.
+    ``throttles``, one per file or ``None``, pace the bytes read from each blob.
+    """
+    stream = ZipStream()
+    throttles = throttles or [None] * len(files)
+    with zipfile.ZipFile(stream, 'w') as archive:
+        for file, name, throttle in zip(files, member_names(files), throttles):
+            try:
+                handle = open_blob(file.handle.path, file.compression)
+            except FileNotFoundError:
+                logger.error('Archive member %s of file %s is missing', file.handle.name, file.pk)
+                continue
+
+            info = zipfile.ZipInfo(name, date_time=timezone.localtime(file.updated_at).timetuple()[:6])
+            info.compress_type = compress_type(file, name)
+            info.external_attr = 0o644 << 16
+            with handle, archive.open(info, 'w', force_zip64=file.size >= ZIP64_THRESHOLD) as member:
+                while data := handle.read(chunk_size):
+                    if throttle is not None:
+                        throttle.wait(len(data))
+                    member.write(data)
+                    if stream.chunks:
+                        yield stream.pop()
+            if stream.chunks:
+                yield stream.pop()
+    yield stream.pop()
+
+
+class ClosingIterator:
+    """Iterates ``iterator`` and calls ``on_close`` when the response is closed, even if it was never started."""
+
+    def __init__(self, iterator, on_close):
+        self.iterator = iterator
+        self.on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.iterator)
+
+    def close(self):
+        try:
+            self.iterator.close()
+        finally:
+            self.on_close()
+
+
+class AsyncIterator:
+    """Runs each step of a blocking iterator in a worker thread, for responses served under ASGI."""
+
+    def __init__(self, iterator):
+        self.iterator = iterator
+
+    async def __aiter__(self):
+        sentinel = object()
+        while (data := await asyncio.to_thread(next, self.iterator, sentinel)) is not sentinel:
+            yield data
+
+    def close(self):
+        if hasattr(self.iterator, 'close'):
+            self.iterator.close()
+
+
+def archive_response(files, filename='files.zip', asynchronous=False, throttles=None):
+    """
+    Stream a ZIP archive of ``files``; ``throttles``, one per file or ``None``, pace their
+    members and are released when the response is closed.
+    """
+    files = list(files)
+    iterator = iter_zip(files, settings.DOWNLOAD_CHUNK_SIZE, throttles)
+    if any(throttles or ()):
+        iterator = ClosingIterator(iterator, lambda: release_throttles(throttles))
+    if asynchronous:
+        iterator = AsyncIterator(iterator)
+    response = StreamingHttpResponse(iterator, content_type='application/zip')
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
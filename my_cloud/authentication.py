@@ -0,0 +1,51 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.dispatch import receiver
+from django.db import models
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+def token_cache_key(key):
+    return 'auth-token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def invalidate_token(key):
+    caches[settings.AUTH_TOKEN_CACHE].delete(token_cache_key(key))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that keeps resolved tokens in the ``AUTH_TOKEN_CACHE`` cache.
+
+    Entries live for ``AUTH_TOKEN_CACHE_TTL`` seconds and are dropped when the token is
+    deleted (logout, user removal) or its user is saved (password change, deactivation).
+    With a TTL of 0 every request looks the token up.
+    """
+
+    def authenticate_credentials(self, key):
+        if not settings.AUTH_TOKEN_CACHE_TTL:
+            return super().authenticate_credentials(key)
+        cache = caches[settings.AUTH_TOKEN_CACHE]
+        cache_key = token_cache_key(key)
+        token = cache.get(cache_key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(cache_key, token, settings.AUTH_TOKEN_CACHE_TTL)
+        return token.user, token
+
+
+@receiver(models.signals.post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(models.signals.post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    if created:
+        return
+    for key in Token.objects.filter(user_id=instance.id).values_list('key', flat=True):
+        invalidate_token(key)
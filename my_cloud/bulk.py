@@ -0,0 +1,174 @@
+from collections import defaultdict
+from uuid import uuid4
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import PermissionDenied, ValidationError
+
+from .caching import touch_files
+from .deletion import deletion_worker
+from .links import forget_files, forget_revisions
+from .models import File, PendingDeletion, UserUsage, bulk_delete
+from .previews import discard_previews
+from .quotas import check_quota
+from .serializers import FileSerializer
+
+BULK_MAX_ITEMS = 1000
+
+
+def parse_ids(data):
+    """Return the unique file ids from the ``ids`` list of a bulk request body, keeping their order."""
+    ids = data.get('ids', None)
+    if not isinstance(ids, list) or not ids:
+        raise ValidationError({'ids': 'Expected a non-empty list of file ids'})
+    if len(ids) > BULK_MAX_ITEMS:
+        raise ValidationError({'ids': f'At most {BULK_MAX_ITEMS} files per request'})
+    try:
+        return list(dict.fromkeys(int(pk) for pk in ids))
+    except (TypeError, ValueError):
+        raise ValidationError({'ids': 'Expected integer file ids'})
+
+
+class BulkSelection:
+    """
+    Files of a bulk request that the user may change, locked with one query.
+
+    ``results`` holds one entry per requested id; ids that are unknown or belong to
+    another user get their error right away, the rest are filled in by the operation.
+    """
+
+    def __init__(self, user, ids, fields=('id', 'user_id', 'extension', 'size', 'stored_size', 'handle')):
+        files = File.objects.select_for_update().filter(pk__in=ids).only(*fields).order_by('id')
+        self.files = []
+        self.results = {pk: {'id': pk, 'status': status.HTTP_404_NOT_FOUND, 'error': 'File not found'}
+                        for pk in ids}
+        for file in files:
+            if user.is_superuser or file.user_id == user.id:
+                self.files.append(file)
+                self.results[file.pk] = {'id': file.pk, 'status': status.HTTP_200_OK}
+            else:
+                self.results[file.pk] = {'id': file.pk, 'status': status.HTTP_403_FORBIDDEN,
+                                         'error': 'You do not have permission to perform this action.'}
+
+    @property
+    def pks(self):
+        return [file.pk for file in self.files]
+
+    @property
+    def owners(self):
+        return {file.user_id for file in self.files}
+
+    def usage(self):
+        """Return ``{(user_id, extension): (files, bytes, stored bytes)}`` of the selected files."""
+        usage = defaultdict(lambda: (0, 0, 0))
+        for file in self.files:
+            files, size, stored_size = usage[file.user_id, file.extension]
+            usage[file.user_id, file.extension] = (files + 1, size + file.size, stored_size + file.stored_size)
+        return usage
+
+    def response(self):
+        return {'results': list(self.results.values())}
+
+
+def delete_files(user, ids):
+    """
+    Delete the user's files among ``ids`` with one queryset delete.
+
+    The ``post_delete`` receivers are skipped, their work is done once for all files: usage is
+    adjusted per user, the blobs are queued for the deletion worker in one insert and the
+    signed links, list versions and previews are dropped together.
+    """
+    with transaction.atomic():
+        selection = BulkSelection(user, ids)
+        if selection.files:
+            changes = defaultdict(dict)
+            for (user_id, extension), (files, size, stored_size) in selection.usage().items():
+                changes[user_id][extension] = (-size, -files, -stored_size)
+            for user_id, user_changes in changes.items():
+                UserUsage.record_many(user_id, user_changes)
+            PendingDeletion.objects.bulk_create([PendingDeletion(name=file.handle.name)
+                                                 for file in selection.files if file.handle])
+            with bulk_delete():
+                File.objects.filter(pk__in=selection.pks).delete()
+            forget_files(*selection.pks)
+            touch_files(*selection.owners)
+            transaction.on_commit(deletion_worker.wake)
+            transaction.on_commit(lambda: discard_previews(selection.pks))
+
+    for pk in selection.pks:
+        selection.results[pk]['status'] = status.HTTP_204_NO_CONTENT
+    return selection.response()
+
+
+def update_files(user, ids, data):
+    """
+    Apply the same ``description`` and/or owner (``user``, superusers only) to the user's files.
+
+    Moving files to another user checks the new owner's quota for all of them at once.
+    """
+    changes = {}
+    if 'description' in data:
+        try:
+            changes['description'] = FileSerializer().fields['description'].run_validation(data['description'])
+        except ValidationError as e:
+            raise ValidationError({'description': e.detail})
+    if 'user' in data:
+        if not user.is_superuser:
+            raise PermissionDenied('Only a superuser can move files to another user')
+        try:
+            changes['user'] = User.objects.get(pk=data['user'])
+        except (TypeError, ValueError):
+            raise ValidationError({'user': 'Expected a user id'})
+    if not changes:
+        raise ValidationError('Nothing to update, expected description or user')
+
+    with transaction.atomic():
+        selection = BulkSelection(user, ids)
+        if selection.files:
+            if 'user' in changes:
+                target = changes['user'].pk
+                moved = {key: value for key, value in selection.usage().items() if key[0] != target}
+                check_quota(target, sum(size for _, size, _ in moved.values()))
+                for (user_id, extension), (files, size, stored_size) in moved.items():
+                    UserUsage.record(user_id, extension, -size, -files, -stored_size)
+                    UserUsage.record(target, extension, size, files, stored_size)
+            File.objects.filter(pk__in=selection.pks).update(updated_at=timezone.now(), **changes)
+            touch_files(*selection.owners, *([changes['user'].pk] if 'user' in changes else []))
+    return selection.response()
+
+
+def share_files(user, ids, build_url):
+    """Give every file of the user among ``ids`` a new share token; ``build_url`` makes the link."""
+    for attempt in range(3):
+        try:
+            with transaction.atomic():
+                selection = BulkSelection(user, ids)
+                now = timezone.now()
+                for file in selection.files:
+                    file.token = uuid4()
+                    file.updated_at = now
+                File.objects.bulk_update(selection.files, ['token', 'updated_at'], batch_size=BULK_MAX_ITEMS)
+                touch_files(*selection.owners)
+            break
+        except IntegrityError:
+            # A token collision rolls back the whole batch, which is then retried with new tokens
+            if attempt == 2:
+                raise
+
+    for file in selection.files:
+        selection.results[file.pk]['url'] = build_url(file.get_download_path())
+    return selection.response()
+
+
+def unshare_files(user, ids):
+    """Remove the share tokens of the user's files among ``ids`` and revoke their signed links."""
+    with transaction.atomic():
+        selection = BulkSelection(user, ids)
+        File.objects.filter(pk__in=selection.pks).update(token=None, link_revision=F('link_revision') + 1,
+                                                         updated_at=timezone.now())
+        forget_revisions(*selection.pks)
+        touch_files(*selection.owners)
+    return selection.response()
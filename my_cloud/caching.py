@@ -0,0 +1,155 @@
+import hashlib
+from functools import wraps
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import models, transaction
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+from rest_framework.response import Response
+
+from .models import File, UserSettings, UserUsage, in_bulk_delete
+
+
+def version_key(scope):
+    return f'list-version:{scope}'
+
+
+def get_versions(scopes):
+    """
+    Return the current versions of ``scopes``.
+
+    A version that is not in the cache (never set, expired or evicted) starts over with a
+    new random value, so it can never bring back the ETag of an older state.
+    """
+    cache = caches[settings.LIST_CACHE]
+    keys = [version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, settings.LIST_VERSION_TTL)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump(scopes):
+    caches[settings.LIST_CACHE].set_many({version_key(scope): uuid4().hex for scope in scopes},
+                                         settings.LIST_VERSION_TTL)
+
+
+def touch(scopes):
+    """Give ``scopes`` new versions now and once more when the current transaction commits."""
+    if not settings.LIST_VERSIONS:
+        return
+    scopes = set(scopes)
+    bump(scopes)
+    if transaction.get_connection().in_atomic_block:
+        # Requests running before the commit may have cached the old rows under the new versions
+        transaction.on_commit(lambda: bump(scopes))
+
+
+def touch_files(*user_ids):
+    touch(['files', *(f'files:{user_id}' for user_id in user_ids)])
+
+
+def touch_users(*user_ids):
+    touch(['users', *(f'users:{user_id}' for user_id in user_ids)])
+
+
+def touch_settings(user_id):
+    touch([f'settings:{user_id}'])
+
+
+def file_scope(request):
+    # Superusers may list the files of every user
+    return 'files' if request.user.is_superuser else f'files:{request.user.id}'
+
+
+def user_scope(request):
+    return 'users' if request.user.is_superuser else f'users:{request.user.id}'
+
+
+def settings_scope(request):
+    return f'settings:{request.user.id}'
+
+
+def conditional_list(scope):
+    """
+    Answer unchanged GET responses of a view action with ``304 Not Modified`` and keep the
+    payload for ``LIST_CACHE_TTL`` seconds.
+
+    The ETag is derived from the URL, the user and the version of the data the response is
+    built from, named by ``scope(request)``. Writes give that scope a new version, so
+    neither the ETag nor the cached payload is reused afterwards; versions and cached
+    payloads are looked up without a database query. Without ``LIST_VERSIONS`` (a cache
+    shared by all workers) responses are built every time.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method != 'GET' or not settings.LIST_VERSIONS:
+                return func(self, request, *args, **kwargs)
+
+            # Versions are read before the rows, a write in between only costs a cache miss
+            key = hashlib.sha256('\n'.join([
+                func.__name__, str(request.user.id), request.build_absolute_uri(),
+                request.headers.get('Accept', ''), *get_versions([scope(request)]),
+            ]).encode()).hexdigest()
+            etag = quote_etag(key)
+
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                cache = caches[settings.LIST_CACHE]
+                cached = cache.get(f'list-response:{key}') if settings.LIST_CACHE_TTL else None
+                if cached is not None:
+                    content, content_type = cached
+                    response = Response(content) if content_type is None \
+                        else HttpResponse(content, content_type=content_type)
+                else:
+                    response = func(self, request, *args, **kwargs)
+                    if response.status_code != 200:
+                        return response
+                    if settings.LIST_CACHE_TTL:
+                        cached = (response.data, None) if isinstance(response, Response) \
+                            else (response.content, response['Content-Type'])
+                        cache.set(f'list-response:{key}', cached, settings.LIST_CACHE_TTL)
+
+            response['ETag'] = etag
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ['Authorization'])
+            return response
+        return wrapper
+    return decorator
+
+
+@receiver(models.signals.post_save, sender=File)
+def touch_saved_file(sender, instance, **kwargs):
+    owners = {instance.user_id, getattr(instance, '_stored_user_id', instance.user_id)}
+    instance._stored_user_id = instance.user_id
+    touch_files(*owners)
+
+
+@receiver(models.signals.post_delete, sender=File)
+def touch_deleted_file(sender, instance, **kwargs):
+    if not in_bulk_delete():
+        touch_files(instance.user_id)
+
+
+@receiver(models.signals.post_save, sender=User)
+@receiver(models.signals.post_delete, sender=User)
+def touch_user(sender, instance, **kwargs):
+    touch_users(instance.pk)
+
+
+@receiver(models.signals.post_save, sender=UserUsage)
+def touch_usage(sender, instance, **kwargs):
+    touch_users(instance.user_id)
+
+
+@receiver(models.signals.post_save, sender=UserSettings)
+def touch_user_settings(sender, instance, **kwargs):
+    touch_settings(instance.user_id)
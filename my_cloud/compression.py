@@ -0,0 +1,145 @@
+import gzip
+import os
+import shutil
+import tempfile
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, without it only gzip is available
+    zstandard = None
+
+# Formats that are compressed already, compressing them again only costs CPU
+COMPRESSED_EXTENSIONS = {
+    '7z', 'avi', 'bz2', 'docx', 'epub', 'flac', 'gif', 'gz', 'heic', 'jar', 'jpeg', 'jpg', 'm4a', 'm4v',
+    'mkv', 'mov', 'mp3', 'mp4', 'odp', 'ods', 'odt', 'ogg', 'opus', 'png', 'pptx', 'rar', 'tgz', 'webm',
+    'webp', 'xlsx', 'xz', 'zip', 'zst',
+}
+
+# Raised while reading blobs whose compressed stream is damaged
+DECOMPRESSION_ERRORS = (EOFError, gzip.BadGzipFile, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+
+# Suffixes of compressed content addressed blobs, whose names carry no extension of their own
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def compression_for(extension, compression=None):
+    """
+    Return the codec for new blobs of files with ``extension``, or ``''``: ``compression``,
+    by default ``STORAGE_COMPRESSION``, unless the format is compressed already.
+    """
+    if compression is None:
+        compression = settings.STORAGE_COMPRESSION
+    if not compression or (extension or '').lstrip('.').lower() in COMPRESSED_EXTENSIONS:
+        return ''
+    if compression == 'zstd' and zstandard is None:
+        raise ImproperlyConfigured('Compression with "zstd" requires the zstandard package')
+    if compression not in SUFFIXES:
+        raise ImproperlyConfigured(f'Unknown compression codec: {compression}')
+    return compression
+
+
+def compressor(compression):
+    """Return an object with ``compress(data)`` and ``flush()`` that streams ``compression`` output."""
+    level = settings.STORAGE_COMPRESSION_LEVEL
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=level or 3).compressobj()
+    # wbits 31 writes a gzip header and trailer, so the blob can be sent as Content-Encoding: gzip
+    return zlib.compressobj(level or 6, zlib.DEFLATED, 31)
+
+
+def open_blob(path, compression):
+    """Open a stored blob for reading its original bytes; only forward seeks are cheap."""
+    match compression:
+        case '':
+            return open(path, 'rb')
+        case 'gzip':
+            return gzip.open(path, 'rb')
+        case 'zstd':
+            return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+        case _:
+            raise ValueError(f'Unknown blob compression: {compression}')
+
+
+def open_seekable_blob(path, compression):
+    """Like ``open_blob``, but spooled to a temporary file when the codec cannot seek backwards."""
+    blob = open_blob(path, compression)
+    if compression != 'zstd':
+        return blob
+    spooled = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+    with blob:
+        shutil.copyfileobj(blob, spooled, settings.DOWNLOAD_CHUNK_SIZE)
+    spooled.seek(0)
+    return spooled
+
+
+def compress_blob(path, compression, digest):
+    """
+    Hash the original bytes of the blob at ``path`` with ``digest`` and, with a ``compression``
+    codec, compress it in place in the same pass. Returns the stored size.
+    """
+    chunk_size = settings.DOWNLOAD_CHUNK_SIZE
+    if not compression:
+        with open(path, 'rb') as source:
+            while data := source.read(chunk_size):
+                digest.update(data)
+        return os.path.getsize(path)
+
+    # The blob is replaced only once its compressed copy is complete
+    temp = f'{path}.{os.getpid()}.tmp'
+    stream = compressor(compression)
+    try:
+        with open(path, 'rb') as source, open(temp, 'wb') as target:
+            while data := source.read(chunk_size):
+                digest.update(data)
+                target.write(stream.compress(data))
+            target.write(stream.flush())
+        os.replace(temp, path)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+    return os.path.getsize(path)
+
+
+def transcode_blob(source, compression, target, target_compression):
+    """
+    Write the blob at ``source``, stored with ``compression``, to ``target`` with
+    ``target_compression`` and return the stored size. The target appears only once complete.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp = f'{target}.{os.getpid()}.tmp'
+    try:
+        if compression == target_compression:
+            shutil.copyfile(source, temp)
+        else:
+            stream = compressor(target_compression) if target_compression else None
+            with open_blob(source, compression) as blob, open(temp, 'wb') as f:
+                while data := blob.read(settings.DOWNLOAD_CHUNK_SIZE):
+                    f.write(stream.compress(data) if stream else data)
+                if stream:
+                    f.write(stream.flush())
+        os.replace(temp, target)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+    return os.path.getsize(target)
+
+
+def accepted_encoding(request, compression):
+    """Return the ``Content-Encoding`` to send a ``compression`` blob as is, or ``None``."""
+    if not compression:
+        return None
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = item.partition(';')
+        if coding.strip().lower() != compression:
+            continue
+        name, _, value = params.replace(' ', '').partition('=')
+        try:
+            accepted = name != 'q' or float(value) > 0
+        except ValueError:
+            accepted = False
+        return compression if accepted else None
+    return None
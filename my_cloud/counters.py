@@ -0,0 +1,115 @@
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .caching import touch_files
+from .models import File
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadCounterBuffer:
+    """
+    Collects download increments in process memory and writes them in bulk.
+
+    Pending increments are flushed at most ``DOWNLOAD_COUNTER_FLUSH_INTERVAL`` seconds
+    after they were recorded, either by the next recording request or by a timer thread,
+    and once more when the process exits.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._owners = set()
+        self._flushed_at = time.monotonic()
+        self._timer = None
+
+    def add(self, pk, at, count=1, user_id=None):
+        with self._lock:
+            pending_count, _ = self._pending.get(pk, (0, None))
+            self._pending[pk] = (pending_count + count, at)
+            if user_id is not None:
+                self._owners.add(user_id)
+            due = time.monotonic() - self._flushed_at >= settings.DOWNLOAD_COUNTER_FLUSH_INTERVAL
+            if not due and self._timer is None:
+                self._timer = threading.Timer(settings.DOWNLOAD_COUNTER_FLUSH_INTERVAL, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            owners, self._owners = self._owners, set()
+            self._flushed_at = time.monotonic()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return
+
+        by_count = defaultdict(dict)
+        for pk, (count, at) in pending.items():
+            by_count[count][pk] = at
+
+        try:
+            with transaction.atomic():
+                for count, rows in sorted(by_count.items()):
+                    File.objects.filter(pk__in=sorted(rows)).update(
+                        download_count=F('download_count') + count,
+                        download_at=Case(*[When(pk=pk, then=Value(at)) for pk, at in rows.items()]),
+                    )
+                touch_files(*owners)
+        except DatabaseError:
+            logger.exception('Download counter flush failed, %d files kept pending', len(pending))
+            for pk, (count, at) in pending.items():
+                self.add(pk, at, count)
+            with self._lock:
+                self._owners.update(owners)
+
+    def _flush_from_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+
+download_counter = DownloadCounterBuffer()
+atexit.register(download_counter.flush)
+
+
+def record_download(pk, user_id=None, deferred=False):
+    """
+    Count one download of the file ``pk`` without rewriting the rest of the row.
+
+    ``user_id`` is the owner, whose file lists change with the counter. With ``deferred``
+    the download goes to the buffer even when ``DOWNLOAD_COUNTER_BUFFERED`` is off.
+    """
+    now = timezone.now()
+    if deferred or settings.DOWNLOAD_COUNTER_BUFFERED:
+        download_counter.add(pk, now, user_id=user_id)
+    else:
+        File.objects.filter(pk=pk).update(download_count=F('download_count') + 1, download_at=now)
+        if user_id is not None:
+            touch_files(user_id)
+
+
+async def arecord_download(pk, user_id=None, deferred=False):
+    now = timezone.now()
+    if deferred or settings.DOWNLOAD_COUNTER_BUFFERED:
+        await sync_to_async(download_counter.add)(pk, now, user_id=user_id)
+    else:
+        await File.objects.filter(pk=pk).aupdate(download_count=F('download_count') + 1, download_at=now)
+        if user_id is not None:
+            await sync_to_async(touch_files)(user_id)
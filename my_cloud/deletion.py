@@ -0,0 +1,162 @@
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+
+from .models import File, PendingDeletion
+from .storage import DEFAULT_VOLUME
+from .uploads import expire_sessions
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL = 60 * 60
+# Content blobs reused this recently may gain a reference from a transaction that is still open
+REUSE_GRACE = 10 * 60
+
+
+def iter_files(root):
+    """
+    Yield ``os.DirEntry`` objects of all regular files below ``root``.
+
+    Directories are read one at a time with ``os.scandir``, so memory use does not
+    depend on the number of files.
+    """
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except FileNotFoundError:
+            continue
+
+
+def trash_folders():
+    """
+    Return ``{volume: trash folder}``: ``MEDIA_DELETE_FOLDER`` for ``MEDIA_ROOT`` and
+    ``deleted_files/`` in the root of every other volume, so trashing never copies across disks.
+    """
+    storage = File.handle.field.storage
+    return {volume: settings.MEDIA_DELETE_FOLDER if volume == DEFAULT_VOLUME else os.path.join(root, 'deleted_files')
+            for volume, root in storage.volumes().items()}
+
+
+def move_to_trash(name, reused_since=None):
+    """
+    Move the blob ``name`` to the trash of its volume; returns False if it is already gone.
+
+    With ``reused_since``, a blob touched after that time is left in place (or moved back),
+    see ``FileSystemStorage.reuse_content``.
+    """
+    storage = File.handle.field.storage
+    path = storage.path(name)
+    folder = trash_folders()[storage.split_volume(name)[0]]
+    os.makedirs(folder, exist_ok=True)
+    target = os.path.join(folder, os.path.basename(path))
+    try:
+        if reused_since is not None and os.stat(path).st_mtime > reused_since:
+            return False
+        os.replace(path, target)
+        # Renaming onto another link of the same file, as left by reshard_blobs, does nothing
+        if os.path.exists(path) and os.path.samefile(path, target):
+            os.remove(path)
+        # An upload that touched the blob before the rename still counts on it
+        if reused_since is not None and os.stat(target).st_mtime > reused_since:
+            os.replace(target, path)
+            return False
+    except FileNotFoundError:
+        return False
+    # The retention period counts from the deletion, not from the upload
+    os.utime(target)
+    return True
+
+
+def process_pending(batch_size=100):
+    """
+    Move the blobs of one batch of queued deletions to the trash and return how many were processed.
+
+    Rows locked by another worker are skipped, blobs still referenced by a file are kept.
+    Content blobs reused within ``REUSE_GRACE`` are queued again at the end, so the upload
+    that reused them can commit its reference first.
+    """
+    storage = File.handle.field.storage
+    reused_since = time.time() - REUSE_GRACE
+    with transaction.atomic():
+        batch = list(PendingDeletion.objects.select_for_update(skip_locked=True).order_by('id')[:batch_size])
+        if not batch:
+            return 0
+        names = {row.name for row in batch}
+        referenced = set(File.objects.filter(handle__in=names).values_list('handle', flat=True))
+        requeued = [name for name in sorted(names - referenced)
+                    if not move_to_trash(name, reused_since if storage.is_content_name(name) else None)
+                    and storage.exists(name)]
+        PendingDeletion.objects.filter(pk__in=[row.pk for row in batch]).delete()
+        PendingDeletion.objects.bulk_create(PendingDeletion(name=name) for name in requeued)
+    return len(batch) - sum(row.name in requeued for row in batch)
+
+
+def purge_trash(retention_days=None):
+    """Remove trashed blobs older than ``retention_days`` and return how many were removed."""
+    if retention_days is None:
+        retention_days = settings.TRASH_RETENTION_DAYS
+    cutoff = time.time() - retention_days * 24 * 60 * 60
+    removed = 0
+    entries = (entry for folder in trash_folders().values() for entry in iter_files(folder))
+    for entry in entries:
+        try:
+            if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
+
+
+class DeletionWorker:
+    """
+    Drains the deletion queue from a daemon thread of the web process.
+
+    The thread is started by the first deletion and woken after every transaction that
+    deleted files; it purges the trash and expired upload sessions at most once per
+    ``PURGE_INTERVAL``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._thread = None
+        self._purged_at = None
+
+    def wake(self):
+        if not settings.DELETION_WORKER_THREAD:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='deletion-worker', daemon=True)
+                self._thread.start()
+        self._event.set()
+
+    def _run(self):
+        while True:
+            self._event.wait()
+            self._event.clear()
+            try:
+                while process_pending():
+                    pass
+                if self._purged_at is None or time.monotonic() - self._purged_at >= PURGE_INTERVAL:
+                    self._purged_at = time.monotonic()
+                    purge_trash()
+                    expire_sessions()
+            except (DatabaseError, OSError):
+                logger.exception('Deletion worker failed, queued deletions are kept')
+            finally:
+                connection.close()
+
+
+deletion_worker = DeletionWorker()
@@ -0,0 +1,261 @@
+import asyncio
+import base64
+import os
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+
+from .compression import accepted_encoding, open_blob
+
+
+class RangeFileIterator:
+    """Yields ``length`` bytes of an open file starting at ``offset`` in chunks, paced by ``throttle``."""
+
+    def __init__(self, file, offset, length, chunk_size, throttle=None):
+        self.file = file
+        self.offset = offset
+        self.length = length
+        self.chunk_size = chunk_size
+        self.throttle = throttle
+
+    def __iter__(self):
+        self.file.seek(self.offset)
+        remaining = self.length
+        while remaining > 0:
+            data = self.file.read(min(self.chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            if self.throttle is not None:
+                self.throttle.wait(len(data))
+            yield data
+
+    def close(self):
+        self.file.close()
+        if self.throttle is not None:
+            self.throttle.release()
+
+
+class AsyncRangeFileIterator(RangeFileIterator):
+    """Async variant for ASGI: reads run in a worker thread so the event loop never blocks on disk."""
+
+    __iter__ = None
+
+    async def __aiter__(self):
+        await asyncio.to_thread(self.file.seek, self.offset)
+        remaining = self.length
+        while remaining > 0:
+            data = await asyncio.to_thread(self.file.read, min(self.chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            if self.throttle is not None:
+                await self.throttle.await_(len(data))
+            yield data
+
+
+def parse_range(header, size):
+    """
+    Parse a ``Range: bytes=...`` header for a body of ``size`` bytes.
+
+    Returns ``(start, stop)`` with ``stop`` exclusive, or ``None`` when the header
+    should be ignored and the whole body served (missing, malformed or multi-range).
+    Raises ``ValueError`` when the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+
+    first, sep, last = spec.strip().partition('-')
+    if not sep or not (first == '' or first.isdigit()) or not (last == '' or last.isdigit()):
+        return None
+
+    if first == '':
+        if last == '':
+            return None
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError('Suffix range cannot be satisfied')
+        return max(size - suffix, 0), size
+
+    start = int(first)
+    if start >= size:
+        raise ValueError('Range start beyond end of file')
+    stop = int(last) + 1 if last else size
+    if stop <= start:
+        return None
+    return start, min(stop, size)
+
+
+def if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def file_etag(file, size, last_modified, encoding=None):
+    """
+    Strong ETag of the blob: its checksum when known, otherwise derived from name, size and mtime.
+    The compressed representation sent with ``Content-Encoding`` gets a tag of its own.
+    """
+    if file.checksum:
+        tag = file.checksum
+    else:
+        tag = f'{os.path.basename(file.handle.name)}-{size:x}-{last_modified:x}'
+    return quote_etag(f'{tag}-{encoding}' if encoding else tag)
+
+
+def digest_headers(response, file):
+    """Let clients verify the whole body with ``Digest`` (RFC 3230) and ``Repr-Digest`` (RFC 9530)."""
+    if file.checksum:
+        value = base64.b64encode(bytes.fromhex(file.checksum)).decode('ascii')
+        response['Digest'] = f'sha-256={value}'
+        response['Repr-Digest'] = f'sha-256=:{value}:'
+    return response
+
+
+def validator_headers(response, file, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if file.compression:
+        patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+def attachment_headers(response, file, etag, last_modified, encoding=None):
+    response['Content-Disposition'] = content_disposition_header(True, file.filename)
+    response['Accept-Ranges'] = 'bytes'
+    validator_headers(response, file, etag, last_modified)
+    if encoding:
+        # The digests describe the original bytes, not the encoded body
+        response['Content-Encoding'] = encoding
+        return response
+    return digest_headers(response, file)
+
+
+def serve_file(request, file, asynchronous=False, throttle=None):
+    """
+    Build a streaming response for the stored blob of ``file``.
+
+    Honours conditional requests (``If-None-Match``/``If-Modified-Since``) and single
+    ``Range``/``If-Range`` requests; the body is never read into memory as a whole.
+    With ``asynchronous`` the body is an async iterator to be served under ASGI.
+
+    Compressed blobs are sent as they are with ``Content-Encoding`` to clients that accept
+    their codec and decompressed while streaming to all others. A ``throttle`` paces the
+    body and is released when the response is closed.
+    """
+    encoding = accepted_encoding(request, file.compression)
+    decompress = bool(file.compression) and encoding is None
+    if decompress:
+        handle = open_blob(file.handle.path, file.compression)
+        stat = os.stat(file.handle.path)
+        size = file.size
+    else:
+        handle = file.handle.storage.open(file.handle.name, 'rb')
+        stat = os.fstat(handle.fileno())
+        size = stat.st_size
+    last_modified = int(stat.st_mtime)
+    etag = file_etag(file, size, last_modified, encoding)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        handle.close()
+        return validator_headers(response, file, etag, last_modified)
+
+    byte_range = None
+    if if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except ValueError:
+            handle.close()
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    # FileResponse may be sent with sendfile, which would pass the compressed bytes through
+    # and could not be throttled
+    if byte_range is None and not asynchronous and not decompress and throttle is None:
+        response = FileResponse(handle, content_type='application/octet-stream')
+        response.block_size = settings.DOWNLOAD_CHUNK_SIZE
+        response['Content-Length'] = size
+        return attachment_headers(response, file, etag, last_modified, encoding)
+
+    iterator_class = AsyncRangeFileIterator if asynchronous else RangeFileIterator
+    start, stop = byte_range or (0, size)
+    iterator = iterator_class(handle, start, stop - start, settings.DOWNLOAD_CHUNK_SIZE, throttle)
+    response = StreamingHttpResponse(iterator, content_type='application/octet-stream')
+    response['Content-Length'] = stop - start
+    if byte_range is not None:
+        response.status_code = status.HTTP_206_PARTIAL_CONTENT
+        response['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    return attachment_headers(response, file, etag, last_modified, encoding)
+
+
+def offload_file(file):
+    """
+    Hand byte serving of ``file`` over to the front proxy.
+
+    With ``DOWNLOAD_OFFLOAD = 'x-accel-redirect'`` nginx serves the blob from the internal
+    location ``DOWNLOAD_OFFLOAD_PREFIX``; with ``'x-sendfile'`` Apache/lighttpd serve the
+    absolute blob path. The proxy takes care of ranges and conditional requests.
+    """
+    response = HttpResponse(content_type='application/octet-stream')
+    match settings.DOWNLOAD_OFFLOAD:
+        case 'x-accel-redirect':
+            response['X-Accel-Redirect'] = quote(settings.DOWNLOAD_OFFLOAD_PREFIX + file.handle.name)
+        case 'x-sendfile':
+            response['X-Sendfile'] = file.handle.path
+        case offload:
+            raise ValueError(f'Unknown DOWNLOAD_OFFLOAD mode: {offload}')
+    response['Content-Disposition'] = content_disposition_header(True, file.filename)
+    return digest_headers(response, file)
+
+
+def download_response(request, file, asynchronous=False, throttle=None):
+    """
+    Serve ``file`` with its blob offloaded to the proxy or streamed by ``serve_file``.
+
+    Offloaded downloads are shaped by the proxy, ``throttle`` is released at once for them and
+    for responses without a body.
+    """
+    try:
+        # The proxy would send compressed blobs without Content-Encoding
+        if settings.DOWNLOAD_OFFLOAD and not file.compression:
+            response = offload_file(file)
+        else:
+            response = serve_file(request, file, asynchronous, throttle)
+    except Exception:
+        if throttle is not None:
+            throttle.release()
+        raise
+    if throttle is not None and not response.streaming:
+        throttle.release()
+    return response
+
+
+def requests_start(request):
+    """Whether ``request`` asks for the body from its first byte."""
+    byte_range = request.headers.get('Range', '')
+    return not byte_range or byte_range.replace(' ', '').startswith('bytes=0-')
+
+
+def is_download_start(request, response):
+    """A download is counted once per transfer, not per range request, revalidation or HEAD."""
+    if request.method == 'HEAD':
+        return False
+    if response.has_header('X-Accel-Redirect') or response.has_header('X-Sendfile'):
+        return requests_start(request)
+    if response.status_code == status.HTTP_200_OK:
+        return True
+    return (response.status_code == status.HTTP_206_PARTIAL_CONTENT
+            and response['Content-Range'].startswith('bytes 0-'))
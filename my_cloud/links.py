@@ -0,0 +1,139 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.db import models, transaction
+from django.db.models import F
+from django.dispatch import receiver
+from django.urls import reverse
+
+from .models import File, in_bulk_delete
+
+SALT = 'my_cloud.links'
+# Revision cached for files that no longer exist, revisions themselves start at 0
+GONE = -1
+
+
+class LinkExpired(Exception):
+    """The link was valid once: it expired, was revoked or used up its downloads."""
+
+
+def sign_link(file, expires_in=None, max_downloads=None):
+    """
+    Return a signed download path for ``file``.
+
+    The signed payload carries everything needed to stream the blob (id, owner, storage key,
+    name, size, checksum, codec, tier), the ``link_revision`` of the file, the expiry time
+    and the download limit, so checking it takes no database query.
+    """
+    expires_in = expires_in or settings.DOWNLOAD_LINK_MAX_AGE
+    payload = {
+        'i': file.pk, 'u': file.user_id, 'k': file.handle.name, 'n': file.filename, 's': file.size,
+        'c': file.checksum, 'z': file.compression, 't': file.tier, 'r': file.link_revision,
+        'e': int(time.time()) + expires_in if expires_in else None, 'm': max_downloads,
+    }
+    signed = signing.dumps(payload, salt=SALT, compress=True)
+    return reverse('signed-download', kwargs={'signed': signed})
+
+
+def load_link(signed):
+    """
+    Return the payload of a signed link that may be served.
+
+    Raises ``signing.BadSignature`` for links that were not issued here and ``LinkExpired``
+    for expired and revoked ones.
+    """
+    link = signing.loads(signed, salt=SALT)
+    if link['e'] is not None and link['e'] < time.time():
+        raise LinkExpired('Link expired')
+    if link['r'] != current_revision(link['i']):
+        raise LinkExpired('Link revoked')
+    return link
+
+
+def link_file(link):
+    """Unsaved ``File`` built from a link payload, enough to serve the blob."""
+    return File(pk=link['i'], user_id=link['u'], handle=link['k'], filename=link['n'], size=link['s'],
+                checksum=link['c'], compression=link['z'], tier=link['t'], link_revision=link['r'])
+
+
+def revision_key(pk):
+    return f'link-revision:{pk}'
+
+
+def current_revision(pk):
+    """
+    Current ``link_revision`` of the file ``pk``, or ``GONE``.
+
+    Revisions are kept in ``DOWNLOAD_LINK_CACHE`` for ``DOWNLOAD_LINK_CACHE_TTL`` seconds.
+    Revocations reach the cache of the process that made them at once and other processes
+    once their entry expires.
+    """
+    cache = caches[settings.DOWNLOAD_LINK_CACHE]
+    revision = cache.get(revision_key(pk))
+    if revision is None:
+        revision = File.objects.filter(pk=pk).values_list('link_revision', flat=True).first()
+        revision = GONE if revision is None else revision
+        cache.set(revision_key(pk), revision, settings.DOWNLOAD_LINK_CACHE_TTL)
+    return revision
+
+
+def revoke_links(*pks):
+    """Invalidate all signed links of the files ``pks`` issued so far."""
+    File.objects.filter(pk__in=pks).update(link_revision=F('link_revision') + 1)
+    forget_revisions(*pks)
+
+
+def forget_revisions(*pks):
+    """Drop the cached revisions of ``pks`` once the current transaction commits."""
+    keys = [revision_key(pk) for pk in pks]
+    transaction.on_commit(lambda: caches[settings.DOWNLOAD_LINK_CACHE].delete_many(keys))
+
+
+def downloads_key(signed):
+    return 'link-downloads:' + hashlib.sha256(signed.encode()).hexdigest()
+
+
+def count_download(signed, link):
+    """
+    Count a download of a link with a download limit; returns False once the limit is used up.
+
+    The count is kept in ``DOWNLOAD_LINK_CACHE`` until the link expires, so the limit holds
+    across processes only with a shared cache.
+    """
+    if link['m'] is None:
+        return True
+    cache = caches[settings.DOWNLOAD_LINK_CACHE]
+    key = downloads_key(signed)
+    timeout = max(int(link['e'] - time.time()), 1) if link['e'] is not None else None
+    cache.add(key, 0, timeout)
+    try:
+        downloads = cache.incr(key)
+    except ValueError:  # evicted in between
+        cache.add(key, 1, timeout)
+        downloads = 1
+    return downloads <= link['m']
+
+
+def refund_download(signed, link):
+    """Give back a download counted by ``count_download`` for a request that sent no body."""
+    if link['m'] is None:
+        return
+    try:
+        caches[settings.DOWNLOAD_LINK_CACHE].decr(downloads_key(signed))
+    except ValueError:  # evicted, nothing to give back
+        pass
+
+
+@receiver(models.signals.post_delete, sender=File)
+def forget_deleted_file(sender, instance, **kwargs):
+    if not in_bulk_delete():
+        forget_files(instance.pk)
+
+
+def forget_files(*pks):
+    """Mark the signed links of the deleted files ``pks`` gone."""
+    caches[settings.DOWNLOAD_LINK_CACHE].set_many({revision_key(pk): GONE for pk in pks},
+                                                  settings.DOWNLOAD_LINK_CACHE_TTL)
@@ -0,0 +1,220 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from itertools import cycle
+from uuid import uuid4
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from my_cloud.counters import download_counter
+from my_cloud.links import sign_link
+from my_cloud.models import File
+
+SCENARIOS = ['file_list', 'user_list', 'file_create', 'issue_link_generation', 'issue_link_download',
+             'signed_link_download']
+COMPARED = ['requests_per_second', 'latency_p50_ms', 'latency_p99_ms', 'queries_per_request']
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = ('Seed synthetic users and files into a throwaway test database and measure throughput, latency, '
+            'query count and memory of the file API and download paths')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--files', type=int, default=1000, help='Files in total, spread over the users')
+        parser.add_argument('--file-size', type=int, default=64 * 1024, help='Size of seeded and uploaded files')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+        parser.add_argument('--memory-requests', type=int, default=20,
+                            help='Requests per scenario repeated under tracemalloc for the memory high-water')
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='May be repeated, default all')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+        parser.add_argument('--compare', help='JSON results of an earlier run to print the change against')
+        parser.add_argument('--list-cache', action='store_true',
+                            help='Serve repeated list requests from the response cache instead of the database')
+        parser.add_argument('--use-current-db', action='store_true',
+                            help='Seed into the configured database inside a transaction that is rolled back, '
+                                 'instead of a temporary test database')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['files'] < 1 or options['requests'] < 1:
+            raise CommandError('--users, --files and --requests have to be positive')
+
+        media_root = tempfile.mkdtemp(prefix='benchmark-media-')
+        test_db = None
+        try:
+            if not options['use_current_db']:
+                test_db = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            with override_settings(MEDIA_ROOT=media_root, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                                   SLOW_REQUEST_SAMPLE_RATE=0, LIST_VERSIONS=options['list_cache'],
+                                   LIST_CACHE_TTL=(settings.LIST_CACHE_TTL or 30) if options['list_cache'] else 0), \
+                    transaction.atomic():
+                results = self.run_benchmarks(options)
+                # Nothing seeded is kept, its blobs are removed with media_root
+                transaction.set_rollback(True)
+        finally:
+            if test_db is not None:
+                connection.creation.destroy_test_db(test_db, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.print_comparison(json.load(f), results)
+
+    def run_benchmarks(self, options):
+        self.seed(options)
+        scenarios = options['scenario'] or SCENARIOS
+        results = {
+            'meta': self.meta(options),
+            'scenarios': {name: self.measure(name, options) for name in scenarios},
+        }
+        # Signed link downloads are counted through the buffer
+        download_counter.flush()
+        return results
+
+    def seed(self, options):
+        # Names of users left by an interrupted run cannot collide
+        prefix = f'benchmark-{uuid4().hex[:8]}'
+        self.admin = User.objects.create_superuser(f'{prefix}-admin', password='password')
+        self.users = [User.objects.create_user(f'{prefix}-user-{i}', password='password')
+                      for i in range(options['users'])]
+        self.admin_client = Client(headers={'Authorization': f'Token {Token.objects.create(user=self.admin).key}'})
+        self.user_client = Client(headers={'Authorization': f'Token {Token.objects.create(user=self.users[0]).key}'})
+
+        # All seeded rows share one blob, only the downloads read it
+        storage = File.handle.field.storage
+        content = SimpleUploadedFile('benchmark.bin', os.urandom(options['file_size']))
+        blob = storage.save('benchmark.bin', content)
+        users = cycle(self.users)
+        File.objects.bulk_create([
+            File(title=f'file {i}', filename=f'file-{i}.bin', extension='bin', size=options['file_size'],
+                 description=f'Synthetic file number {i}', handle=blob, checksum=content.checksum,
+                 user=next(users))
+            for i in range(options['files'])
+        ], batch_size=1000)
+        call_command('rebuild_usage', stdout=open(os.devnull, 'w'))
+
+        own = list(File.objects.filter(user=self.users[0]).only('id'))
+        for file in own:
+            file.token = uuid4()
+        File.objects.bulk_update(own, ['token'], batch_size=1000)
+        self.own_files = [file.pk for file in own]
+        self.signed = [sign_link(file) for file in File.objects.filter(pk__in=self.own_files)]
+
+    def request(self, name, options, step):
+        match name:
+            case 'file_list':
+                return self.user_client.get('/api/file')
+            case 'user_list':
+                return self.admin_client.get('/api/user')
+            case 'file_create':
+                upload = SimpleUploadedFile(f'upload-{step}.bin', b'u' * options['file_size'])
+                return self.user_client.post('/api/file', {
+                    'title': f'upload {step}', 'filename': upload.name, 'extension': 'bin',
+                    'size': options['file_size'], 'user': self.users[0].pk, 'handle': upload,
+                })
+            case 'issue_link_generation':
+                pk = self.own_files[step % len(self.own_files)]
+                return self.user_client.post('/api/link-generation', {'id': pk}, content_type='application/json')
+            case 'issue_link_download':
+                token = self.shared[step % len(self.shared)]
+                response = self.user_client.get(f'/download/{token}')
+                b''.join(response.streaming_content)
+                return response
+            case 'signed_link_download':
+                response = self.user_client.get(self.signed[step % len(self.signed)])
+                b''.join(response.streaming_content)
+                return response
+
+    def measure(self, name, options):
+        self.stderr.write(f'{name}: {options["requests"]} requests')
+        latencies, queries, errors = [], [], 0
+        # issue_link_generation replaces the tokens of the same files
+        self.shared = list(File.objects.filter(pk__in=self.own_files).values_list('token', flat=True))
+        self.request(name, options, -1)  # warm up caches and connections
+
+        started = time.perf_counter()
+        for step in range(options['requests']):
+            with CaptureQueriesContext(connection) as captured:
+                request_started = time.perf_counter()
+                response = self.request(name, options, step)
+                latencies.append(time.perf_counter() - request_started)
+            queries.append(len(captured))
+            errors += response.status_code >= 400
+        elapsed = time.perf_counter() - started
+
+        tracemalloc.start()
+        for step in range(options['memory_requests']):
+            self.request(name, options, options['requests'] + step)
+        _, memory_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        latencies.sort()
+        return {
+            'requests': options['requests'],
+            'errors': errors,
+            'seconds': round(elapsed, 3),
+            'requests_per_second': round(options['requests'] / elapsed, 1),
+            'latency_p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+            'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'latency_max_ms': round(latencies[-1] * 1000, 2),
+            'queries_per_request': round(sum(queries) / len(queries), 2),
+            'queries_max': max(queries),
+            'memory_peak_bytes': memory_peak,
+        }
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                    check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': f'{connection.vendor} {connection.pg_version if connection.vendor == "postgresql" else ""}'.strip(),
+            'users': options['users'],
+            'files': options['files'],
+            'file_size': options['file_size'],
+            'list_cache': options['list_cache'],
+        }
+
+    def print_comparison(self, before, after):
+        self.stderr.write(f'{"scenario":<24}' + ''.join(f'{column:>24}' for column in COMPARED))
+        for name, result in after['scenarios'].items():
+            previous = before.get('scenarios', {}).get(name)
+            if previous is None:
+                continue
+            cells = []
+            for column in COMPARED:
+                old, new = previous[column], result[column]
+                change = f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+                cells.append(f'{new} ({change})')
+            self.stderr.write(f'{name:<24}' + ''.join(f'{cell:>24}' for cell in cells))
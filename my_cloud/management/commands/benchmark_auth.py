@@ -0,0 +1,37 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from my_cloud.authentication import CachedTokenAuthentication, invalidate_token
+
+
+class Command(BaseCommand):
+    help = 'Compare per-request query count and latency of token authentication with and without the cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        with transaction.atomic():
+            user = User.objects.create_user('benchmark-auth-user')
+            token = Token.objects.create(user=user)
+            request = RequestFactory().get('/api/file', HTTP_AUTHORIZATION=f'Token {token.key}')
+
+            for backend in (TokenAuthentication(), CachedTokenAuthentication()):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    for _ in range(count):
+                        backend.authenticate(request)
+                    elapsed = time.perf_counter() - started
+                self.stdout.write(f'{type(backend).__name__:<28} {len(queries) / count:6.3f} queries/request '
+                                  f'{elapsed / count * 1e6:9.1f} us/request')
+
+            invalidate_token(token.key)
+            transaction.set_rollback(True)
@@ -0,0 +1,40 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from my_cloud.caching import touch_users
+from my_cloud.models import File, UserUsage
+
+
+class Command(BaseCommand):
+    help = 'Recalculate per-user storage usage from the File table'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            missing = User.objects.filter(usage__isnull=True).values_list('id', flat=True)
+            UserUsage.objects.bulk_create([UserUsage(user_id=user_id) for user_id in missing], batch_size=1000)
+
+            # Locking the usage rows holds back concurrent accounting until the new totals are written
+            usage = {row.user_id: row for row in UserUsage.objects.select_for_update()}
+            stored = {user_id: (row.files, row.bytes) for user_id, row in usage.items()}
+            for row in usage.values():
+                row.files, row.bytes, row.stored_bytes, row.extensions = 0, 0, 0, {}
+
+            rows = File.objects.values('user_id', 'extension').annotate(files=Count('id'), bytes=Sum('size'),
+                                                                       stored_bytes=Sum('stored_size'))
+            for row in rows:
+                user_usage = usage[row['user_id']]
+                user_usage.files += row['files']
+                user_usage.bytes += row['bytes'] or 0
+                user_usage.stored_bytes += row['stored_bytes'] or 0
+                user_usage.extensions[row['extension']] = {'files': row['files'], 'bytes': row['bytes'] or 0}
+
+            UserUsage.objects.bulk_update(usage.values(), ['files', 'bytes', 'stored_bytes', 'extensions'], batch_size=1000)
+            touch_users(*usage)
+
+        changed = [user_id for user_id, row in usage.items() if stored[user_id] != (row.files, row.bytes)]
+        for user_id in changed:
+            self.stdout.write(f'user {user_id}: {stored[user_id][0]} files, {stored[user_id][1]} bytes -> '
+                              f'{usage[user_id].files} files, {usage[user_id].bytes} bytes')
+        self.stdout.write(self.style.SUCCESS(f'Usage rebuilt for {len(usage)} users, {len(changed)} corrected'))
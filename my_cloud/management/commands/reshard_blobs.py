@@ -0,0 +1,108 @@
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from my_cloud.caching import touch_files
+from my_cloud.deletion import process_pending
+from my_cloud.models import File, PendingDeletion
+from my_cloud.previews import discard_previews
+from my_cloud.storage import DEFAULT_VOLUME, VOLUME_FOLDER, volume_prefix
+
+logger = logging.getLogger(__name__)
+
+FLAT_NAME_RE = r'^(volumes/[^/]+/)?user_files/[^/]+$'
+
+
+def copy_blob(storage, name, target):
+    """
+    Place the blob ``name`` at ``target`` without removing it; returns False if it is missing.
+
+    Blobs are hard linked on the same volume and copied through a temporary file
+    otherwise, so an interrupted run never leaves a partial blob under ``target``.
+    """
+    path, target_path = storage.path(name), storage.path(target)
+    if os.path.exists(target_path):
+        return True
+    if not os.path.exists(path):
+        logger.error('Blob %s is missing', name)
+        return False
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    if storage.split_volume(name)[0] == storage.split_volume(target)[0]:
+        try:
+            os.link(path, target_path)
+        except FileExistsError:
+            pass
+    else:
+        temp = f'{target_path}.tmp'
+        shutil.copy2(path, temp)
+        os.replace(temp, target_path)
+    return True
+
+
+class Command(BaseCommand):
+    help = ('Move blobs from the flat user_files/ folder to the ab/cd/ layout, or with --volume to another '
+            'storage volume, rewriting the file handles batch by batch. Interrupted runs resume where they stopped')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--volume', help='Move all blobs to this volume, "default" is MEDIA_ROOT')
+        parser.add_argument('--workers', type=int, default=4, help='Blobs moved in parallel')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        storage = File.handle.field.storage
+        volume = options['volume']
+        if volume is not None and volume not in storage.volumes():
+            raise CommandError(f'Unknown volume {volume}, expected one of {", ".join(storage.volumes())}')
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size have to be positive')
+
+        # Rows are picked by their current handle, so a new run continues with what is left
+        queryset = File.objects.exclude(handle='').exclude(handle__isnull=True)
+        if volume is None:
+            queryset = queryset.filter(handle__regex=FLAT_NAME_RE)
+        elif volume == DEFAULT_VOLUME:
+            queryset = queryset.filter(handle__startswith=VOLUME_FOLDER)
+        else:
+            queryset = queryset.exclude(handle__startswith=volume_prefix(volume))
+
+        last_id = moved = failed = 0
+        with ThreadPoolExecutor(options['workers'], thread_name_prefix='reshard') as executor:
+            while rows := list(queryset.filter(id__gt=last_id).order_by('id')
+                               .values_list('id', 'user_id', 'handle')[:options['batch_size']]):
+                last_id = rows[-1][0]
+                targets = {name: self.target_name(storage, name, volume) for name in {row[2] for row in rows}}
+                copied = dict(zip(targets, executor.map(lambda name: copy_blob(storage, name, targets[name]),
+                                                        targets)))
+                done = {name: target for name, target in targets.items() if copied[name]}
+                failed += len(targets) - len(done)
+                self.rewrite_handles(done, [row for row in rows if row[2] in done])
+                moved += len(done)
+                self.stdout.write(f'{moved} blobs moved, {failed} missing, up to file {last_id}')
+
+        while process_pending():
+            pass
+        self.stdout.write(self.style.SUCCESS(f'{moved} blobs moved, {failed} missing'))
+
+    def target_name(self, storage, name, volume):
+        source_volume, _ = storage.split_volume(name)
+        filename = os.path.basename(name)
+        if storage.is_content_name(name):
+            return storage.content_name(filename, volume or source_volume)
+        return storage.blob_name(volume or source_volume, filename)
+
+    def rewrite_handles(self, targets, rows):
+        if not targets:
+            return
+        storage = File.handle.field.storage
+        with transaction.atomic():
+            for name, target in targets.items():
+                File.objects.filter(handle=name).update(handle=target, tier=storage.tier_of(target))
+            # The old names go through the deletion queue, which keeps blobs that are still referenced
+            PendingDeletion.objects.bulk_create([PendingDeletion(name=name) for name in targets])
+            touch_files(*{row[1] for row in rows})
+            pks = [row[0] for row in rows]
+            transaction.on_commit(lambda: discard_previews(pks))
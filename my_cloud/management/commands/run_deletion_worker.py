@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from my_cloud.deletion import process_pending, purge_trash
+from my_cloud.uploads import expire_sessions
+
+
+class Command(BaseCommand):
+    help = ('Move blobs of deleted files to the trash, purge trash older than TRASH_RETENTION_DAYS and remove '
+            'upload sessions idle for UPLOAD_SESSION_MAX_AGE_DAYS')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the queue, purge the trash and exit')
+        parser.add_argument('--interval', type=float, default=10.0, help='Seconds between queue polls')
+        parser.add_argument('--purge-interval', type=float, default=3600.0, help='Seconds between trash purges')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--retention-days', type=int, default=None)
+
+    def handle(self, *args, **options):
+        purged_at = None
+        while True:
+            processed = 0
+            while batch := process_pending(options['batch_size']):
+                processed += batch
+            if processed:
+                self.stdout.write(f'{processed} queued deletions processed')
+
+            if purged_at is None or time.monotonic() - purged_at >= options['purge_interval']:
+                purged_at = time.monotonic()
+                removed = purge_trash(options['retention_days'])
+                if removed:
+                    self.stdout.write(f'{removed} blobs purged from the trash')
+                expired = expire_sessions()
+                if expired:
+                    self.stdout.write(f'{expired} idle upload sessions removed')
+
+            if options['once']:
+                return
+            time.sleep(options['interval'])
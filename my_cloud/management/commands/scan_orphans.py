@@ -0,0 +1,54 @@
+import os
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from my_cloud.deletion import iter_files, move_to_trash
+from my_cloud.models import File, PendingDeletion, UploadSession
+from my_cloud.storage import volume_prefix
+
+
+class Command(BaseCommand):
+    help = (f'Find blobs in {settings.MEDIA_USER_FOLDER} of every storage volume that no file, upload or '
+            f'queued deletion refers to')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--move', action='store_true', help='Move orphaned blobs to the trash')
+        parser.add_argument('--min-age', type=float, default=24.0,
+                            help='Ignore blobs modified less than this many hours ago')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        storage = File.handle.field.storage
+        cutoff = time.time() - options['min_age'] * 60 * 60
+        entries = ((volume_prefix(volume), root, entry) for volume, root in storage.volumes().items()
+                   for entry in iter_files(os.path.join(root, settings.MEDIA_USER_FOLDER)))
+
+        scanned = orphans = size = 0
+        while batch := list(islice(entries, options['batch_size'])):
+            scanned += len(batch)
+            names = {}
+            for prefix, root, entry in batch:
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                # Fresh blobs may belong to uploads whose rows are not committed yet
+                if stat.st_mtime < cutoff:
+                    names[prefix + os.path.relpath(entry.path, root).replace(os.sep, '/')] = stat.st_size
+
+            known = set(File.objects.filter(handle__in=names).values_list('handle', flat=True))
+            known.update(UploadSession.objects.filter(name__in=names).values_list('name', flat=True))
+            known.update(PendingDeletion.objects.filter(name__in=names).values_list('name', flat=True))
+
+            for name in sorted(names.keys() - known):
+                orphans += 1
+                size += names[name]
+                self.stdout.write(name)
+                if options['move']:
+                    move_to_trash(name)
+
+        action = 'moved to the trash' if options['move'] else 'found'
+        self.stdout.write(self.style.SUCCESS(f'{scanned} blobs scanned, {orphans} orphans ({size} bytes) {action}'))
@@ -0,0 +1,102 @@
+import hashlib
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import groupby
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from my_cloud.caching import touch_files
+from my_cloud.compression import DECOMPRESSION_ERRORS, open_blob
+from my_cloud.models import File
+from my_cloud.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+def read_checksum(storage, name, compression, bucket, chunk_size):
+    """
+    SHA-256 of the original bytes of a stored blob read at the pace of ``bucket``; ``None`` if
+    the blob is missing and ``''`` if it cannot be decompressed.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open_blob(storage.path(name), compression) as f:
+            while data := f.read(chunk_size):
+                if bucket is not None:
+                    bucket.wait(len(data))
+                digest.update(data)
+    except FileNotFoundError:
+        return None
+    except DECOMPRESSION_ERRORS:
+        return ''
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = 'Re-read stored blobs in parallel at a bounded rate and compare them with the checksums of their files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Blobs read in parallel')
+        parser.add_argument('--rate', type=float, default=20.0,
+                            help='Read rate of all workers together in MiB/s, 0 for no limit')
+        parser.add_argument('--after', default='', help='Resume after this blob name, as printed by a previous run')
+        parser.add_argument('--fill-missing', action='store_true',
+                            help='Store the checksum of files that have none yet')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers has to be positive')
+        storage = File.handle.field.storage
+        chunk_size = settings.DOWNLOAD_CHUNK_SIZE
+        rate = options['rate'] * 1024 * 1024
+        bucket = TokenBucket(rate, max(rate, chunk_size)) if rate > 0 else None
+
+        rows = (File.objects.exclude(handle='').exclude(handle__isnull=True)
+                .filter(handle__gt=options['after'])
+                .order_by('handle').values_list('handle', 'checksum', 'compression').distinct()
+                .iterator(chunk_size=options['batch_size']))
+        # Rows sharing a blob share its compression as well
+        blobs = ((name, list(group)) for name, group in groupby(rows, lambda row: row[0]))
+
+        self.counts = dict.fromkeys(('verified', 'filled', 'unchecked', 'corrupt', 'missing'), 0)
+        self.fill_missing = options['fill_missing']
+        # Only a few blobs are queued ahead of the workers, so memory stays flat on any table size
+        with ThreadPoolExecutor(options['workers'], thread_name_prefix='scrub') as executor:
+            pending = {}
+            for name, group in blobs:
+                future = executor.submit(read_checksum, storage, name, group[0][2], bucket, chunk_size)
+                pending[future] = (name, {checksum for _, checksum, _ in group})
+                if len(pending) >= options['workers'] * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.report(*pending.pop(future), future.result())
+            for future in list(pending):
+                self.report(*pending.pop(future), future.result())
+
+        if self.counts['filled']:
+            touch_files()
+        summary = ', '.join(f'{count} {state}' for state, count in self.counts.items())
+        if self.counts['corrupt'] or self.counts['missing']:
+            raise CommandError(f'Blob check failed: {summary}')
+        self.stdout.write(self.style.SUCCESS(f'Blobs checked: {summary}'))
+
+    def report(self, name, expected, actual):
+        expected.discard('')
+        if actual is None:
+            self.counts['missing'] += 1
+            logger.error('Blob %s is missing', name)
+            self.stdout.write(f'missing {name}')
+        elif actual == '':
+            self.counts['corrupt'] += 1
+            logger.error('Blob %s cannot be decompressed', name)
+            self.stdout.write(f'corrupt {name}')
+        elif expected and expected != {actual}:
+            self.counts['corrupt'] += 1
+            logger.error('Blob %s has checksum %s, expected %s', name, actual, ', '.join(sorted(expected)))
+            self.stdout.write(f'corrupt {name}')
+        elif self.fill_missing and File.objects.filter(handle=name, checksum='').update(checksum=actual):
+            self.counts['filled'] += 1
+        else:
+            self.counts['verified' if expected else 'unchecked'] += 1
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from my_cloud.deletion import process_pending
+from my_cloud.storage import COLD_TIER
+from my_cloud.tiering import cold_volume, copy_to_tier, idle_files, switch_blob
+
+
+class Command(BaseCommand):
+    help = ('Move files that were not downloaded for --days days to the STORAGE_COLD_VOLUME, compressed with '
+            'STORAGE_COLD_COMPRESSION. Meant to run periodically; interrupted runs resume where they stopped')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            help='Days without downloads before a file is moved, default STORAGE_COLD_AFTER_DAYS')
+        parser.add_argument('--workers', type=int, default=2, help='Blobs moved in parallel')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        cold_volume()
+        days = options['days'] if options['days'] is not None else settings.STORAGE_COLD_AFTER_DAYS
+        if days < 0:
+            raise CommandError('--days cannot be negative')
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size have to be positive')
+
+        # Moved rows leave the hot tier, so a new run continues with what is left
+        queryset = idle_files(days)
+        last_id = moved = failed = 0
+        with ThreadPoolExecutor(options['workers'], thread_name_prefix='tiering') as executor:
+            while rows := list(queryset.filter(id__gt=last_id).order_by('id')
+                               .values_list('id', 'handle', 'extension', 'compression')[:options['batch_size']]):
+                last_id = rows[-1][0]
+                blobs = {name: (extension, compression) for _, name, extension, compression in rows}
+                # Blobs are copied in parallel, the rows are switched over by this thread
+                copies = executor.map(lambda name: copy_to_tier(name, *blobs[name], COLD_TIER), blobs)
+                for name, copy in zip(blobs, copies):
+                    if copy is None:
+                        failed += 1
+                    else:
+                        switch_blob(name, COLD_TIER, *copy)
+                        moved += 1
+                self.stdout.write(f'{moved} blobs moved, {failed} failed, up to file {last_id}')
+
+        while process_pending():
+            pass
+        self.stdout.write(self.style.SUCCESS(f'{moved} blobs moved to the cold tier, {failed} failed'))
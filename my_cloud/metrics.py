@@ -0,0 +1,257 @@
+import hmac
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseNotFound
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = tuple(4 ** power for power in range(4, 16))  # 256 B .. 1 GiB
+# Any other method sent by a client is counted as "other", so it cannot add label values
+HTTP_METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'))
+
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(names, values, extra=''):
+    labels = ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values))
+    return '{' + ','.join(part for part in (labels, extra) if part) + '}'
+
+
+class Histogram:
+    """Thread-safe histogram series keyed by label values, rendered in the Prometheus text format."""
+
+    def __init__(self, name, documentation, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                bucket = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{format_labels(self.labels, labels, bucket)} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, labels)} {total}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, labels)} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def inc(self, labels, value=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            series = sorted(self._series.items())
+        for labels, value in series:
+            lines.append(f'{self.name}{format_labels(self.labels, labels)} {value}')
+        return lines
+
+
+REQUEST_LABELS = ('view', 'method')
+
+requests_total = Counter('http_requests_total', 'Requests by view, method and status.',
+                         REQUEST_LABELS + ('status',))
+request_duration = Histogram('http_request_duration_seconds', 'Time until the response headers are ready.',
+                             REQUEST_LABELS, LATENCY_BUCKETS)
+request_queries = Histogram('http_request_db_queries', 'Database queries per request.',
+                            REQUEST_LABELS, QUERY_BUCKETS)
+request_db_duration = Histogram('http_request_db_duration_seconds', 'Time spent in database queries per request.',
+                                REQUEST_LABELS, LATENCY_BUCKETS)
+request_size = Histogram('http_request_size_bytes', 'Request body size.', REQUEST_LABELS, SIZE_BUCKETS)
+response_size = Histogram('http_response_size_bytes', 'Response body size, streamed bodies once fully sent.',
+                          REQUEST_LABELS, SIZE_BUCKETS)
+
+METRICS = (requests_total, request_duration, request_queries, request_db_duration, request_size, response_size)
+
+
+def render_metrics():
+    return '\n'.join(line for metric in METRICS for line in metric.render()) + '\n'
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# Context variables follow the request into sync_to_async threads, unlike per-connection state
+current_stats = ContextVar('current_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - start
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    actions = getattr(match.func, 'actions', None)
+    if actions:
+        return actions.get(request.method.lower(), match.func.__name__)
+    return match.func.__name__
+
+
+def method_label(request):
+    return request.method if request.method in HTTP_METHODS else 'other'
+
+
+def count_bytes(iterator, done):
+    sent = 0
+    try:
+        for chunk in iterator:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        done(sent)
+
+
+async def acount_bytes(iterator, done):
+    sent = 0
+    try:
+        async for chunk in iterator:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        done(sent)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records latency, database queries and time, body sizes and status of every request,
+    labelled by view (the viewset action or view function name).
+
+    Requests slower than ``SLOW_REQUEST_THRESHOLD`` seconds are logged for a
+    ``SLOW_REQUEST_SAMPLE_RATE`` share of them.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, start = RequestStats(), time.perf_counter()
+        token = current_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.record(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats, start = RequestStats(), time.perf_counter()
+        token = current_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.record(request, response, stats, time.perf_counter() - start)
+
+    def record(self, request, response, stats, duration):
+        labels = (view_name(request), method_label(request))
+        requests_total.inc(labels + (str(response.status_code),))
+        request_duration.observe(labels, duration)
+        request_queries.observe(labels, stats.queries)
+        request_db_duration.observe(labels, stats.db_time)
+        try:
+            request_size.observe(labels, int(request.META.get('CONTENT_LENGTH') or 0))
+        except ValueError:
+            pass
+
+        if response.has_header('Content-Length'):
+            response_size.observe(labels, int(response['Content-Length']))
+        elif not response.streaming:
+            response_size.observe(labels, len(response.content))
+        else:
+            done = lambda sent: response_size.observe(labels, sent)
+            if response.is_async:
+                response.streaming_content = acount_bytes(response.streaming_content, done)
+            else:
+                response.streaming_content = count_bytes(response.streaming_content, done)
+
+        if duration >= settings.SLOW_REQUEST_THRESHOLD and random.random() < settings.SLOW_REQUEST_SAMPLE_RATE:
+            logger.warning('Slow request %s %s (%s): %d in %.3fs, %d queries in %.3fs',
+                           request.method, request.get_full_path(), labels[0], response.status_code,
+                           duration, stats.queries, stats.db_time)
+        else:
+            logger.debug('%s %s (%s): %d in %.3fs, %d queries', request.method, request.get_full_path(),
+                         labels[0], response.status_code, duration, stats.queries)
+        return response
+
+
+def metrics_allowed(request):
+    """
+    Check the bearer token when ``METRICS_TOKEN`` is set, the client address otherwise.
+
+    Behind a proxy ``REMOTE_ADDR`` is the proxy (or empty for a unix socket), so the address
+    list cannot tell scrapers from other clients there.
+    """
+    if settings.METRICS_TOKEN:
+        expected = f'Bearer {settings.METRICS_TOKEN}'.encode()
+        return hmac.compare_digest(request.headers.get('Authorization', '').encode(), expected)
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics_view(request):
+    if not metrics_allowed(request):
+        return HttpResponseNotFound()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
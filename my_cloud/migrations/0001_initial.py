@@ -0,0 +1,54 @@
+# Generated by Django 5.0.4 on 2026-10-18 01:34
+
+import django.db.models.deletion
+import my_cloud.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSettings',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='settings', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('color_theme', models.CharField(choices=[('dark', 'DARK'), ('light', 'LIGHT')], default='dark')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'User settings',
+                'verbose_name_plural': 'User setings',
+            },
+        ),
+        migrations.CreateModel(
+            name='File',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=100)),
+                ('filename', models.CharField(default='', max_length=255)),
+                ('extension', models.CharField(default='')),
+                ('size', models.BigIntegerField(default=0)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('handle', models.FileField(blank=True, max_length=255, null=True, storage=my_cloud.models.UUIDFileStorage(), upload_to='')),
+                ('url', models.CharField(blank=True, null=True, unique=True)),
+                ('download_count', models.IntegerField(default=0)),
+                ('download_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='file', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'File',
+                'verbose_name_plural': 'Files',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_cloud', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='token',
+            field=models.UUIDField(blank=True, null=True, unique=True),
+        ),
+    ]
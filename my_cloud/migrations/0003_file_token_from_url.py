@@ -0,0 +1,35 @@
+from uuid import UUID
+
+from django.db import migrations
+
+
+def token_from_url(apps, schema_editor):
+    File = apps.get_model('my_cloud', 'File')
+    files = []
+    for file in File.objects.filter(url__isnull=False).only('id', 'url').iterator():
+        try:
+            file.token = UUID(file.url.rstrip('/').rsplit('/', 1)[-1])
+        except ValueError:
+            continue
+        files.append(file)
+    File.objects.bulk_update(files, ['token'], batch_size=1000)
+
+
+def url_from_token(apps, schema_editor):
+    File = apps.get_model('my_cloud', 'File')
+    files = []
+    for file in File.objects.filter(token__isnull=False).only('id', 'token').iterator():
+        file.url = f'/download/{file.token}'
+        files.append(file)
+    File.objects.bulk_update(files, ['url'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_cloud', '0002_file_token'),
+    ]
+
+    operations = [
+        migrations.RunPython(token_from_url, url_from_token),
+    ]
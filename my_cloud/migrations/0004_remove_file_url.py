@@ -0,0 +1,17 @@
+# Generated by Django 5.0.4 on 2026-10-18 01:36
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_cloud', '0003_file_token_from_url'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='file',
+            name='url',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.4 on 2026-10-18 01:39
+
+import my_cloud.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_cloud', '0005_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='handle',
+            field=models.FileField(blank=True, db_index=True, max_length=255, null=True, storage=my_cloud.storage.UUIDFileStorage(), upload_to=''),
+        ),
+    ]
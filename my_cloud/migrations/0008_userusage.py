@@ -0,0 +1,48 @@
+# Generated by Django 5.0.4 on 2026-10-18 01:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def create_usage(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    File = apps.get_model('my_cloud', 'File')
+    UserUsage = apps.get_model('my_cloud', 'UserUsage')
+
+    usage = {user_id: UserUsage(user_id=user_id) for user_id in User.objects.values_list('id', flat=True)}
+    rows = File.objects.values('user_id', 'extension').annotate(files=Count('id'), bytes=Sum('size'))
+    for row in rows:
+        user_usage = usage[row['user_id']]
+        user_usage.files += row['files']
+        user_usage.bytes += row['bytes'] or 0
+        user_usage.extensions[row['extension']] = {'files': row['files'], 'bytes': row['bytes'] or 0}
+    UserUsage.objects.bulk_create(usage.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('my_cloud', '0007_file_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserUsage',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='usage', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('bytes', models.BigIntegerField(default=0)),
+                ('files', models.IntegerField(default=0)),
+                ('extensions', models.JSONField(default=dict)),
+                ('quota', models.BigIntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'User usage',
+                'verbose_name_plural': 'User usage',
+            },
+        ),
+        migrations.RunPython(create_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.0.4 on 2026-10-18 02:00
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import DatabaseError, migrations, transaction
+
+SEARCH_TRIGGER = '''
+CREATE FUNCTION my_cloud_file_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('simple', regexp_replace(coalesce(NEW.filename, ''), '[._-]+', ' ', 'g')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(NEW.extension, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER my_cloud_file_search_vector
+    BEFORE INSERT OR UPDATE OF title, filename, extension, description ON my_cloud_file
+    FOR EACH ROW EXECUTE FUNCTION my_cloud_file_search_vector();
+
+UPDATE my_cloud_file SET title = title;
+'''
+
+DROP_SEARCH_TRIGGER = '''
+DROP TRIGGER my_cloud_file_search_vector ON my_cloud_file;
+DROP FUNCTION my_cloud_file_search_vector();
+'''
+
+
+def create_trigram_index(apps, schema_editor):
+    # pg_trgm is optional: without it filename matching falls back to a sequential icontains scan
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            schema_editor.execute('CREATE INDEX file_filename_trgm_idx ON my_cloud_file '
+                                  'USING gin (filename gin_trgm_ops)')
+    except DatabaseError:
+        pass
+
+
+def drop_trigram_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS file_filename_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_cloud', '0009_pendingdeletion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='file_search_idx'),
+        ),
+        migrations.RunSQL(SEARCH_TRIGGER, DROP_SEARCH_TRIGGER),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
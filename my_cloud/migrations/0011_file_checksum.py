@@ -0,0 +1,24 @@
+# Generated by Django 5.0.4 on 2026-10-18 02:10
+
+import my_cloud.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_cloud', '0010_file_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='checksum',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='handle',
+            field=my_cloud.storage.ChecksumFileField(blank=True, db_index=True, max_length=255, null=True, storage=my_cloud.storage.UUIDFileStorage(), upload_to=''),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.4 on 2026-10-18 02:24
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_stored_size(apps, schema_editor):
+    # Blobs written so far are uncompressed
+    apps.get_model('my_cloud', 'File').objects.update(stored_size=F('size'))
+    apps.get_model('my_cloud', 'UserUsage').objects.update(stored_bytes=F('bytes'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_cloud', '0011_file_checksum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='compression',
+            field=models.CharField(blank=True, default='', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='stored_size',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userusage',
+            name='stored_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_stored_size, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 02:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_cloud', '0012_file_compression'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='tier',
+            field=models.CharField(choices=[('hot', 'Hot'), ('cold', 'Cold')], default='hot', editable=False, max_length=4),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 02:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('my_cloud', '0013_file_tier'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='link_revision',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
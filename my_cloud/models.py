@@ -1,18 +1,41 @@
 import os
+from contextlib import contextmanager
+from contextvars import ContextVar
 from uuid import uuid4
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.core.files.storage import FileSystemStorage
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
 from django.dispatch import receiver
+from django.urls import reverse
 
-from diploma.settings import MEDIA_USER_FOLDER, MEDIA_DELETE_FOLDER
+from .storage import COLD_TIER, HOT_TIER, ChecksumFileField, UUIDFileStorage
 
 
-class UUIDFileStorage(FileSystemStorage):
-    def get_available_name(self, name, max_length=None):
-        _, ext = os.path.splitext(name)
-        return MEDIA_USER_FOLDER + str(uuid4()) + ext
+# Set by bulk_delete(): post_delete receivers of File leave their work to the bulk operation
+_bulk_delete = ContextVar('bulk_delete', default=False)
+
+
+@contextmanager
+def bulk_delete():
+    """Delete files without the per-row work of the ``post_delete`` receivers, which the caller does in bulk."""
+    token = _bulk_delete.set(True)
+    try:
+        yield
+    finally:
+        _bulk_delete.reset(token)
+
+
+def in_bulk_delete():
+    return _bulk_delete.get()
+
+
+class FileManager(models.Manager):
+    def get_queryset(self):
+        # The search vector is maintained and read by the database only
+        return super().get_queryset().defer('search_vector')
 
 
 class File(models.Model):
@@ -21,31 +44,198 @@ class File(models.Model):
     extension = models.CharField(default='')
     size = models.BigIntegerField(default=0)
     description = models.TextField(null=True, blank=True)
-    handle = models.FileField(storage=UUIDFileStorage() , null=True, blank=True, max_length=255)
-    url = models.CharField(unique=True, null=True, blank=True)
+    handle = ChecksumFileField(storage=UUIDFileStorage() , null=True, blank=True, max_length=255, db_index=True)
+    token = models.UUIDField(unique=True, null=True, blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, to_field='id', related_name='file')
     download_count = models.IntegerField(default=0)
     download_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Filled by the my_cloud_file_search_vector trigger from title, filename, extension and description
+    search_vector = SearchVectorField(null=True, editable=False)
+    # SHA-256 of the blob, written by the storage while saving it; empty for rows from before it was kept
+    checksum = models.CharField(default='', blank=True, max_length=64, editable=False)
+    # Codec of the blob on disk ('', 'gzip', 'zstd') and its size there; size stays the original size
+    compression = models.CharField(default='', blank=True, max_length=10, editable=False)
+    stored_size = models.BigIntegerField(default=0, editable=False)
+    # Storage tier of the blob, kept on the row so listings need not look at the disk
+    tier = models.CharField(default=HOT_TIER, max_length=4, editable=False,
+                            choices=[(HOT_TIER, 'Hot'), (COLD_TIER, 'Cold')])
+    # Signed download links carry the revision they were issued for, bumping it revokes them
+    link_revision = models.IntegerField(default=0, editable=False)
+
+    objects = FileManager()
 
     class Meta:
         verbose_name = 'File'
         verbose_name_plural = 'Files'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='file_created_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='file_user_created_idx'),
+            models.Index(fields=['extension', 'created_at', 'id'], name='file_extension_created_idx'),
+            models.Index(fields=['size', 'id'], name='file_size_idx'),
+            models.Index(fields=['updated_at', 'id'], name='file_updated_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'], name='file_user_updated_idx'),
+            models.Index(fields=['title', 'id'], name='file_title_idx'),
+            models.Index(fields=['user', 'title', 'id'], name='file_user_title_idx'),
+            models.Index(fields=['created_at', 'id'], name='file_shared_created_idx',
+                         condition=models.Q(token__isnull=False)),
+            GinIndex(fields=['search_vector'], name='file_search_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def get_download_path(self):
+        if self.token is None:
+            return None
+        return reverse('download', kwargs={'uuid': self.token})
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._accounted = {name: value for name, value in zip(field_names, values)
+                               if name in ('user_id', 'extension', 'size', 'stored_size')}
+        if 'handle' in field_names:
+            instance._stored_handle = values[field_names.index('handle')] or None
+        if 'user_id' in field_names:
+            instance._stored_user_id = values[field_names.index('user_id')]
+        return instance
+
+
+@receiver(models.signals.post_save, sender=File)
+def account_file(sender, instance, created, update_fields=None, **kwargs):
+    accounted_fields = {'user', 'user_id', 'extension', 'size', 'stored_size'}
+    if update_fields is not None and accounted_fields.isdisjoint(update_fields):
+        return
+
+    current = {'user_id': instance.user_id, 'extension': instance.extension, 'size': instance.size,
+               'stored_size': instance.stored_size}
+    if created:
+        UserUsage.record(instance.user_id, instance.extension, instance.size, 1, instance.stored_size)
+    else:
+        accounted = getattr(instance, '_accounted', {})
+        if len(accounted) < len(current):
+            return
+        if accounted != current:
+            UserUsage.record(accounted['user_id'], accounted['extension'], -accounted['size'], -1,
+                             -accounted['stored_size'])
+            UserUsage.record(instance.user_id, instance.extension, instance.size, 1, instance.stored_size)
+    instance._accounted = current
+
+
+@receiver(models.signals.post_delete, sender=File)
+def release_file(sender, instance, *args, **kwargs):
+    if in_bulk_delete():
+        return
+    UserUsage.record(instance.user_id, instance.extension, -instance.size, -1, -instance.stored_size)
+
 
 @receiver(models.signals.post_delete, sender=File)
 def delete_file(sender, instance, *args, **kwargs):
-    if not instance.handle:
+    if not instance.handle or in_bulk_delete():
         return
-    path = instance.handle.path
-    if not os.path.exists(MEDIA_DELETE_FOLDER):
-        os.makedirs(MEDIA_DELETE_FOLDER)
+    # The blob is moved to the trash by the deletion worker once the transaction commits
+    PendingDeletion.objects.create(name=instance.handle.name)
+    from .deletion import deletion_worker
+    transaction.on_commit(deletion_worker.wake)
+
+
+class PendingDeletion(models.Model):
+    name = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Pending deletion'
+        verbose_name_plural = 'Pending deletions'
+
+    def __str__(self):
+        return self.name
+
+
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, to_field='id', related_name='uploads')
+    title = models.CharField(null=False, max_length=100)
+    filename = models.CharField(default='', max_length=255)
+    extension = models.CharField(default='')
+    size = models.BigIntegerField(default=0)
+    description = models.TextField(null=True, blank=True)
+    name = models.CharField(default='', max_length=255)
+    received = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Upload session'
+        verbose_name_plural = 'Upload sessions'
+
+    def __str__(self):
+        return self.filename
+
+    @property
+    def path(self):
+        return File.handle.field.storage.path(self.name)
+
+    @property
+    def is_complete(self):
+        return self.received == [[0, self.size]] or (self.size == 0 and not self.received)
+
+
+@receiver(models.signals.post_delete, sender=UploadSession)
+def delete_upload_blob(sender, instance, *args, **kwargs):
+    if instance.name and os.path.exists(instance.path):
+        os.remove(instance.path)
+
+
+class UserUsage(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, to_field='id', related_name='usage')
+    bytes = models.BigIntegerField(default=0)
+    # Bytes on disk after compression, for capacity reporting; quotas count the original sizes
+    stored_bytes = models.BigIntegerField(default=0)
+    files = models.IntegerField(default=0)
+    extensions = models.JSONField(default=dict)
+    quota = models.BigIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'User usage'
+        verbose_name_plural = 'User usage'
+
+    def __str__(self):
+        return f'{self.files} files, {self.bytes} bytes'
+
+    @classmethod
+    def record(cls, user_id, extension, size, files, stored_size=0):
+        """
+        Add ``size`` bytes (``stored_size`` on disk) and ``files`` files to the usage of a user
+        inside the current transaction.
+        """
+        cls.record_many(user_id, {extension: (size, files, stored_size)})
+
+    @classmethod
+    def record_many(cls, user_id, changes):
+        """Like ``record`` for several extensions at once: ``{extension: (size, files, stored_size)}``."""
+        with transaction.atomic():
+            usage = cls.objects.select_for_update().filter(user_id=user_id).first()
+            if usage is None:
+                return
+            for extension, (size, files, stored_size) in changes.items():
+                usage.bytes += size
+                usage.stored_bytes += stored_size
+                usage.files += files
+
+                per_extension = usage.extensions.setdefault(extension, {'files': 0, 'bytes': 0})
+                per_extension['files'] += files
+                per_extension['bytes'] += size
+                if per_extension['files'] <= 0:
+                    del usage.extensions[extension]
+            usage.save()
 
-    os.replace(path, os.path.join(MEDIA_DELETE_FOLDER, os.path.basename(path)))
+    def get_quota(self):
+        if self.quota is not None:
+            return self.quota
+        return settings.USER_QUOTA_BYTES
 
 
 class UserSettings(models.Model):
@@ -70,3 +260,4 @@ class UserSettings(models.Model):
 def create_user(sender, instance, created, **kwargs):
     if created:
         UserSettings.objects.create(user_id=instance.id)
+        UserUsage.objects.create(user_id=instance.id)
@@ -0,0 +1,135 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def get_ordering(request, view):
+    """
+    Return ``(field, descending)`` from the ``ordering`` query parameter.
+
+    Only the view's ``ordering_fields`` are accepted, ``id`` is always used as the tie-breaker.
+    """
+    ordering = request.query_params.get('ordering', view.default_ordering)
+    field = ordering.lstrip('-')
+    if field not in view.ordering_fields:
+        raise ValidationError({'ordering': f'Expected one of {", ".join(view.ordering_fields)}'})
+    return field, ordering.startswith('-')
+
+
+def order_queryset(queryset, request, view):
+    field, descending = get_ordering(request, view)
+    sign = '-' if descending else ''
+    if field == 'id':
+        return queryset.order_by(sign + 'id')
+    return queryset.order_by(sign + field, sign + 'id')
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over ``(ordering field, id)``.
+
+    Every page is a single range scan starting right after the last row of the previous
+    page, so page N costs the same as page 1. Pagination is used when the client passes
+    ``limit`` or ``cursor``; plain requests keep returning the whole list.
+    """
+    cursor_query_param = 'cursor'
+    limit_query_param = 'limit'
+    default_limit = 100
+    max_limit = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.limit_query_param not in params:
+            return None
+
+        self.request = request
+        self.field, self.descending = get_ordering(request, view)
+        self.limit = self.get_limit(request)
+
+        cursor = params.get(self.cursor_query_param)
+        if cursor:
+            queryset = self.after(queryset, *self.decode_cursor(queryset, cursor))
+
+        rows = list(order_queryset(queryset, request, view)[:self.limit + 1])
+        self.has_next = len(rows) > self.limit
+        self.page = rows[:self.limit]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get(self.limit_query_param, self.default_limit))
+        except ValueError:
+            raise ValidationError({self.limit_query_param: 'Expected an integer'})
+        if limit <= 0:
+            raise ValidationError({self.limit_query_param: 'Expected a positive integer'})
+        return min(limit, self.max_limit)
+
+    def after(self, queryset, value, pk):
+        lookup = 'lt' if self.descending else 'gt'
+        if self.field == 'id':
+            return queryset.filter(**{f'id__{lookup}': pk})
+        return queryset.filter(Q(**{f'{self.field}__{lookup}': value})
+                               | Q(**{self.field: value, f'id__{lookup}': pk}))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        value = getattr(last, self.field)
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        cursor = base64.urlsafe_b64encode(json.dumps([value, last.pk]).encode()).decode()
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, queryset, cursor):
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            value = queryset.model._meta.get_field(self.field).to_python(value)
+            return value, int(pk)
+        except (TypeError, ValueError, DjangoValidationError):
+            raise ValidationError({self.cursor_query_param: 'Invalid cursor'})
+
+
+class RankedPagination(KeysetPagination):
+    """
+    Limit/offset pagination for results ordered by a computed rank, which has no index to seek.
+
+    Answers in the same ``{'next', 'results'}`` shape as ``KeysetPagination`` without counting all matches.
+    """
+    offset_query_param = 'offset'
+    default_limit = 20
+    max_limit = 100
+    max_offset = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        try:
+            self.offset = int(request.query_params.get(self.offset_query_param, 0))
+        except ValueError:
+            raise ValidationError({self.offset_query_param: 'Expected an integer'})
+        if not 0 <= self.offset <= self.max_offset:
+            raise ValidationError({self.offset_query_param: f'Expected an integer from 0 to {self.max_offset}'})
+
+        rows = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(rows) > self.limit and self.offset + self.limit <= self.max_offset
+        self.page = rows[:self.limit]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
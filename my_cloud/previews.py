@@ -0,0 +1,217 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import models, transaction
+from django.dispatch import receiver
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.urls import reverse
+from django.utils.http import quote_etag
+
+from .compression import open_blob, open_seekable_blob
+from .models import File, in_bulk_delete
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional, without it only text previews are made
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_FOLDER = 'previews/'
+IMAGE_EXTENSIONS = {'bmp', 'gif', 'jpeg', 'jpg', 'png', 'tif', 'tiff', 'webp'}
+TEXT_EXTENSIONS = {'c', 'cfg', 'conf', 'cpp', 'css', 'csv', 'go', 'h', 'html', 'ini', 'java', 'js', 'json', 'log',
+                   'md', 'py', 'rs', 'rst', 'sh', 'sql', 'toml', 'ts', 'tsv', 'txt', 'xml', 'yaml', 'yml'}
+TEXT_PREVIEW_BYTES = 4096
+RENDER_ERRORS = (OSError, ValueError) + ((Image.DecompressionBombError,) if Image is not None else ())
+
+
+def preview_kind(file):
+    """Return ``'image'``, ``'text'`` or ``None`` for files that have no preview."""
+    if not file.handle:
+        return None
+    extension = (file.extension or os.path.splitext(file.filename)[1]).lstrip('.').lower()
+    if extension in IMAGE_EXTENSIONS and Image is not None:
+        return 'image'
+    if extension in TEXT_EXTENSIONS:
+        return 'text'
+    return None
+
+
+def preview_version(file):
+    """Short tag of the blob the previews are made from, used to version preview URLs."""
+    return hashlib.sha256(file.handle.name.encode()).hexdigest()[:16]
+
+
+def preview_name(file, kind, size):
+    name = 'text' if kind == 'text' else str(size)
+    return f'{PREVIEW_FOLDER}{file.pk}/{name}-{preview_version(file)}'
+
+
+def render_image(source, target, size):
+    with open_seekable_blob(*source) as blob, Image.open(blob) as image:
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image.save(target, 'PNG', optimize=True)
+        else:
+            image.convert('RGB').save(target, 'JPEG', quality=80, optimize=True)
+
+
+def render_text(source, target):
+    with open_blob(*source) as f:
+        data = f.read(TEXT_PREVIEW_BYTES)
+    if len(data) == TEXT_PREVIEW_BYTES and b'\n' in data:
+        data = data[:data.rindex(b'\n') + 1]
+    with open(target, 'wb') as f:
+        f.write(data.decode('utf-8', errors='replace').encode('utf-8'))
+
+
+def render(source, path, kind, size):
+    """
+    Write the preview of ``source``, a ``(blob path, compression)`` pair, to ``path``; returns
+    ``path`` or ``None`` if it cannot be made.
+    """
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = f'{path}.{threading.get_ident()}.tmp'
+    try:
+        if kind == 'image':
+            render_image(source, temp, size)
+        else:
+            render_text(source, temp)
+        os.replace(temp, path)
+        return path
+    except RENDER_ERRORS as e:
+        logger.error('Preview of %s failed: %s', source[0], e)
+        return None
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+class PreviewPool:
+    """
+    Renders previews in a thread pool of ``PREVIEW_WORKERS`` workers.
+
+    Requests for a preview that is being rendered already wait for the same job.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._jobs = {}
+
+    def submit(self, source, path, kind, size):
+        with self._lock:
+            job = self._jobs.get(path)
+            if job is None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(settings.PREVIEW_WORKERS, thread_name_prefix='preview')
+                job = self._executor.submit(render, source, path, kind, size)
+                self._jobs[path] = job
+                job.add_done_callback(lambda _: self._forget(path))
+            return job
+
+    def _forget(self, path):
+        with self._lock:
+            self._jobs.pop(path, None)
+
+
+preview_pool = PreviewPool()
+
+
+def get_preview(file, size=None):
+    """Return ``(path, kind)`` of the preview of ``file``, rendering it first if needed."""
+    kind = preview_kind(file)
+    if kind is None:
+        return None, None
+    size = size or settings.PREVIEW_SIZES[0]
+    if size not in settings.PREVIEW_SIZES:
+        raise ValueError(f'Preview size has to be one of {settings.PREVIEW_SIZES}')
+
+    storage = File.handle.field.storage
+    path = storage.path(preview_name(file, kind, size))
+    if not os.path.exists(path):
+        path = preview_pool.submit((file.handle.path, file.compression), path, kind, size).result()
+    return path, kind
+
+
+def preview_response(request, file, path, kind):
+    """
+    Serve a rendered preview.
+
+    Preview URLs carry the blob version in ``v``, so a matching request may be cached for a year.
+    """
+    version = preview_version(file)
+    etag = quote_etag(os.path.basename(path))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        handle = open(path, 'rb')
+        if kind == 'text':
+            content_type = 'text/plain; charset=utf-8'
+        else:
+            content_type = 'image/png' if handle.read(4) == b'\x89PNG' else 'image/jpeg'
+            handle.seek(0)
+        response = FileResponse(handle, content_type=content_type)
+    response['ETag'] = etag
+    if request.GET.get('v') == version:
+        patch_cache_control(response, private=True, max_age=365 * 24 * 60 * 60, immutable=True)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def preview_url(request, file):
+    if preview_kind(file) is None:
+        return None
+    path = reverse('file-preview', kwargs={'pk': file.pk}) + f'?v={preview_version(file)}'
+    return request.build_absolute_uri(path) if request is not None else path
+
+
+def schedule_previews(file):
+    """Render all previews of a new or replaced blob in the background."""
+    kind = preview_kind(file)
+    if kind is None:
+        return
+    storage = File.handle.field.storage
+    for size in settings.PREVIEW_SIZES[:1] if kind == 'text' else settings.PREVIEW_SIZES:
+        path = storage.path(preview_name(file, kind, size))
+        preview_pool.submit((file.handle.path, file.compression), path, kind, size)
+
+
+def discard_previews(pks):
+    storage = File.handle.field.storage
+    for pk in pks:
+        shutil.rmtree(storage.path(f'{PREVIEW_FOLDER}{pk}'), ignore_errors=True)
+
+
+@receiver(models.signals.post_save, sender=File)
+def refresh_previews(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'handle' not in update_fields:
+        return
+    handle = instance.handle.name or None
+    if not created and getattr(instance, '_stored_handle', None) == handle:
+        return
+    instance._stored_handle = handle
+
+    pk = instance.pk
+    if not created:
+        transaction.on_commit(lambda: discard_previews([pk]))
+    if settings.PREVIEW_ON_UPLOAD:
+        transaction.on_commit(lambda: schedule_previews(instance))
+
+
+@receiver(models.signals.post_delete, sender=File)
+def delete_previews(sender, instance, **kwargs):
+    if in_bulk_delete():
+        return
+    pk = instance.pk
+    transaction.on_commit(lambda: discard_previews([pk]))
@@ -0,0 +1,27 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import UserUsage
+
+
+class QuotaExceeded(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Storage quota exceeded'
+    default_code = 'quota_exceeded'
+
+
+def check_quota(user_id, size):
+    """Raise ``QuotaExceeded`` if storing ``size`` more bytes would put the user over quota."""
+    usage = UserUsage.objects.filter(user_id=user_id).first()
+    if usage is None:
+        return
+    quota = usage.get_quota()
+    if quota and usage.bytes + size > quota:
+        raise QuotaExceeded(f'Storage quota exceeded: {usage.bytes} of {quota} bytes used')
+
+
+def request_body_size(request):
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return 0
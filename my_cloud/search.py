@@ -0,0 +1,45 @@
+import re
+from functools import cache
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connections
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce
+
+# Words as split by the search vector trigger, which also breaks filenames on '.', '_' and '-'
+WORD_RE = re.compile(r'[^\W_]+')
+SEARCH_CONFIG = 'simple'
+
+
+@cache
+def trigram_available(alias):
+    with connections[alias].cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def search_query(text):
+    """Return a query matching every word of ``text`` as a prefix, or ``None`` if it has no words."""
+    words = WORD_RE.findall(text.lower())
+    if not words:
+        return None
+    return SearchQuery(' & '.join(f"'{word}':*" for word in words), search_type='raw', config=SEARCH_CONFIG)
+
+
+def search_files(queryset, text):
+    """
+    Filter ``queryset`` to files matching ``text`` and order them by relevance.
+
+    Words are looked up in the ``search_vector`` GIN index; filenames additionally match by
+    trigram word similarity when ``pg_trgm`` is installed, or by substring otherwise.
+    """
+    query = search_query(text)
+    match = Q(search_vector=query) if query is not None else Q(pk__in=[])
+    rank = Coalesce(SearchRank(F('search_vector'), query), 0.0) if query is not None else Value(0.0)
+
+    if trigram_available(queryset.db):
+        match |= Q(filename__trigram_word_similar=text)
+        rank = rank + TrigramWordSimilarity(text, 'filename')
+    else:
+        match |= Q(filename__icontains=text)
+    return queryset.filter(match).annotate(rank=rank).order_by('-rank', '-id')
@@ -3,33 +3,59 @@ from rest_framework.fields import SerializerMethodField
 from rest_framework.serializers import Serializer, ModelSerializer, CharField
 from rest_framework.authtoken.models import Token
 
-from .models import File, UserSettings
+from .models import File, UploadSession, UserSettings
+from .previews import preview_url
 
 
 class FileSerializer(ModelSerializer):
+    url = SerializerMethodField()
+    preview = SerializerMethodField()
+
     class Meta:
         model = File
-        exclude = []
+        exclude = ['token', 'search_vector']
+
+    def get_url(self, obj):
+        path = obj.get_download_path()
+        request = self.context.get('request')
+        if path is None or request is None:
+            return path
+        return request.build_absolute_uri(path)
+
+    def get_preview(self, obj):
+        return preview_url(self.context.get('request'), obj)
+
+
+class UploadSessionSerializer(ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'title', 'filename', 'extension', 'description', 'size', 'received', 'created_at']
+        read_only_fields = ['received']
+        extra_kwargs = {'size': {'min_value': 0}}
 
 
 class UserSerializer(ModelSerializer):
     total_files = SerializerMethodField()
     total_size = SerializerMethodField()
+    total_stored_size = SerializerMethodField()
 
     class Meta:
         model = User
-        fields = ['id', 'username', 'first_name', 'last_name', 'email', 'is_superuser', 'password', 'total_files', 'total_size']
+        fields = ['id', 'username', 'first_name', 'last_name', 'email', 'is_superuser', 'password', 'total_files', 'total_size',
+                  'total_stored_size']
         extra_kwargs = {"password": {"write_only": True}}
 
     def get_total_files(self, obj):
-        return File.objects.filter(user=obj).count()
+        usage = getattr(obj, 'usage', None)
+        return usage.files if usage is not None else 0
 
     def get_total_size(self, obj):
-        from django.db.models import Sum
-        value = File.objects.filter(user=obj).aggregate(total_size=Sum('size'))['total_size']
-        if value is None:
-            return 0
-        return int(value)
+        usage = getattr(obj, 'usage', None)
+        return usage.bytes if usage is not None else 0
+
+    def get_total_stored_size(self, obj):
+        usage = getattr(obj, 'usage', None)
+        return usage.stored_bytes if usage is not None else 0
 
     def create(self, obj):
         user = User(username=obj['username'])
@@ -0,0 +1,240 @@
+import hashlib
+import logging
+import os
+import random
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File as DjangoFile
+from django.core.files.storage import FileSystemStorage
+from django.utils._os import safe_join
+from django.db import models
+from django.db.models.fields.files import FieldFile
+
+from diploma.settings import MEDIA_USER_FOLDER
+from .compression import SUFFIXES, compress_blob, compression_for, compressor
+
+logger = logging.getLogger(__name__)
+
+CONTENT_FOLDER = MEDIA_USER_FOLDER + 'cas/'
+DEFAULT_VOLUME = 'default'
+VOLUME_FOLDER = 'volumes/'
+HOT_TIER = 'hot'
+COLD_TIER = 'cold'
+# Written by the storage while saving a blob, stored on the row by ChecksumFileField
+STORED_FIELDS = ('checksum', 'compression', 'stored_size', 'tier')
+
+
+def volume_prefix(volume):
+    return '' if volume == DEFAULT_VOLUME else f'{VOLUME_FOLDER}{volume}/'
+
+
+def content_compression(name):
+    """Compression of a content addressed blob, told by the suffix of its name."""
+    for compression, suffix in SUFFIXES.items():
+        if name.endswith(suffix):
+            return compression
+    return ''
+
+
+def free_space(root):
+    try:
+        stat = os.statvfs(root)
+    except OSError as e:
+        logger.error('Storage volume %s is not available: %s', root, e)
+        return 0
+    return stat.f_bavail * stat.f_frsize
+
+
+class DigestFile(DjangoFile):
+    """Proxies an uploaded file and hashes its chunks while they are written to disk."""
+
+    def __init__(self, file, digest):
+        super().__init__(file, getattr(file, 'name', None))
+        self.digest = digest
+
+    def chunks(self, chunk_size=None):
+        for chunk in self.file.chunks(chunk_size):
+            self.digest.update(chunk)
+            yield chunk
+
+
+class CompressedFile(DjangoFile):
+    """Proxies a file and compresses its chunks while they are written to disk."""
+
+    def __init__(self, file, compression):
+        super().__init__(file, getattr(file, 'name', None))
+        self.compression = compression
+
+    def chunks(self, chunk_size=None):
+        stream = compressor(self.compression)
+        for chunk in self.file.chunks(chunk_size):
+            if data := stream.compress(chunk):
+                yield data
+        yield stream.flush()
+
+
+class UUIDFileStorage(FileSystemStorage):
+    """
+    Stores every upload under a fresh UUID name in ``MEDIA_USER_FOLDER``, fanned out into
+    ``ab/cd/`` directories by the first characters of the UUID.
+
+    Besides ``MEDIA_ROOT`` (the ``default`` volume) blobs may live on the ``STORAGE_VOLUMES``
+    roots; their names start with ``volumes/<volume>/``. New blobs go to the volume with
+    the most free space or, with ``STORAGE_PLACEMENT = 'weight'``, to a random volume
+    by ``STORAGE_VOLUME_WEIGHTS``. The ``STORAGE_COLD_VOLUME`` only holds blobs moved there
+    by ``tier_blobs``.
+
+    Uploads are hashed with SHA-256 in the same pass that writes them, and compressed on
+    the way when ``content.compress`` names a codec. The hex digest, the codec and the size
+    on disk are left in ``content`` for ``ChecksumFileField`` to store on the row. With
+    ``STORAGE_DEDUPLICATE`` enabled blobs are content addressed instead: the upload is
+    stored once under its SHA-256 digest, so identical files share one blob. File rows
+    pointing at the same name act as its reference count.
+    """
+
+    def volumes(self):
+        """Return ``{volume: root}`` of all storage volumes."""
+        return {DEFAULT_VOLUME: self.location, **settings.STORAGE_VOLUMES}
+
+    def split_volume(self, name):
+        """Return ``(volume, name inside the volume root)`` of a blob name."""
+        if name.startswith(VOLUME_FOLDER):
+            volume, _, rest = name[len(VOLUME_FOLDER):].partition('/')
+            return volume, rest
+        return DEFAULT_VOLUME, name
+
+    def path(self, name):
+        volume, rest = self.split_volume(name)
+        if volume == DEFAULT_VOLUME:
+            return super().path(name)
+        if volume not in settings.STORAGE_VOLUMES:
+            raise SuspiciousFileOperation(f'Unknown storage volume {volume}')
+        return safe_join(os.path.abspath(settings.STORAGE_VOLUMES[volume]), rest)
+
+    def name_of(self, path):
+        """Return the blob name of an absolute ``path`` on one of the volumes."""
+        path = os.path.abspath(path)
+        # Other volumes first, in case one of them is mounted below MEDIA_ROOT
+        for volume, root in sorted(self.volumes().items(), key=lambda item: item[0] == DEFAULT_VOLUME):
+            root = os.path.abspath(root)
+            if path.startswith(root + os.sep):
+                return volume_prefix(volume) + os.path.relpath(path, root).replace(os.sep, '/')
+        raise SuspiciousFileOperation(f'{path} is not on a storage volume')
+
+    def tier_of(self, name):
+        return COLD_TIER if self.split_volume(name)[0] == settings.STORAGE_COLD_VOLUME else HOT_TIER
+
+    def choose_volume(self):
+        # Only tier_blobs puts blobs on the cold volume
+        volumes = [volume for volume in self.volumes() if volume != settings.STORAGE_COLD_VOLUME]
+        if len(volumes) == 1:
+            return volumes[0]
+        match settings.STORAGE_PLACEMENT:
+            case 'free':
+                roots = self.volumes()
+                return max(volumes, key=lambda volume: free_space(roots[volume]))
+            case 'weight':
+                weights = [settings.STORAGE_VOLUME_WEIGHTS.get(volume, 1.0) for volume in volumes]
+                return random.choices(volumes, weights)[0]
+            case placement:
+                raise ValueError(f'Unknown STORAGE_PLACEMENT mode: {placement}')
+
+    def blob_name(self, volume, filename):
+        return f'{volume_prefix(volume)}{MEDIA_USER_FOLDER}{filename[:2]}/{filename[2:4]}/{filename}'
+
+    def get_available_name(self, name, max_length=None):
+        _, ext = os.path.splitext(name)
+        return self.blob_name(self.choose_volume(), f'{uuid4()}{ext}')
+
+    def content_name(self, digest, volume=DEFAULT_VOLUME, compression=''):
+        suffix = SUFFIXES.get(compression, '')
+        return f'{volume_prefix(volume)}{CONTENT_FOLDER}{digest[:2]}/{digest[2:4]}/{digest}{suffix}'
+
+    def content_names(self, digest):
+        """Names the blob with ``digest`` may have, one per volume and compression."""
+        return [self.content_name(digest, volume, compression)
+                for volume in self.volumes() for compression in ('', *SUFFIXES)]
+
+    def is_content_name(self, name):
+        return self.split_volume(name)[1].startswith(CONTENT_FOLDER)
+
+    def reuse_content(self, name):
+        """
+        Mark the content blob ``name`` as reused by a file that is not committed yet.
+
+        The deletion worker keeps blobs touched less than ``deletion.REUSE_GRACE`` seconds ago, even
+        when no file references them. Raises ``FileNotFoundError`` if the blob is gone.
+        """
+        os.utime(self.path(name))
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        compression = getattr(content, 'compress', '')
+        source = DigestFile(content, digest)
+        if compression:
+            source = CompressedFile(source, compression)
+        # FileSystemStorage returns names relative to MEDIA_ROOT, which blobs on other volumes are not
+        name = self.name_of(os.path.join(self.location, super()._save(name, source)))
+        content.checksum = digest.hexdigest()
+        content.compression = compression
+        if settings.STORAGE_DEDUPLICATE:
+            name, content.compression = self._store_content(name, content.checksum, compression)
+        content.stored_size = self.size(name)
+        content.tier = self.tier_of(name)
+        return name
+
+    def commit_upload(self, name, compression=''):
+        """
+        Finish a blob that was written in place, e.g. one assembled from upload chunks.
+
+        The blob is hashed and, with a ``compression`` codec, compressed in the same pass;
+        with ``STORAGE_DEDUPLICATE`` it is then moved to its content address. Returns
+        ``(name, checksum, compression, stored size)``.
+        """
+        digest = hashlib.sha256()
+        stored_size = compress_blob(self.path(name), compression, digest)
+        checksum = digest.hexdigest()
+        if settings.STORAGE_DEDUPLICATE:
+            name, compression = self._store_content(name, checksum, compression)
+            stored_size = self.size(name)
+        return name, checksum, compression, stored_size
+
+    def _store_content(self, name, digest, compression=''):
+        """Move a new blob to its content address; returns the name and compression of the stored blob."""
+        # Identical content is kept once even when it is on another volume or compressed differently
+        for content_name in self.content_names(digest):
+            try:
+                self.reuse_content(content_name)
+            except FileNotFoundError:
+                continue
+            os.remove(self.path(name))
+            return content_name, content_compression(content_name)
+
+        content_name = self.content_name(digest, self.split_volume(name)[0], compression)
+        content_path = self.path(content_name)
+        os.makedirs(os.path.dirname(content_path), exist_ok=True)
+        os.replace(self.path(name), content_path)
+        return content_name, compression
+
+
+class ChecksumFieldFile(FieldFile):
+    def save(self, name, content, save=True):
+        content.compress = compression_for(getattr(self.instance, 'extension', ''))
+        super().save(name, content, save=False)
+        for field in STORED_FIELDS:
+            if hasattr(content, field):
+                setattr(self.instance, field, getattr(content, field))
+        if save:
+            self.instance.save()
+
+
+class ChecksumFileField(models.FileField):
+    """
+    ``FileField`` that lets ``UUIDFileStorage`` compress new blobs by the ``extension`` of
+    the row and copies what the storage found out while writing them (``STORED_FIELDS``)
+    into the fields of the same names. These have to be declared after this field, so
+    their values are read when the blob has been written.
+    """
+    attr_class = ChecksumFieldFile
@@ -1,3 +1,1757 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import quote
+from uuid import UUID, uuid4
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .compression import zstandard
+from .counters import download_counter, record_download
+from .deletion import REUSE_GRACE, process_pending, purge_trash
+from .links import sign_link
+from .downloads import parse_range
+from .models import File, PendingDeletion, UploadSession, UserSettings, UserUsage
+from .throttling import BucketRegistry, DownloadLimited, download_throttle, slot_key
+from .tiering import move_blob
+from .uploads import allocate_blob
+from .views import issue_link_download_async, signed_link_download_async
+
+
+class MediaRootMixin:
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        media_override = override_settings(MEDIA_ROOT=self.media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+    def create_file(self, user, content=b'0123456789' * 10, filename='data.bin', **kwargs):
+        return File.objects.create(title=filename, filename=filename, size=len(content), user=user,
+                                   handle=SimpleUploadedFile(filename, content), **kwargs)
+
+
+class ParseRangeTest(TestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 10))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 100))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 100))
+        self.assertEqual(parse_range('bytes=50-500', 100), (50, 100))
+
+    def test_ignored_ranges(self):
+        self.assertIsNone(parse_range(None, 100))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 100))
+        self.assertIsNone(parse_range('items=0-1', 100))
+        self.assertIsNone(parse_range('bytes=9-1', 100))
+        self.assertIsNone(parse_range('bytes=a-b', 100))
+
+    def test_unsatisfiable_ranges(self):
+        with self.assertRaises(ValueError):
+            parse_range('bytes=100-', 100)
+        with self.assertRaises(ValueError):
+            parse_range('bytes=-0', 100)
+
+
+class IssueLinkDownloadTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', password='password')
+        self.content = bytes(range(256)) * 4
+        self.file = self.create_file(self.user, self.content, token=uuid4())
+
+    def download(self, headers=None):
+        return self.client.get(self.file.get_download_path(), headers=headers)
+
+    def test_full_download_is_streamed(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        self.assertIn('filename="data.bin"', response['Content-Disposition'])
+
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.download_count, 1)
+        self.assertIsNotNone(self.file.download_at)
+
+    def test_partial_download(self):
+        response = self.download({'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.download_count, 0)
+
+    def test_if_range_mismatch_serves_full_body(self):
+        response = self.download({'Range': 'bytes=10-19', 'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_if_range_match_serves_range(self):
+        etag = self.download()['ETag']
+        response = self.download({'Range': 'bytes=-4', 'If-Range': etag})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[-4:])
+
+    def test_unsatisfiable_range(self):
+        response = self.download({'Range': f'bytes={len(self.content)}-'})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_revalidation(self):
+        etag = self.download()['ETag']
+        response = self.download({'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.download_count, 1)
+
+    def test_head_is_not_counted(self):
+        response = self.client.head(f'/download/{self.file.token}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.download_count, 0)
+
+    def test_checksum_headers(self):
+        digest = hashlib.sha256(self.content)
+        self.assertEqual(self.file.checksum, digest.hexdigest())
+
+        response = self.download({'Range': 'bytes=10-19'})
+        self.assertEqual(response['ETag'], f'"{digest.hexdigest()}"')
+        encoded = base64.b64encode(digest.digest()).decode()
+        self.assertEqual(response['Digest'], f'sha-256={encoded}')
+        self.assertEqual(response['Repr-Digest'], f'sha-256=:{encoded}:')
+
+    def test_unknown_link(self):
+        self.assertEqual(self.client.get(f'/download/{uuid4()}').status_code, 404)
+
+
+class IssueLinkDownloadOffloadTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', password='password')
+        self.file = self.create_file(self.user, token=uuid4())
+
+    def download(self, headers=None):
+        return self.client.get(self.file.get_download_path(), headers=headers)
+
+    @override_settings(DOWNLOAD_OFFLOAD='x-accel-redirect', DOWNLOAD_OFFLOAD_PREFIX='/protected/')
+    def test_x_accel_redirect(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.file.handle.name)
+        self.assertIn('filename="data.bin"', response['Content-Disposition'])
+
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.download_count, 1)
+
+    @override_settings(DOWNLOAD_OFFLOAD='x-sendfile')
+    def test_x_sendfile(self):
+        response = self.download()
+        self.assertEqual(response['X-Sendfile'], self.file.handle.path)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    @override_settings(DOWNLOAD_OFFLOAD='x-accel-redirect')
+    def test_range_continuation_is_not_counted(self):
+        self.download({'Range': 'bytes=50-'})
+        self.download({'Range': 'bytes=0-49'})
+
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.download_count, 1)
+
+
+class IssueLinkGenerationTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', password='password')
+        self.file = self.create_file(self.user)
+        self.auth = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+
+    def test_link_is_served_on_any_host(self):
+        response = self.client.post('/api/link-generation', {'id': self.file.id},
+                                    content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.file.refresh_from_db()
+        self.assertEqual(response.json()['url'], f'http://testserver/download/{self.file.token}')
+
+        for host in ('testserver', 'cdn.example.com'):
+            download = self.client.get(f'/download/{self.file.token}', headers={'Host': host})
+            self.assertEqual(download.status_code, 200)
+
+        listing = self.client.get('/api/file', headers={'Host': 'cdn.example.com', **self.auth})
+        self.assertEqual(listing.json()[0]['url'], f'http://cdn.example.com/download/{self.file.token}')
+        self.assertNotIn('token', listing.json()[0])
+
+    def test_link_revocation(self):
+        self.file.token = uuid4()
+        self.file.save()
+        path = self.file.get_download_path()
+
+        response = self.client.delete('/api/link-generation', {'id': self.file.id},
+                                      content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.file.refresh_from_db()
+        self.assertIsNone(self.file.token)
+        self.assertEqual(self.client.get(path).status_code, 404)
+
+
+    def test_link_changes_keep_concurrent_updates(self):
+        # The file is changed by another request after the view loaded it
+        def rename_file(request, file):
+            File.objects.filter(pk=file.pk).update(title='renamed')
+
+        with mock.patch('my_cloud.views.FileView.check_object_permissions', side_effect=rename_file):
+            for method in (self.client.post, self.client.delete):
+                response = method('/api/link-generation', {'id': self.file.id},
+                                  content_type='application/json', headers=self.auth)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(File.objects.get(pk=self.file.pk).title, 'renamed')
+                File.objects.filter(pk=self.file.pk).update(title=self.file.title)
+
+@override_settings(DOWNLOAD_SIGNED_LINKS=True)
+class SignedLinkTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        self.user = User.objects.create_user('owner', password='password')
+        self.content = b'signed content'
+        self.file = self.create_file(self.user, self.content)
+        self.auth = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+        self.addCleanup(download_counter.flush)
+
+    def issue(self, **body):
+        response = self.client.post('/api/link-generation', {'id': self.file.id, **body},
+                                    content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        url = response.json()['url']
+        self.assertTrue(url.startswith('http://testserver/download/s/'))
+        return url.removeprefix('http://testserver')
+
+    def test_download_without_queries(self):
+        path = self.issue()
+        self.assertEqual(b''.join(self.client.get(path).streaming_content), self.content)
+        with self.assertNumQueries(0):
+            response = self.client.get(path)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['ETag'], f'"{self.file.checksum}"')
+
+        download_counter.flush()
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.download_count, 2)
+
+    def test_expiry_and_download_limit(self):
+        path = self.issue(max_downloads=2, expires_in=60)
+        for _ in range(2):
+            self.assertEqual(self.client.get(path).status_code, 200)
+        # Range requests resuming a download are not counted
+        self.assertEqual(self.client.get(path, headers={'Range': 'bytes=5-'}).status_code, 206)
+        self.assertEqual(self.client.get(path, headers={'Range': 'bytes=0-'}).status_code, 410)
+
+        path = self.issue(expires_in=60)
+        with mock.patch('my_cloud.links.time.time', return_value=time.time() + 61):
+            self.assertEqual(self.client.get(path).status_code, 410)
+
+        response = self.client.post('/api/link-generation', {'id': self.file.id, 'expires_in': 10 ** 9},
+                                    content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 400)
+
+    def test_head_and_revalidation_do_not_use_up_downloads(self):
+        path = self.issue(max_downloads=1)
+        response = self.client.head(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(path, headers={'If-None-Match': response['ETag']}).status_code, 304)
+
+        response = self.client.get(path)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(self.client.get(path).status_code, 410)
+
+    def test_revocation(self):
+        path = self.issue()
+        self.assertEqual(self.client.get(path[:-2] + 'xx').status_code, 404)
+
+        response = self.client.delete('/api/link-generation', {'id': self.file.id},
+                                      content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(path).status_code, 410)
+
+        path = self.issue()
+        self.file.delete()
+        self.assertEqual(self.client.get(path).status_code, 410)
+
+    def test_moved_blob_is_looked_up(self):
+        path = self.issue()
+        moved = f'user_files/{uuid4()}.bin'
+        os.replace(self.file.handle.path, File.handle.field.storage.path(moved))
+        File.objects.filter(pk=self.file.pk).update(handle=moved)
+        self.assertEqual(b''.join(self.client.get(path).streaming_content), self.content)
+
+
+class ThrottlingTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        registry = mock.patch('my_cloud.throttling.buckets', BucketRegistry())
+        registry.start()
+        self.addCleanup(registry.stop)
+        self.user = User.objects.create_user('owner', password='password')
+        self.content = os.urandom(4096)
+        self.file = self.create_file(self.user, self.content, token=uuid4())
+        self.addCleanup(download_counter.flush)
+
+    @override_settings(DOWNLOAD_CHUNK_SIZE=1024, DOWNLOAD_RATE_PER_LINK=1024)
+    def test_bandwidth_is_shaped(self):
+        response = self.client.get(f'/download/{self.file.token}')
+        self.assertTrue(response.streaming)
+
+        # The first chunk is sent from the full bucket
+        body, seconds = self.consume(response)
+        self.assertEqual(body, self.content)
+        self.assertAlmostEqual(seconds, 3, places=2)
+
+    def consume(self, response):
+        """Read a streamed body with sleeping advancing a fake clock; returns the body and the seconds slept."""
+        clock = [time.monotonic()]
+        started = clock[0]
+        with mock.patch('time.monotonic', side_effect=lambda: clock[0]), \
+                mock.patch('time.sleep', side_effect=lambda delay: clock.__setitem__(0, clock[0] + delay)):
+            body = b''.join(response.streaming_content)
+        return body, clock[0] - started
+
+    @override_settings(DOWNLOAD_RATE_PER_OWNER=1024, DOWNLOAD_RATE_GLOBAL=4096)
+    def test_owner_and_global_buckets_are_shared(self):
+        other = self.create_file(self.user, b'other')
+        stranger = self.create_file(User.objects.create_user('stranger', password='password'), b'stranger')
+        owner, total = download_throttle(self.file).buckets
+        self.assertEqual(download_throttle(other).buckets, [owner, total])
+        self.assertEqual(download_throttle(stranger).buckets[1], total)
+        self.assertIsNot(download_throttle(stranger).buckets[0], owner)
+
+        with override_settings(DOWNLOAD_RATE_PER_OWNER=0, DOWNLOAD_RATE_GLOBAL=0):
+            self.assertIsNone(download_throttle(self.file))
+
+    @override_settings(DOWNLOAD_CONCURRENCY_PER_LINK=1, DOWNLOAD_SIGNED_LINKS=True)
+    def test_concurrent_downloads(self):
+        running = download_throttle(self.file)
+        with self.assertRaises(DownloadLimited):
+            download_throttle(self.file)
+
+        response = self.client.get(f'/download/{self.file.token}')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '10')
+        # Turned away requests do not use up limited signed links
+        path = sign_link(self.file, max_downloads=1)
+        self.assertEqual(self.client.get(path).status_code, 429)
+
+        running.release()
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(caches['default'].get(slot_key(self.file.pk)), 1)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(caches['default'].get(slot_key(self.file.pk)), 0)
+
+        # Responses without a body give the slot back at once
+        response = self.client.get(f'/download/{self.file.token}', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(caches['default'].get(slot_key(self.file.pk)), 0)
+
+    @override_settings(DOWNLOAD_CONCURRENCY_PER_LINK=2, DOWNLOAD_CONCURRENCY_TTL=60)
+    def test_slot_count_is_kept_while_busy_and_never_negative(self):
+        cache, key = caches['default'], slot_key(self.file.pk)
+        with mock.patch.object(cache, 'touch', wraps=cache.touch) as touch:
+            first = download_throttle(self.file)
+        touch.assert_called_once_with(key, 60)
+
+        # The count expired during the download and a new one was started meanwhile
+        cache.delete(key)
+        second = download_throttle(self.file)
+        first.release()
+        second.release()
+        self.assertEqual(cache.get(key), 0)
+
+    @override_settings(DOWNLOAD_CONCURRENCY_PER_LINK=1, DOWNLOAD_CHUNK_SIZE=1024, DOWNLOAD_RATE_PER_LINK=1024)
+    def test_archive_takes_member_slots(self):
+        other = self.create_file(self.user, b'other', 'other.bin', token=uuid4())
+        path = f'/download/archive?tokens={other.token},{self.file.token}'
+        running = download_throttle(self.file)
+        self.assertEqual(self.client.get(path).status_code, 429)
+        # The slot of the first member is given back
+        self.assertEqual(caches['default'].get(slot_key(other.pk)), 0)
+        running.release()
+
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(caches['default'].get(slot_key(self.file.pk)), 1)
+        body, seconds = self.consume(response)
+        self.assertEqual(zipfile.ZipFile(io.BytesIO(body)).read('data.bin'), self.content)
+        self.assertAlmostEqual(seconds, 3, places=2)
+        self.assertEqual(caches['default'].get(slot_key(self.file.pk)), 0)
+
+
+class DownloadCounterTest(TransactionTestCase):
+    threads = 8
+    downloads_per_thread = 25
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.file = File.objects.create(title='data', user=self.user, description='keep')
+        self.updated_at = self.file.updated_at
+
+    def run_concurrently(self, target):
+        def worker():
+            try:
+                for _ in range(self.downloads_per_thread):
+                    target()
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+    def assert_counted(self):
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.download_count, self.threads * self.downloads_per_thread)
+        self.assertIsNotNone(self.file.download_at)
+        self.assertEqual(self.file.updated_at, self.updated_at)
+        self.assertEqual(self.file.description, 'keep')
+
+    def test_concurrent_downloads_are_not_lost(self):
+        self.run_concurrently(lambda: record_download(self.file.pk))
+        self.assert_counted()
+
+    @override_settings(DOWNLOAD_COUNTER_BUFFERED=True, DOWNLOAD_COUNTER_FLUSH_INTERVAL=60)
+    def test_buffered_downloads_are_flushed_in_bulk(self):
+        other = File.objects.create(title='other', user=self.user)
+        self.run_concurrently(lambda: record_download(self.file.pk))
+        record_download(other.pk)
+
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.download_count, 0)
+
+        download_counter.flush()
+        self.assert_counted()
+        other.refresh_from_db()
+        self.assertEqual(other.download_count, 1)
+
+
+class ChunkedUploadTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', password='password')
+        self.auth = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+        self.content = bytes(range(256)) * 40
+
+    def start_upload(self):
+        response = self.client.post('/api/upload', {
+            'title': 'data', 'filename': 'data.bin', 'extension': 'bin', 'size': len(self.content),
+        }, content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def put_chunk(self, upload_id, start, stop):
+        return self.client.put(f'/api/upload/{upload_id}', self.content[start:stop],
+                               content_type='application/octet-stream',
+                               headers={'Content-Range': f'bytes {start}-{stop - 1}/{len(self.content)}', **self.auth})
+
+    def test_upload_in_chunks(self):
+        upload_id = self.start_upload()
+        self.assertEqual(self.put_chunk(upload_id, 6000, len(self.content)).status_code, 200)
+        self.assertEqual(self.put_chunk(upload_id, 0, 3000).status_code, 200)
+
+        status = self.client.get(f'/api/upload/{upload_id}', headers=self.auth).json()
+        self.assertEqual(status['received'], [[0, 3000], [6000, len(self.content)]])
+        self.assertEqual(self.client.post(f'/api/upload/{upload_id}/commit', headers=self.auth).status_code, 400)
+
+        self.assertEqual(self.put_chunk(upload_id, 3000, 6000).status_code, 200)
+        response = self.client.post(f'/api/upload/{upload_id}/commit', headers=self.auth)
+        self.assertEqual(response.status_code, 201)
+
+        file = File.objects.get(pk=response.json()['id'])
+        self.assertEqual(file.user, self.user)
+        self.assertEqual(file.size, len(self.content))
+        self.assertEqual(file.checksum, hashlib.sha256(self.content).hexdigest())
+        with file.handle.open('rb') as handle:
+            self.assertEqual(handle.read(), self.content)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_chunk_outside_upload_is_rejected(self):
+        upload_id = self.start_upload()
+        response = self.client.put(f'/api/upload/{upload_id}?offset={len(self.content)}', b'x',
+                                   content_type='application/octet-stream', headers=self.auth)
+        self.assertEqual(response.status_code, 400)
+
+    def test_abort_removes_blob(self):
+        upload_id = self.start_upload()
+        path = UploadSession.objects.get(pk=upload_id).path
+        self.assertTrue(os.path.exists(path))
+
+        self.assertEqual(self.client.delete(f'/api/upload/{upload_id}', headers=self.auth).status_code, 204)
+        self.assertFalse(os.path.exists(path))
+
+    def test_negative_size_is_rejected(self):
+        response = self.client.post('/api/upload', {'title': 'data', 'filename': 'data.bin', 'size': -1},
+                                    content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_idle_sessions_expire(self):
+        idle, fresh = self.start_upload(), self.start_upload()
+        path = UploadSession.objects.get(pk=idle).path
+        UploadSession.objects.filter(pk=idle).update(updated_at=timezone.now() - timedelta(days=8))
+
+        call_command('run_deletion_worker', once=True, stdout=io.StringIO())
+        self.assertEqual(list(UploadSession.objects.values_list('id', flat=True)), [UUID(fresh)])
+        self.assertFalse(os.path.exists(path))
+
+    def test_foreign_session_is_hidden(self):
+        upload_id = self.start_upload()
+        other = User.objects.create_user('other', password='password')
+        headers = {'Authorization': f'Token {Token.objects.create(user=other).key}'}
+        self.assertEqual(self.client.get(f'/api/upload/{upload_id}', headers=headers).status_code, 404)
+
+
+@override_settings(STORAGE_DEDUPLICATE=True)
+class DeduplicatingStorageTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', password='password')
+        self.other = User.objects.create_user('other', password='password')
+        self.content = b'same content'
+        self.digest = hashlib.sha256(self.content).hexdigest()
+        self.trash = os.path.join(self.media_root, 'deleted_files')
+        trash_override = override_settings(MEDIA_DELETE_FOLDER=self.trash)
+        trash_override.enable()
+        self.addCleanup(trash_override.disable)
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.create_file(self.user, self.content, 'a.txt')
+        second = self.create_file(self.other, self.content, 'b.txt')
+        self.assertEqual(first.handle.name, second.handle.name)
+        self.assertTrue(first.handle.name.endswith(self.digest))
+        path = first.handle.path
+
+        first.delete()
+        process_pending()
+        self.assertTrue(os.path.exists(path))
+        # Past the grace period kept for uploads that reused the blob
+        os.utime(path, (0, 0))
+        second.delete()
+        process_pending()
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(os.path.join(self.trash, self.digest)))
+
+    def test_reused_blob_is_not_trashed_before_the_upload_commits(self):
+        first = self.create_file(self.user, self.content, 'a.txt')
+        path = first.handle.path
+        os.utime(path, (0, 0))
+        first.delete()
+
+        # Another upload reuses the blob, the worker runs before its file row is committed
+        storage = File.handle.field.storage
+        new_name = storage.save('user_files/upload', SimpleUploadedFile('upload', self.content))
+        self.assertEqual(new_name, first.handle.name)
+        self.assertEqual(process_pending(), 0)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(PendingDeletion.objects.get().name, new_name)
+
+        second = self.create_file(self.other, self.content, 'b.txt')
+        self.assertEqual(process_pending(), 1)
+        self.assertTrue(os.path.exists(second.handle.path))
+
+    def test_stale_reused_blob_is_trashed(self):
+        first = self.create_file(self.user, self.content, 'a.txt')
+        path = first.handle.path
+        first.delete()
+        stale = time.time() - REUSE_GRACE - 1
+        os.utime(path, (stale, stale))
+        self.assertEqual(process_pending(), 1)
+        self.assertFalse(os.path.exists(path))
+
+    def test_instant_upload_by_digest(self):
+        stored = self.create_file(self.user, self.content, 'a.txt')
+        headers = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+        response = self.client.post('/api/file', {
+            'title': 'copy', 'filename': 'copy.txt', 'extension': 'txt', 'user': self.user.id, 'digest': self.digest,
+        }, headers=headers)
+        self.assertEqual(response.status_code, 201)
+
+        file = File.objects.get(pk=response.json()['id'])
+        self.assertEqual(file.handle.name, stored.handle.name)
+        self.assertEqual(file.size, len(self.content))
+        self.assertEqual(file.checksum, self.digest)
+
+    def test_instant_upload_requires_own_blob(self):
+        self.create_file(self.other, self.content, 'a.txt')
+        headers = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+        response = self.client.post('/api/file', {
+            'title': 'copy', 'filename': 'copy.txt', 'extension': 'txt', 'user': self.user.id, 'digest': self.digest,
+        }, headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class DeletionTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', password='password')
+        self.trash = os.path.join(self.media_root, 'deleted_files')
+        trash_override = override_settings(MEDIA_DELETE_FOLDER=self.trash)
+        trash_override.enable()
+        self.addCleanup(trash_override.disable)
+
+    def test_delete_queues_blob(self):
+        file = self.create_file(self.user)
+        path = file.handle.path
+
+        with override_settings(DELETION_WORKER_THREAD=False), self.captureOnCommitCallbacks(execute=True):
+            file.delete()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(PendingDeletion.objects.get().name, file.handle.name)
+
+        self.assertEqual(process_pending(), 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(os.path.join(self.trash, os.path.basename(path))))
+        self.assertFalse(PendingDeletion.objects.exists())
+        self.assertEqual(process_pending(), 0)
+
+    def test_user_delete_queues_all_blobs(self):
+        paths = [self.create_file(self.user, filename=f'{i}.bin').handle.path for i in range(3)]
+        self.user.delete()
+        self.assertEqual(PendingDeletion.objects.count(), 3)
+
+        self.assertEqual(process_pending(batch_size=2), 2)
+        self.assertEqual(process_pending(batch_size=2), 1)
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+    def test_missing_blob_is_skipped(self):
+        file = self.create_file(self.user)
+        os.remove(file.handle.path)
+        file.delete()
+        self.assertEqual(process_pending(), 1)
+        self.assertFalse(PendingDeletion.objects.exists())
+
+    def test_purge_trash(self):
+        os.makedirs(self.trash)
+        old, new = os.path.join(self.trash, 'old'), os.path.join(self.trash, 'new')
+        for path in (old, new):
+            open(path, 'wb').close()
+        os.utime(old, (0, 0))
+
+        self.assertEqual(purge_trash(retention_days=30), 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+    def test_scan_orphans(self):
+        file = self.create_file(self.user)
+        storage = File.handle.field.storage
+        orphan = storage.save('user_files/orphan.bin', io.BytesIO(b'orphan'))
+
+        out = io.StringIO()
+        call_command('scan_orphans', min_age=0, stdout=out)
+        self.assertIn(orphan, out.getvalue())
+        self.assertNotIn(file.handle.name, out.getvalue())
+        self.assertTrue(storage.exists(orphan))
+
+        call_command('scan_orphans', min_age=0, move=True, stdout=io.StringIO())
+        self.assertFalse(storage.exists(orphan))
+        self.assertTrue(os.path.exists(file.handle.path))
+        self.assertTrue(os.path.exists(os.path.join(self.trash, os.path.basename(orphan))))
+
+
+class ScrubBlobsTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', password='password')
+        self.file = self.create_file(self.user, b'intact')
+
+    def test_intact_blobs_pass(self):
+        out = io.StringIO()
+        call_command('scrub_blobs', workers=2, rate=1, stdout=out)
+        self.assertIn('1 verified', out.getvalue())
+
+    def test_corrupt_and_missing_blobs_fail(self):
+        with open(self.file.handle.path, 'wb') as f:
+            f.write(b'rotten')
+        missing = self.create_file(self.user, b'gone')
+        os.remove(missing.handle.path)
+
+        out = io.StringIO()
+        with self.assertRaisesMessage(CommandError, '1 corrupt, 1 missing'):
+            call_command('scrub_blobs', stdout=out)
+        self.assertIn(f'corrupt {self.file.handle.name}', out.getvalue())
+        self.assertIn(f'missing {missing.handle.name}', out.getvalue())
+
+    def test_fill_missing_checksums(self):
+        File.objects.update(checksum='')
+        call_command('scrub_blobs', stdout=io.StringIO())
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.checksum, '')
+
+        out = io.StringIO()
+        call_command('scrub_blobs', fill_missing=True, stdout=out)
+        self.assertIn('1 filled', out.getvalue())
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.checksum, hashlib.sha256(b'intact').hexdigest())
+
+
+class StorageVolumesTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', password='password')
+        self.volume = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.volume, ignore_errors=True)
+        overrides = override_settings(STORAGE_VOLUMES={'disk2': self.volume},
+                                      MEDIA_DELETE_FOLDER=os.path.join(self.media_root, 'deleted_files'))
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_blobs_are_sharded(self):
+        with override_settings(STORAGE_VOLUMES={}):
+            file = self.create_file(self.user)
+        self.assertRegex(file.handle.name, r'^user_files/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f-]+\.bin$')
+        self.assertTrue(file.handle.path.startswith(self.media_root))
+
+    @override_settings(STORAGE_PLACEMENT='weight', STORAGE_VOLUME_WEIGHTS={'default': 0})
+    def test_placement_by_weight(self):
+        file = self.create_file(self.user, b'on disk2', token=uuid4())
+        self.assertTrue(file.handle.name.startswith('volumes/disk2/user_files/'))
+        self.assertTrue(file.handle.path.startswith(self.volume))
+        response = self.client.get(file.get_download_path())
+        self.assertEqual(b''.join(response.streaming_content), b'on disk2')
+
+        file.delete()
+        process_pending()
+        self.assertTrue(os.path.exists(os.path.join(self.volume, 'deleted_files', os.path.basename(file.handle.name))))
+
+    def test_placement_by_free_space(self):
+        free = {self.media_root: 10, self.volume: 20}
+        with mock.patch('my_cloud.storage.free_space', lambda root: free[root]):
+            self.assertTrue(self.create_file(self.user).handle.name.startswith('volumes/disk2/'))
+            free[self.media_root] = 30
+            self.assertTrue(self.create_file(self.user).handle.name.startswith('user_files/'))
+
+    def test_reshard_and_move_to_volume(self):
+        with override_settings(STORAGE_VOLUMES={}):
+            files = [self.create_file(self.user, f'blob {i}'.encode(), f'{i}.bin') for i in range(3)]
+        storage = File.handle.field.storage
+        for file in files:
+            flat = f'user_files/{os.path.basename(file.handle.name)}'
+            os.replace(file.handle.path, storage.path(flat))
+            File.objects.filter(pk=file.pk).update(handle=flat)
+
+        out = io.StringIO()
+        call_command('reshard_blobs', batch_size=2, workers=2, stdout=out)
+        self.assertIn('3 blobs moved, 0 missing', out.getvalue())
+        for i, file in enumerate(files):
+            file.refresh_from_db()
+            self.assertRegex(file.handle.name, r'^user_files/[0-9a-f]{2}/[0-9a-f]{2}/')
+            with file.handle.open('rb') as f:
+                self.assertEqual(f.read(), f'blob {i}'.encode())
+        self.assertFalse([name for name in os.listdir(storage.path('user_files')) if name.endswith('.bin')])
+
+        call_command('reshard_blobs', volume='disk2', stdout=io.StringIO())
+        for i, file in enumerate(files):
+            file.refresh_from_db()
+            self.assertTrue(file.handle.name.startswith('volumes/disk2/user_files/'))
+            with file.handle.open('rb') as f:
+                self.assertEqual(f.read(), f'blob {i}'.encode())
+
+        out = io.StringIO()
+        call_command('scan_orphans', min_age=0, stdout=out)
+        self.assertIn('0 orphans', out.getvalue())
+
+
+@override_settings(STORAGE_COMPRESSION='gzip')
+class CompressedStorageTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', password='password')
+        self.content = b'compressible line\n' * 500
+        self.file = self.create_file(self.user, self.content, 'notes.txt', extension='txt', token=uuid4())
+
+    def test_blob_is_compressed(self):
+        self.assertEqual(self.file.compression, 'gzip')
+        self.assertEqual(self.file.size, len(self.content))
+        self.assertEqual(self.file.checksum, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(self.file.stored_size, os.path.getsize(self.file.handle.path))
+        self.assertLess(self.file.stored_size, self.file.size)
+        with open(self.file.handle.path, 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), self.content)
+
+        usage = UserUsage.objects.get(user=self.user)
+        self.assertEqual((usage.bytes, usage.stored_bytes), (self.file.size, self.file.stored_size))
+
+        photo = self.create_file(self.user, b'\xff\xd8' * 100, 'photo.jpg', extension='jpg')
+        self.assertEqual((photo.compression, photo.stored_size), ('', photo.size))
+
+    def test_download_is_decompressed(self):
+        response = self.client.get(self.file.get_download_path())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(int(response['Content-Length']), len(self.content))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response.has_header('Digest'))
+
+        response = self.client.get(self.file.get_download_path(), headers={'Range': 'bytes=1000-1999'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[1000:2000])
+        self.assertEqual(response['Content-Range'], f'bytes 1000-1999/{len(self.content)}')
+
+        response = self.client.get(f'/download/archive?tokens={self.file.token}')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.read('notes.txt'), self.content)
+
+    def test_download_passes_encoding_through(self):
+        response = self.client.get(self.file.get_download_path(), headers={'Accept-Encoding': 'br, gzip;q=0.5'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(int(response['Content-Length']), self.file.stored_size)
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.content)
+        self.assertFalse(response.has_header('Digest'))
+
+        etag = response['ETag']
+        self.assertNotEqual(etag, self.client.get(self.file.get_download_path())['ETag'])
+        response = self.client.get(self.file.get_download_path(),
+                                   headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(self.file.get_download_path(), headers={'Accept-Encoding': 'gzip;q=0'})
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_chunked_upload_and_scrub(self):
+        headers = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+        upload_id = self.client.post('/api/upload', {
+            'title': 'log', 'filename': 'app.log', 'extension': 'log', 'size': len(self.content),
+        }, content_type='application/json', headers=headers).json()['id']
+        self.client.put(f'/api/upload/{upload_id}', self.content, content_type='application/octet-stream',
+                        headers={'Content-Range': f'bytes 0-{len(self.content) - 1}/{len(self.content)}', **headers})
+        response = self.client.post(f'/api/upload/{upload_id}/commit', headers=headers)
+        self.assertEqual(response.status_code, 201)
+
+        file = File.objects.get(pk=response.json()['id'])
+        self.assertEqual((file.compression, file.checksum), ('gzip', self.file.checksum))
+        self.assertEqual(file.stored_size, os.path.getsize(file.handle.path))
+
+        out = io.StringIO()
+        call_command('scrub_blobs', rate=0, stdout=out)
+        self.assertIn('2 verified', out.getvalue())
+
+        with open(file.handle.path, 'r+b') as f:
+            f.seek(20)
+            f.write(b'damaged')
+        with self.assertRaises(CommandError):
+            call_command('scrub_blobs', rate=0, stdout=io.StringIO())
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    @override_settings(STORAGE_COMPRESSION='zstd')
+    def test_zstd(self):
+        file = self.create_file(self.user, self.content, 'notes.txt', extension='txt', token=uuid4())
+        self.assertEqual(file.compression, 'zstd')
+        response = self.client.get(file.get_download_path(), headers={'Range': 'bytes=10-19'})
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+        response = self.client.get(file.get_download_path(), headers={'Accept-Encoding': 'zstd'})
+        self.assertEqual(response['Content-Encoding'], 'zstd')
+        self.assertEqual(zstandard.ZstdDecompressor().decompressobj().decompress(
+            b''.join(response.streaming_content)), self.content)
+
+
+class TieringTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', password='password')
+        self.auth = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+        self.cold = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cold, ignore_errors=True)
+        overrides = override_settings(STORAGE_VOLUMES={'cold': self.cold}, STORAGE_COLD_VOLUME='cold',
+                                      MEDIA_DELETE_FOLDER=os.path.join(self.media_root, 'deleted_files'))
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.content = b'rarely read line\n' * 200
+
+    def create_idle_file(self, content, filename, days=100, **kwargs):
+        file = self.create_file(self.user, content, filename, extension=filename.rsplit('.', 1)[1], **kwargs)
+        File.objects.filter(pk=file.pk).update(created_at=timezone.now() - timedelta(days=days))
+        return file
+
+    @override_settings(STORAGE_PLACEMENT='weight', STORAGE_VOLUME_WEIGHTS={'default': 0})
+    def test_uploads_skip_cold_volume(self):
+        file = self.create_file(self.user)
+        self.assertTrue(file.handle.name.startswith('user_files/'))
+        self.assertEqual(file.tier, 'hot')
+
+    def test_idle_files_move_to_cold_tier(self):
+        idle = self.create_idle_file(self.content, 'old.txt', token=uuid4())
+        downloaded = self.create_idle_file(b'read recently', 'read.txt')
+        File.objects.filter(pk=downloaded.pk).update(download_at=timezone.now() - timedelta(days=1))
+        recent = self.create_file(self.user, b'new', 'new.txt', extension='txt')
+
+        out = io.StringIO()
+        call_command('tier_blobs', days=30, stdout=out)
+        self.assertIn('1 blobs moved to the cold tier, 0 failed', out.getvalue())
+
+        old_path = idle.handle.path
+        idle.refresh_from_db()
+        self.assertEqual((idle.tier, idle.compression), ('cold', 'gzip'))
+        self.assertTrue(idle.handle.path.startswith(self.cold))
+        self.assertEqual(idle.stored_size, os.path.getsize(idle.handle.path))
+        self.assertLess(idle.stored_size, idle.size)
+        self.assertFalse(os.path.exists(old_path))
+        for file in (downloaded, recent):
+            file.refresh_from_db()
+            self.assertEqual(file.tier, 'hot')
+
+        usage = UserUsage.objects.get(user=self.user)
+        self.assertEqual(usage.stored_bytes, sum(File.objects.values_list('stored_size', flat=True)))
+        listing = self.client.get('/api/file', headers=self.auth).json()
+        self.assertEqual({row['id']: row['tier'] for row in listing}[idle.pk], 'cold')
+
+        with mock.patch('my_cloud.tiering.promotion_pool.submit') as submit:
+            response = self.client.get(idle.get_download_path())
+            self.assertEqual(b''.join(response.streaming_content), self.content)
+        submit.assert_called_once_with(idle.handle.name)
+
+    def test_promotion_moves_blob_back(self):
+        idle = self.create_idle_file(self.content, 'old.txt')
+        call_command('tier_blobs', days=30, stdout=io.StringIO())
+        idle.refresh_from_db()
+        cold_name = idle.handle.name
+
+        self.assertTrue(move_blob(cold_name, 'hot'))
+        process_pending()
+        idle.refresh_from_db()
+        self.assertEqual((idle.tier, idle.compression, idle.stored_size), ('hot', '', len(self.content)))
+        self.assertTrue(idle.handle.name.startswith('user_files/'))
+        with idle.handle.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(File.handle.field.storage.exists(cold_name))
+        self.assertEqual(UserUsage.objects.get(user=self.user).stored_bytes, len(self.content))
+
+    def test_compressed_formats_stay_as_they_are(self):
+        photo = self.create_idle_file(b'\xff\xd8' * 100, 'photo.jpg')
+        call_command('tier_blobs', days=30, stdout=io.StringIO())
+        photo.refresh_from_db()
+        self.assertEqual((photo.tier, photo.compression, photo.stored_size), ('cold', '', photo.size))
+
+
+class UserListTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', password='password')
+        self.auth = {'Authorization': f'Token {Token.objects.create(user=self.admin).key}'}
+
+    def add_users(self, count):
+        for i in range(count):
+            user = User.objects.create_user(f'user{User.objects.count()}', password='password')
+            for size in (10, 20):
+                File.objects.create(title='data', size=size, user=user)
+
+    def list_users(self):
+        caches['default'].clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/user', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_query_count_does_not_depend_on_user_count(self):
+        self.add_users(1)
+        users, few_queries = self.list_users()
+        self.assertEqual(len(users), 2)
+
+        self.add_users(10)
+        users, many_queries = self.list_users()
+        self.assertEqual(len(users), 12)
+        self.assertEqual(few_queries, many_queries)
+
+        totals = {user['username']: (user['total_files'], user['total_size']) for user in users}
+        self.assertEqual(totals['admin'], (0, 0))
+        self.assertEqual(totals['user1'], (2, 30))
+
+
+class FileListTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', password='password')
+        self.user = User.objects.create_user('owner', password='password')
+        self.auth = {'Authorization': f'Token {Token.objects.create(user=self.admin).key}'}
+        for i in range(7):
+            File.objects.create(title=f'file{i}', extension='txt' if i % 2 else 'png', size=i * 10,
+                                user=self.user if i < 5 else self.admin, token=uuid4() if i < 2 else None)
+
+    def list_files(self, query=''):
+        response = self.client.get('/api/file' + query, headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_unpaginated_list(self):
+        self.assertEqual(len(self.list_files()), 7)
+
+    def test_keyset_pages(self):
+        titles = []
+        page = self.list_files('?limit=3&ordering=-size')
+        while True:
+            titles += [file['title'] for file in page['results']]
+            if page['next'] is None:
+                break
+            page = self.client.get(page['next'], headers=self.auth).json()
+        self.assertEqual(titles, [f'file{i}' for i in reversed(range(7))])
+
+    def test_keyset_pages_with_equal_values(self):
+        File.objects.update(created_at=File.objects.first().created_at)
+        first = self.list_files('?limit=4')
+        second = self.client.get(first['next'], headers=self.auth).json()
+        ids = [file['id'] for file in first['results'] + second['results']]
+        self.assertEqual(ids, sorted(File.objects.values_list('id', flat=True)))
+        self.assertIsNone(second['next'])
+
+    def test_filters(self):
+        titles = lambda files: sorted(file['title'] for file in files)
+        self.assertEqual(titles(self.list_files(f'?user_id={self.user.id}&extension=txt')), ['file1', 'file3'])
+        self.assertEqual(titles(self.list_files('?size_min=20&size_max=40')), ['file2', 'file3', 'file4'])
+        self.assertEqual(titles(self.list_files('?shared=true')), ['file0', 'file1'])
+        self.assertEqual(len(self.list_files('?shared=false')), 5)
+
+        created = File.objects.get(title='file3').created_at.isoformat()
+        self.assertEqual(len(self.list_files(f'?created_before={quote(created)}')), 3)
+
+    def test_invalid_parameters(self):
+        for query in ('?ordering=handle', '?size_min=big', '?cursor=broken', '?limit=0'):
+            self.assertEqual(self.client.get('/api/file' + query, headers=self.auth).status_code, 400)
+
+
+class FileSearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.other = User.objects.create_user('other', password='password')
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+        File.objects.create(title='Annual report', filename='report_2023.pdf', extension='pdf', user=self.user)
+        File.objects.create(title='Holiday', filename='IMG_0042.jpg', extension='jpg', user=self.user,
+                            description='Photos from the annual trip')
+        File.objects.create(title='Notes', filename='notes.txt', extension='txt', user=self.user)
+        File.objects.create(title='Annual report', filename='report.pdf', extension='pdf', user=self.other)
+
+    def search(self, query):
+        response = self.client.get(f'/api/file/search{query}', headers=self.headers)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def titles(self, query):
+        return [file['title'] for file in self.search(query)['results']]
+
+    def test_search_ranks_title_matches_first(self):
+        self.assertEqual(self.titles('?q=annual'), ['Annual report', 'Holiday'])
+
+    def test_search_by_prefix_filename_and_extension(self):
+        self.assertEqual(self.titles('?q=repo'), ['Annual report'])
+        self.assertEqual(self.titles('?q=2023'), ['Annual report'])
+        self.assertEqual(self.titles('?q=img_00'), ['Holiday'])
+        self.assertEqual(self.titles('?q=txt'), ['Notes'])
+        self.assertEqual(self.titles('?q=missing'), [])
+
+    def test_search_vector_follows_updates(self):
+        File.objects.filter(title='Notes').update(description='shopping list')
+        self.assertEqual(self.titles('?q=shopping'), ['Notes'])
+        self.assertNotIn('search_vector', self.search('?q=shopping')['results'][0])
+
+    def test_search_combines_with_filters_and_paginates(self):
+        self.assertEqual(self.titles('?q=annual&extension=jpg'), ['Holiday'])
+        page = self.search('?q=annual&limit=1')
+        self.assertEqual(len(page['results']), 1)
+        self.assertEqual([file['title'] for file in self.client.get(page['next'], headers=self.headers)
+                          .json()['results']], ['Holiday'])
+
+    def test_search_requires_query(self):
+        response = self.client.get('/api/file/search?q=', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkFileTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser('admin', password='password')
+        self.user = User.objects.create_user('owner', password='password')
+        self.other = User.objects.create_user('other', password='password')
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+        self.files = [self.create_file(self.user, filename=f'{i}.bin', extension='bin') for i in range(3)]
+        self.foreign = self.create_file(self.other, filename='foreign.bin', extension='bin')
+
+    def bulk(self, method, url, body, headers=None):
+        response = getattr(self.client, method)(url, body, content_type='application/json',
+                                                headers=headers or self.headers)
+        self.assertEqual(response.status_code, 200, response.content)
+        return {item['id']: item for item in response.json()['results']}
+
+    def test_bulk_delete(self):
+        ids = [file.pk for file in self.files[:2]] + [self.foreign.pk, 0]
+        with CaptureQueriesContext(connection) as queries:
+            results = self.bulk('delete', '/api/file/bulk', {'ids': ids})
+        self.assertLess(len(queries), 15)
+
+        self.assertEqual([results[pk]['status'] for pk in ids], [204, 204, 403, 404])
+        self.assertEqual(list(File.objects.filter(user=self.user)), [self.files[2]])
+        self.assertTrue(File.objects.filter(pk=self.foreign.pk).exists())
+        self.assertEqual(PendingDeletion.objects.count(), 2)
+
+        usage = UserUsage.objects.get(user=self.user)
+        self.assertEqual((usage.files, usage.bytes), (1, 100))
+        self.assertEqual(usage.extensions, {'bin': {'files': 1, 'bytes': 100}})
+
+    def test_bulk_update_description(self):
+        ids = [file.pk for file in self.files] + [self.foreign.pk]
+        results = self.bulk('patch', '/api/file/bulk', {'ids': ids, 'description': 'archive'})
+        self.assertEqual(results[self.foreign.pk]['status'], 403)
+        self.assertEqual(set(File.objects.filter(description='archive')), set(self.files))
+
+    def test_bulk_update_validates_description(self):
+        for description in ({}, [], 'x' * 10):
+            response = self.client.patch('/api/file/bulk', {'ids': [self.files[0].pk], 'description': description},
+                                         content_type='application/json', headers=self.headers)
+            self.assertEqual(response.status_code, 200 if isinstance(description, str) else 400)
+        response = self.client.patch('/api/file/bulk', {'ids': [self.files[0].pk], 'description': None},
+                                     content_type='application/json', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(File.objects.get(pk=self.files[0].pk).description)
+
+    def test_bulk_move_requires_superuser(self):
+        response = self.client.patch('/api/file/bulk', {'ids': [self.files[0].pk], 'user': self.other.pk},
+                                     content_type='application/json', headers=self.headers)
+        self.assertEqual(response.status_code, 403)
+
+    def test_bulk_move(self):
+        headers = {'Authorization': f'Token {Token.objects.create(user=self.admin).key}'}
+        ids = [file.pk for file in self.files[:2]]
+        self.bulk('patch', '/api/file/bulk', {'ids': ids, 'user': self.other.pk}, headers)
+        self.assertEqual(File.objects.filter(user=self.other).count(), 3)
+
+        call_command('rebuild_usage', stdout=io.StringIO())
+        rebuilt = {usage.user_id: (usage.files, usage.bytes) for usage in UserUsage.objects.all()}
+        self.assertEqual(rebuilt[self.user.pk], (1, 100))
+        self.assertEqual(rebuilt[self.other.pk], (3, 300))
+
+    def test_bulk_move_checks_quota(self):
+        UserUsage.objects.filter(user=self.other).update(quota=150)
+        headers = {'Authorization': f'Token {Token.objects.create(user=self.admin).key}'}
+        response = self.client.patch('/api/file/bulk', {'ids': [self.files[0].pk], 'user': self.other.pk},
+                                     content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(File.objects.filter(user=self.other).count(), 1)
+
+    def test_bulk_links(self):
+        ids = [file.pk for file in self.files] + [self.foreign.pk]
+        results = self.bulk('post', '/api/file/bulk/link', {'ids': ids})
+        self.assertEqual(results[self.foreign.pk]['status'], 403)
+        for file in self.files:
+            file.refresh_from_db()
+            self.assertEqual(results[file.pk]['url'], f'http://testserver/download/{file.token}')
+        self.assertEqual(self.client.get(results[self.files[0].pk]['url']).status_code, 200)
+
+        self.bulk('delete', '/api/file/bulk/link', {'ids': ids})
+        self.assertFalse(File.objects.filter(user=self.user, token__isnull=False).exists())
+
+    def test_bulk_delete_queries_do_not_grow_with_the_selection(self):
+        def delete(count):
+            ids = [self.create_file(self.user, filename=f'{count}-{i}.bin', extension='bin').pk for i in range(count)]
+            with CaptureQueriesContext(connection) as queries:
+                self.bulk('delete', '/api/file/bulk', {'ids': ids})
+            return len(queries)
+
+        self.assertEqual(delete(50), delete(2))
+        self.assertEqual(PendingDeletion.objects.count(), 52)
+        self.assertEqual(UserUsage.objects.get(user=self.user).files, 3)
+
+    def test_bulk_delete_marks_signed_links_gone(self):
+        caches['default'].clear()
+        path = sign_link(File.objects.get(pk=self.files[0].pk))
+        self.assertEqual(self.client.get(path).status_code, 200)
+        download_counter.flush()
+
+        self.bulk('delete', '/api/file/bulk', {'ids': [self.files[0].pk]})
+        self.assertEqual(self.client.get(path).status_code, 410)
+
+    @override_settings(DOWNLOAD_SIGNED_LINKS=True)
+    def test_bulk_unlink_revokes_signed_links(self):
+        caches['default'].clear()
+        file = File.objects.get(pk=self.files[0].pk)
+        path = sign_link(file)
+        self.assertEqual(self.client.get(path).status_code, 200)
+        download_counter.flush()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bulk('delete', '/api/file/bulk/link', {'ids': [file.pk]})
+        self.assertEqual(self.client.get(path).status_code, 410)
+
+    def test_invalid_ids(self):
+        for body in ({}, {'ids': []}, {'ids': 'abc'}, {'ids': ['x']}):
+            response = self.client.delete('/api/file/bulk', body, content_type='application/json',
+                                          headers=self.headers)
+            self.assertEqual(response.status_code, 400)
+
+
+class ArchiveDownloadTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', password='password')
+        self.other = User.objects.create_user('other', password='password')
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+        self.text = self.create_file(self.user, b'text ' * 1000, 'notes.txt', extension='txt', token=uuid4())
+        self.image = self.create_file(self.user, b'\x89PNG' + bytes(range(256)) * 10, 'photo.png',
+                                      extension='png', token=uuid4())
+        self.copy = self.create_file(self.user, b'copy', 'notes.txt', extension='txt')
+        self.foreign = self.create_file(self.other, b'foreign', 'foreign.txt', extension='txt')
+
+    def read_archive(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertTrue(response.streaming)
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_archive_of_owned_files(self):
+        ids = f'{self.text.pk},{self.image.pk},{self.copy.pk}'
+        archive = self.read_archive(self.client.get(f'/api/file/archive?ids={ids}', headers=self.headers))
+
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(), ['notes.txt', 'photo.png', 'notes (1).txt'])
+        self.assertEqual(archive.read('notes.txt'), b'text ' * 1000)
+        self.assertEqual(archive.read('notes (1).txt'), b'copy')
+        self.assertEqual(archive.getinfo('notes.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(archive.getinfo('photo.png').compress_type, zipfile.ZIP_STORED)
+
+    def test_archive_requires_owned_files(self):
+        response = self.client.get(f'/api/file/archive?ids={self.text.pk},{self.foreign.pk}', headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(f'/api/file/archive?ids={self.text.pk}')
+        self.assertEqual(response.status_code, 401)
+
+    def test_archive_by_share_tokens(self):
+        response = self.client.get(f'/download/archive?tokens={self.image.token},{self.text.token}')
+        archive = self.read_archive(response)
+        self.assertEqual(archive.namelist(), ['photo.png', 'notes.txt'])
+        self.assertEqual(File.objects.get(pk=self.text.pk).download_count, 1)
+
+        response = self.client.get(f'/download/archive?tokens={self.text.token},{uuid4()}')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get('/download/archive?tokens=bad').status_code, 400)
+
+    def test_archive_is_streamed_in_chunks(self):
+        big = self.create_file(self.user, os.urandom(300 * 1024), 'big.bin')
+        with override_settings(DOWNLOAD_CHUNK_SIZE=16 * 1024):
+            response = self.client.get(f'/api/file/archive?ids={big.pk}', headers=self.headers)
+            chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 10)
+        self.assertLess(max(len(chunk) for chunk in chunks), 64 * 1024)
+
+
+class PreviewTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', password='password')
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+
+    def create_image(self, size=(1000, 600)):
+        from PIL import Image
+        content = io.BytesIO()
+        Image.new('RGB', size, 'red').save(content, 'JPEG')
+        return self.create_file(self.user, content.getvalue(), 'photo.jpg', extension='jpg')
+
+    def get_preview(self, file, query=''):
+        return self.client.get(f'/api/file/{file.pk}/preview{query}', headers=self.headers)
+
+    def test_image_preview(self):
+        from PIL import Image
+        file = self.create_image()
+        preview = self.client.get(f'/api/file?file_id={file.pk}', headers=self.headers).json()[0]['preview']
+        self.assertIn(f'/api/file/{file.pk}/preview?v=', preview)
+
+        response = self.client.get(preview, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        image = Image.open(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(image.size, (128, 77))
+
+        response = self.get_preview(file, '?size=512')
+        self.assertEqual(Image.open(io.BytesIO(b''.join(response.streaming_content))).size, (512, 307))
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        response = self.get_preview(file, '?size=100')
+        self.assertEqual(response.status_code, 400)
+
+    def test_preview_is_cached_and_revalidated(self):
+        file = self.create_image()
+        etag = self.get_preview(file)['ETag']
+        with mock.patch('my_cloud.previews.render_image') as render_image:
+            response = self.client.get(f'/api/file/{file.pk}/preview', headers={**self.headers, 'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(self.get_preview(file).status_code, 200)
+        render_image.assert_not_called()
+
+    def test_text_preview(self):
+        content = ''.join(f'line {i}\n' for i in range(1000)).encode()
+        file = self.create_file(self.user, content, 'notes.txt', extension='txt')
+        response = self.get_preview(file)
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        text = b''.join(response.streaming_content)
+        self.assertTrue(content.startswith(text))
+        self.assertTrue(text.endswith(b'\n'))
+        self.assertLessEqual(len(text), 4096)
+
+    def test_no_preview(self):
+        file = self.create_file(self.user, b'data', 'data.bin', extension='bin')
+        self.assertEqual(self.get_preview(file).status_code, 404)
+        self.assertIsNone(self.client.get(f'/api/file?file_id={file.pk}', headers=self.headers).json()[0]['preview'])
+
+    def test_handle_change_invalidates_previews(self):
+        file = self.create_image()
+        old_etag = self.get_preview(file)['ETag']
+        preview_folder = os.path.join(self.media_root, 'previews', str(file.pk))
+        self.assertTrue(os.listdir(preview_folder))
+
+        file = File.objects.get(pk=file.pk)
+        with override_settings(PREVIEW_ON_UPLOAD=False), self.captureOnCommitCallbacks(execute=True):
+            file.handle = SimpleUploadedFile('other.jpg', File.objects.get(pk=file.pk).handle.read())
+            file.save()
+        self.assertFalse(os.path.exists(preview_folder))
+        self.assertNotEqual(self.get_preview(file)['ETag'], old_etag)
+
+
+class UserUsageTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', password='password')
+        self.auth = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+
+    def usage(self):
+        return UserUsage.objects.get(user=self.user)
+
+    def test_usage_follows_file_changes(self):
+        first = File.objects.create(title='a', extension='txt', size=10, user=self.user)
+        File.objects.create(title='b', extension='png', size=5, user=self.user)
+        usage = self.usage()
+        self.assertEqual((usage.files, usage.bytes), (2, 15))
+        self.assertEqual(usage.extensions, {'txt': {'files': 1, 'bytes': 10}, 'png': {'files': 1, 'bytes': 5}})
+
+        first = File.objects.get(pk=first.pk)
+        first.size = 30
+        first.save()
+        first.title = 'renamed'
+        first.save()
+        self.assertEqual(self.usage().bytes, 35)
+
+        first.delete()
+        usage = self.usage()
+        self.assertEqual((usage.files, usage.bytes), (1, 5))
+        self.assertEqual(usage.extensions, {'png': {'files': 1, 'bytes': 5}})
+
+    @override_settings(USER_QUOTA_BYTES=100)
+    def test_upload_over_quota_is_rejected(self):
+        File.objects.create(title='a', size=90, user=self.user)
+        response = self.client.post('/api/file', {
+            'title': 'b', 'filename': 'b.bin', 'extension': 'bin', 'size': 20, 'user': self.user.id,
+            'handle': SimpleUploadedFile('b.bin', b'x' * 20),
+        }, headers=self.auth)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(File.objects.count(), 1)
+        self.assertEqual(os.listdir(self.media_root), [])
+
+        response = self.client.post('/api/upload', {'title': 'b', 'filename': 'b.bin', 'size': 20},
+                                    content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 413)
+
+    @override_settings(USER_QUOTA_BYTES=2000, STORAGE_DEDUPLICATE=True)
+    def test_upload_by_digest_is_charged(self):
+        content = b'x' * 1200
+        response = self.client.post('/api/file', {
+            'title': 'a', 'filename': 'a.bin', 'extension': 'bin', 'size': len(content), 'user': self.user.id,
+            'handle': SimpleUploadedFile('a.bin', content),
+        }, headers=self.auth)
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.post('/api/file', {
+            'title': 'b', 'filename': 'b.bin', 'extension': 'bin', 'size': len(content), 'user': self.user.id,
+            'digest': hashlib.sha256(content).hexdigest(),
+        }, content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.usage().bytes, 1200)
+
+    @override_settings(USER_QUOTA_BYTES=100)
+    def test_update_charges_growth_only(self):
+        file = self.create_file(self.user, b'x' * 90, 'a.bin', extension='bin')
+
+        def patch(data, content_type='application/json'):
+            if content_type == MULTIPART_CONTENT:
+                data = encode_multipart(BOUNDARY, data)
+            return self.client.patch(f'/api/file/{file.pk}', data, content_type=content_type, headers=self.auth)
+
+        # The body of a metadata change is not charged
+        self.assertEqual(patch({'title': 'renamed', 'description': 'd' * 100}).status_code, 200)
+
+        response = patch({'size': 95, 'handle': SimpleUploadedFile('b.bin', b'y' * 95)}, MULTIPART_CONTENT)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.usage().bytes, 95)
+
+        response = patch({'size': 120, 'handle': SimpleUploadedFile('c.bin', b'z' * 120)}, MULTIPART_CONTENT)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.usage().bytes, 95)
+
+    def test_per_user_quota_overrides_default(self):
+        UserUsage.objects.filter(user=self.user).update(quota=10)
+        response = self.client.post('/api/upload', {'title': 'b', 'filename': 'b.bin', 'size': 20},
+                                    content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 413)
+
+    def test_rebuild_usage_command(self):
+        File.objects.create(title='a', extension='txt', size=10, user=self.user)
+        UserUsage.objects.filter(user=self.user).update(files=7, bytes=0, extensions={})
+        UserUsage.objects.filter(user=self.user).delete()
+        File.objects.create(title='b', extension='txt', size=5, user=self.user)
+
+        call_command('rebuild_usage', stdout=io.StringIO())
+        usage = self.usage()
+        self.assertEqual((usage.files, usage.bytes), (2, 15))
+        self.assertEqual(usage.extensions, {'txt': {'files': 2, 'bytes': 15}})
+
+
+@override_settings(AUTH_TOKEN_CACHE_TTL=60)
+class CachedTokenAuthenticationTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_user('owner', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.auth = {'Authorization': f'Token {self.token.key}'}
+
+    def get_settings(self):
+        return self.client.get('/api/settings', headers=self.auth)
+
+    def test_repeated_requests_skip_token_lookup(self):
+        self.assertEqual(self.get_settings().status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get_settings().status_code, 200)
+        self.assertFalse([query for query in queries if 'authtoken_token' in query['sql']])
+
+    def test_function_views_use_the_cache(self):
+        file = File.objects.create(title='data', user=self.user)
+        self.get_settings()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/link-generation', {'id': file.id},
+                                        content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'authtoken_token' in query['sql']])
+
+    def test_logout_invalidates_cache(self):
+        self.get_settings()
+        self.assertEqual(self.client.post('/api/logout', headers=self.auth).status_code, 204)
+        self.assertEqual(self.get_settings().status_code, 401)
+
+    def test_password_change_invalidates_cache(self):
+        self.get_settings()
+        self.user.set_password('changed')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_settings().status_code, 401)
+
+    def test_user_delete_invalidates_cache(self):
+        self.get_settings()
+        self.user.delete()
+        self.assertEqual(self.get_settings().status_code, 401)
+
+    @override_settings(AUTH_TOKEN_CACHE_TTL=0)
+    def test_cache_can_be_turned_off(self):
+        self.get_settings()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get_settings().status_code, 200)
+        self.assertTrue([query for query in queries if 'authtoken_token' in query['sql']])
+
+    def test_invalid_token_on_function_view(self):
+        response = self.client.post('/api/link-generation', {'id': 1}, content_type='application/json',
+                                    headers={'Authorization': 'Token invalid'})
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(AUTH_TOKEN_CACHE_TTL=60, LIST_VERSIONS=True, LIST_CACHE_TTL=30)
+class ConditionalListTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_user('owner', password='password')
+        self.auth = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+        self.file = File.objects.create(title='data', user=self.user)
+
+    def get(self, path, etag=None):
+        return self.client.get(path, headers={**self.auth, **({'If-None-Match': etag} if etag else {})})
+
+    def test_unchanged_list_is_not_modified(self):
+        response = self.get('/api/file')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.get('/api/file', etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        with self.assertNumQueries(0):
+            response = self.get('/api/file')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([file['id'] for file in response.json()], [self.file.id])
+
+    @override_settings(LIST_VERSIONS=False)
+    def test_without_shared_cache_lists_are_built_every_time(self):
+        response = self.get('/api/file')
+        self.assertFalse(response.has_header('ETag'))
+        File.objects.create(title='new', user=self.user)
+        self.assertEqual(len(self.get('/api/file').json()), 2)
+
+    def test_writes_change_the_etag(self):
+        etag = self.get('/api/file')['ETag']
+        File.objects.create(title='new', user=self.user)
+        response = self.get('/api/file', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+        etag = response['ETag']
+        record_download(self.file.pk, self.user.id)
+        response = self.get('/api/file', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({file['download_count'] for file in response.json()}, {0, 1})
+
+        etag = response['ETag']
+        self.client.patch('/api/file/bulk', {'ids': [self.file.id], 'description': 'bulk'},
+                          content_type='application/json', headers=self.auth)
+        self.assertEqual(self.get('/api/file', etag).status_code, 200)
+
+    def test_lists_of_other_users_are_separate(self):
+        etag = self.get('/api/file')['ETag']
+        other = User.objects.create_user('other', password='password')
+        File.objects.create(title='other', user=other)
+        self.assertEqual(self.get('/api/file', etag).status_code, 304)
+
+        other_auth = {'Authorization': f'Token {Token.objects.create(user=other).key}'}
+        response = self.client.get('/api/file', headers={**other_auth, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_settings_update_changes_the_etag(self):
+        updated_at = UserSettings.objects.get(user=self.user).updated_at
+        self.client.patch('/api/settings', {'color_theme': 'light'}, content_type='application/json',
+                          headers=self.auth)
+        self.assertGreater(UserSettings.objects.get(user=self.user).updated_at, updated_at)
+
+        etag = self.get('/api/settings')['ETag']
+        self.assertEqual(self.get('/api/settings', etag).status_code, 304)
+        self.client.patch('/api/settings', {'color_theme': 'dark'}, content_type='application/json',
+                          headers=self.auth)
+        response = self.get('/api/settings', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['color_theme'], 'dark')
+
+    def test_usage_change_refreshes_user_list(self):
+        etag = self.get('/api/user')['ETag']
+        File.objects.create(title='more', size=10, user=self.user)
+        response = self.get('/api/user', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['total_size'], 10)
+
+
+class AsyncViewsTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.content = bytes(range(256)) * 4
+        self.file = self.create_file(self.user, self.content, token=uuid4())
+
+    async def download(self, headers=None):
+        request = AsyncRequestFactory().get(self.file.get_download_path(), headers=headers)
+        response = await issue_link_download_async(request, uuid=self.file.token)
+        body = b''
+        if response.streaming:
+            self.assertTrue(response.is_async)
+            body = b''.join([chunk async for chunk in response.streaming_content])
+        return response, body
+
+    async def test_download_streams_asynchronously(self):
+        response, body = await self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+
+        file = await File.objects.aget(pk=self.file.pk)
+        self.assertEqual(file.download_count, 1)
+
+    async def test_download_range(self):
+        response, body = await self.download({'Range': 'bytes=100-199'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content[100:200])
+
+    @override_settings(DOWNLOAD_SIGNED_LINKS=True)
+    async def test_signed_link(self):
+        path = sign_link(self.file, max_downloads=1)
+        signed = path.rstrip('/').rsplit('/', 1)[1]
+        response = await signed_link_download_async(AsyncRequestFactory().head(path), signed=signed)
+        self.assertEqual(response.status_code, 200)
+        response = await signed_link_download_async(AsyncRequestFactory().get(path), signed=signed)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.content)
+        response = await signed_link_download_async(AsyncRequestFactory().get(path), signed=signed)
+        self.assertEqual(response.status_code, 410)
+        await sync_to_async(download_counter.flush)()
+
+    @override_settings(DOWNLOAD_CONCURRENCY_PER_LINK=1)
+    async def test_concurrent_downloads(self):
+        running = await sync_to_async(download_throttle)(self.file)
+        response, _ = await self.download()
+        self.assertEqual(response.status_code, 429)
+        await sync_to_async(running.release)()
+
+        response, body = await self.download()
+        self.assertEqual(body, self.content)
+
+    async def test_unknown_link(self):
+        request = AsyncRequestFactory().get('/download/x')
+        response = await issue_link_download_async(request, uuid=uuid4())
+        self.assertEqual(response.status_code, 404)
+
+    async def test_upload_chunk(self):
+        session = await UploadSession.objects.acreate(user=self.user, title='data', filename='data.bin', size=10,
+                                                      name='user_files/async.bin')
+        await asyncio.to_thread(allocate_blob, session.path, session.size)
+
+        path = f'/api/upload/{session.pk}/chunk'
+        response = await self.async_client.put(path, b'01234', content_type='application/octet-stream',
+                                               headers={'Authorization': f'Token {self.token.key}',
+                                                        'Content-Range': 'bytes 5-9/10'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['received'], [[5, 10]])
+
+        response = await self.async_client.put(path, b'01234', content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(METRICS_TOKEN='secret')
+class RequestMetricsTest(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('owner', password='password')
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+
+    def metrics(self):
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def sample(self, metrics, name):
+        for line in metrics.splitlines():
+            series, _, value = line.rpartition(' ')
+            if series == name:
+                return float(value)
+        return 0.0
+
+    def test_requests_are_recorded_by_view(self):
+        before = self.metrics()
+        name = 'http_requests_total{view="file_list",method="GET",status="200"}'
+        self.client.get('/api/file', headers=self.headers)
+        self.client.get('/api/file', headers=self.headers)
+        after = self.metrics()
+        self.assertEqual(self.sample(after, name) - self.sample(before, name), 2)
+
+        queries = 'http_request_db_queries_sum{view="file_list",method="GET"}'
+        self.assertGreater(self.sample(after, queries), self.sample(before, queries))
+        self.assertIn('http_request_duration_seconds_bucket{view="file_list",method="GET",le="+Inf"}', after)
+
+    def test_function_views_and_streamed_sizes(self):
+        file = self.create_file(self.user, b'x' * 1000, token=uuid4())
+        archive = 'http_response_size_bytes_sum{view="issue_link_download_archive",method="GET"}'
+        download = 'http_response_size_bytes_sum{view="issue_link_download",method="GET"}'
+        before = self.metrics()
+
+        self.assertEqual(len(b''.join(self.client.get(f'/download/{file.token}').streaming_content)), 1000)
+        response = self.client.get(f'/download/archive?tokens={file.token}')
+        size = len(b''.join(response.streaming_content))
+
+        after = self.metrics()
+        self.assertEqual(self.sample(after, download) - self.sample(before, download), 1000)
+        self.assertEqual(self.sample(after, archive) - self.sample(before, archive), size)
+
+    def test_unknown_methods_share_one_label(self):
+        for method in ('BREW', 'FOO1', 'FOO2'):
+            self.client.generic(method, '/api/file', headers=self.headers)
+        metrics = self.metrics()
+        self.assertIn('method="other"', metrics)
+        self.assertNotIn('method="BREW"', metrics)
+
+    def test_metrics_require_the_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 404)
+        # Behind a proxy on the same host every client would come from 127.0.0.1
+        with override_settings(METRICS_ALLOWED_IPS=['127.0.0.1']):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 404)
+
+    @override_settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=['10.0.0.2'])
+    def test_metrics_by_address_without_token(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 404)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_are_off_by_default(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=0, SLOW_REQUEST_SAMPLE_RATE=1)
+    def test_slow_requests_are_logged(self):
+        with self.assertLogs('my_cloud.metrics', 'WARNING') as logs:
+            self.client.get('/api/file', headers=self.headers)
+        self.assertIn('Slow request GET /api/file (file_list): 200', logs.output[0])
+
+
+class BenchmarkCommandTest(TestCase):
+    def test_benchmark_writes_json_results(self):
+        output = os.path.join(tempfile.mkdtemp(), 'results.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        call_command('benchmark', users=2, files=6, file_size=128, requests=3, memory_requests=1,
+                     use_current_db=True, output=output, stderr=io.StringIO())
+
+        with open(output) as f:
+            results = json.load(f)
+        self.assertEqual(results['meta']['files'], 6)
+        self.assertEqual(set(results['scenarios']), {'file_list', 'user_list', 'file_create', 'issue_link_generation',
+                                                     'issue_link_download', 'signed_link_download'})
+        # Only the first download of each signed link reads the link revision of its file
+        self.assertLess(results['scenarios']['signed_link_download']['queries_per_request'], 1)
+        for name, result in results['scenarios'].items():
+            self.assertEqual(result['errors'], 0)
+            if name != 'signed_link_download':
+                self.assertGreater(result['queries_per_request'], 0)
+            self.assertLessEqual(result['latency_p50_ms'], result['latency_p99_ms'])
+
+        # The seeded rows are rolled back
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(File.objects.exists())
@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from rest_framework import status
+
+from .ratelimit import TokenBucket
+
+# Buckets of files and owners that stopped downloading are dropped beyond this many
+MAX_BUCKETS = 10000
+
+
+class DownloadLimited(Exception):
+    """Raised when a shared file already has ``DOWNLOAD_CONCURRENCY_PER_LINK`` downloads running."""
+
+    def response(self):
+        response = HttpResponse(status=status.HTTP_429_TOO_MANY_REQUESTS)
+        response['Retry-After'] = settings.DOWNLOAD_RETRY_AFTER
+        return response
+
+
+class BucketRegistry:
+    """Token buckets of this process by scope, least recently used ones are dropped first."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def get(self, scope, rate):
+        # A changed rate starts a new bucket
+        key = (scope, rate)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(rate, max(rate, settings.DOWNLOAD_CHUNK_SIZE))
+                if len(self._buckets) > MAX_BUCKETS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket
+
+
+buckets = BucketRegistry()
+
+
+class DownloadThrottle:
+    """
+    Bandwidth and concurrency limits of one download, applied by the response iterator.
+
+    Every chunk is taken from all buckets of the download and waits for the slowest one;
+    the concurrency slot is given back once when the response is closed.
+    """
+
+    def __init__(self, buckets, slot=None):
+        self.buckets = buckets
+        self.slot = slot
+
+    def take(self, amount):
+        return max((bucket.take(amount) for bucket in self.buckets), default=0.0)
+
+    def wait(self, amount):
+        delay = self.take(amount)
+        if delay:
+            time.sleep(delay)
+
+    async def await_(self, amount):
+        delay = self.take(amount)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def release(self):
+        slot, self.slot = self.slot, None
+        if slot is not None:
+            release_slot(slot)
+
+
+def slot_key(pk):
+    return f'download-slots:{pk}'
+
+
+def acquire_slot(pk):
+    """
+    Count one more running download of the shared file ``pk``; raises ``DownloadLimited`` at the limit.
+
+    Counts are kept in ``DOWNLOAD_THROTTLE_CACHE``, so the limit covers all processes only
+    with a shared cache. A count left by a crashed worker expires ``DOWNLOAD_CONCURRENCY_TTL`` after
+    the last download started.
+    """
+    cache = caches[settings.DOWNLOAD_THROTTLE_CACHE]
+    key = slot_key(pk)
+    cache.add(key, 0, settings.DOWNLOAD_CONCURRENCY_TTL)
+    try:
+        running = cache.incr(key)
+        # incr keeps the expiry set by add, a busy file must not lose its count mid-download
+        cache.touch(key, settings.DOWNLOAD_CONCURRENCY_TTL)
+    except ValueError:  # expired in between
+        cache.add(key, 1, settings.DOWNLOAD_CONCURRENCY_TTL)
+        running = 1
+    if running > settings.DOWNLOAD_CONCURRENCY_PER_LINK:
+        release_slot(key)
+        raise DownloadLimited(f'{running - 1} downloads of file {pk} are running')
+    return key
+
+
+def release_slot(key):
+    cache = caches[settings.DOWNLOAD_THROTTLE_CACHE]
+    try:
+        running = cache.decr(key)
+        # The count expired and was started again while this download ran
+        if running < 0:
+            cache.incr(key, -running)
+    except ValueError:
+        pass
+
+
+def download_throttle(file):
+    """
+    Return the ``DownloadThrottle`` of a public download of ``file``, or ``None`` without limits.
+
+    Bandwidth is shaped per shared file (``DOWNLOAD_RATE_PER_LINK``), per owner
+    (``DOWNLOAD_RATE_PER_OWNER``) and for all public downloads of the process
+    (``DOWNLOAD_RATE_GLOBAL``), in bytes per second.
+    """
+    limits = [(('link', file.pk), settings.DOWNLOAD_RATE_PER_LINK),
+              (('owner', file.user_id), settings.DOWNLOAD_RATE_PER_OWNER),
+              (('global',), settings.DOWNLOAD_RATE_GLOBAL)]
+    throttle_buckets = [buckets.get(scope, rate) for scope, rate in limits if rate]
+    slot = acquire_slot(file.pk) if settings.DOWNLOAD_CONCURRENCY_PER_LINK else None
+    if not throttle_buckets and slot is None:
+        return None
+    return DownloadThrottle(throttle_buckets, slot)
+
+
+def release_throttles(throttles):
+    for throttle in throttles:
+        if throttle is not None:
+            throttle.release()
+
+
+def archive_throttles(files):
+    """
+    Return the throttles of the public downloads of ``files`` packed into one archive.
+
+    Every member takes a concurrency slot of its file; when one is not available, the slots
+    taken so far are given back and ``DownloadLimited`` is raised.
+    """
+    throttles = []
+    try:
+        for file in files:
+            throttles.append(download_throttle(file))
+    except DownloadLimited:
+        release_throttles(throttles)
+        raise
+    return throttles
@@ -0,0 +1,148 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .caching import touch_files
+from .compression import DECOMPRESSION_ERRORS, compression_for, transcode_blob
+from .deletion import deletion_worker
+from .models import File, PendingDeletion, UserUsage
+from .previews import discard_previews
+from .storage import COLD_TIER, HOT_TIER
+
+logger = logging.getLogger(__name__)
+
+
+def cold_volume():
+    volume = settings.STORAGE_COLD_VOLUME
+    if volume not in settings.STORAGE_VOLUMES:
+        raise ImproperlyConfigured('STORAGE_COLD_VOLUME has to name one of STORAGE_VOLUMES')
+    return volume
+
+
+def idle_files(days):
+    """Hot files whose blob no file has been downloaded or uploaded through for ``days`` days."""
+    cutoff = timezone.now() - timedelta(days=days)
+    recent = File.objects.filter(handle=OuterRef('handle')).filter(
+        Q(download_at__gte=cutoff) | Q(download_at__isnull=True, created_at__gte=cutoff))
+    return (File.objects.filter(tier=HOT_TIER).exclude(handle='').exclude(handle__isnull=True)
+            .exclude(Exists(recent)))
+
+
+def tier_target(storage, name, extension, tier):
+    """Return the name and compression the blob ``name`` gets in ``tier``."""
+    if tier == COLD_TIER:
+        volume, compression = cold_volume(), compression_for(extension, settings.STORAGE_COLD_COMPRESSION)
+    else:
+        volume, compression = storage.choose_volume(), compression_for(extension)
+    filename = os.path.basename(name)
+    if storage.is_content_name(name):
+        return storage.content_name(filename.split('.')[0], volume, compression), compression
+    return storage.blob_name(volume, f'{uuid4()}{os.path.splitext(filename)[1]}'), compression
+
+
+def copy_to_tier(name, extension, compression, tier):
+    """
+    Write a copy of the blob ``name`` to ``tier``, re-encoded with the codec of the tier.
+
+    Returns ``(name, compression, stored size)`` of the copy, or ``None`` when the blob is
+    missing or unreadable.
+    """
+    storage = File.handle.field.storage
+    target, target_compression = tier_target(storage, name, extension, tier)
+    try:
+        # A content addressed copy may be left by an interrupted run, it has the same bytes
+        if storage.exists(target):
+            return target, target_compression, storage.size(target)
+        stored_size = transcode_blob(storage.path(name), compression, storage.path(target), target_compression)
+    except FileNotFoundError:
+        logger.error('Blob %s is missing', name)
+        return None
+    except DECOMPRESSION_ERRORS:
+        logger.error('Blob %s cannot be decompressed', name)
+        return None
+    return target, target_compression, stored_size
+
+
+def switch_blob(name, tier, target, compression, stored_size):
+    """Point the files of the blob ``name`` to its copy ``target`` in ``tier``; the old blob is queued for deletion."""
+    with transaction.atomic():
+        rows = list(File.objects.select_for_update().filter(handle=name)
+                    .values_list('id', 'user_id', 'extension', 'stored_size'))
+        File.objects.filter(handle=name).update(handle=target, tier=tier, compression=compression,
+                                                stored_size=stored_size)
+        for _, user_id, extension, previous_size in rows:
+            UserUsage.record(user_id, extension, 0, 0, stored_size - previous_size)
+        # The deletion queue keeps blobs that are still referenced, the copy too if the files are gone
+        PendingDeletion.objects.bulk_create([PendingDeletion(name=name), PendingDeletion(name=target)])
+        touch_files(*{row[1] for row in rows})
+        pks = [row[0] for row in rows]
+        transaction.on_commit(lambda: discard_previews(pks))
+        transaction.on_commit(deletion_worker.wake)
+
+
+def move_blob(name, tier):
+    """Move the blob ``name`` and all its files to ``tier``; returns False when it cannot be read."""
+    stored = File.objects.filter(handle=name).values('extension', 'compression').first()
+    if stored is None:
+        return False
+    copy = copy_to_tier(name, stored['extension'], stored['compression'], tier)
+    if copy is None:
+        return False
+    switch_blob(name, tier, *copy)
+    return True
+
+
+class PromotionPool:
+    """
+    Moves cold blobs back to the hot volumes from a single background thread.
+
+    Downloads keep streaming from the cold copy meanwhile; a blob is promoted once even
+    when it is downloaded again before it is done.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._jobs = {}
+
+    def submit(self, name):
+        with self._lock:
+            job = self._jobs.get(name)
+            if job is None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(1, thread_name_prefix='promotion')
+                job = self._executor.submit(self._promote, name)
+                self._jobs[name] = job
+                job.add_done_callback(lambda _: self._forget(name))
+            return job
+
+    def _promote(self, name):
+        try:
+            return move_blob(name, HOT_TIER)
+        except (DatabaseError, OSError):
+            logger.exception('Promotion of %s failed, it stays on the cold volume', name)
+            return False
+        finally:
+            connection.close()
+
+    def _forget(self, name):
+        with self._lock:
+            self._jobs.pop(name, None)
+
+
+promotion_pool = PromotionPool()
+
+
+def promote_on_access(file):
+    """Schedule the promotion of a downloaded cold file."""
+    if file.tier == COLD_TIER and file.handle and settings.STORAGE_PROMOTE_ON_ACCESS:
+        promotion_pool.submit(file.handle.name)
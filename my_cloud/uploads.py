@@ -0,0 +1,106 @@
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .models import UploadSession
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+def merge_ranges(ranges):
+    """Merge overlapping and adjacent ``[start, stop)`` ranges into a sorted list."""
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return merged
+
+
+def parse_content_range(request, size):
+    """
+    Return ``(offset, length)`` of an upload chunk.
+
+    The position is taken from ``Content-Range: bytes start-end/total`` or, failing that,
+    from the ``offset`` query parameter together with ``Content-Length``.
+    """
+    try:
+        length = int(request.headers.get('Content-Length') or 0)
+    except ValueError:
+        raise ValidationError('Invalid Content-Length header')
+
+    content_range = request.headers.get('Content-Range')
+    if content_range:
+        match = CONTENT_RANGE_RE.match(content_range.strip())
+        if match is None:
+            raise ValidationError('Invalid Content-Range header')
+        start, end, total = match.groups()
+        offset = int(start)
+        if total != '*' and int(total) != size:
+            raise ValidationError('Content-Range total does not match the upload size')
+        if int(end) - offset + 1 != length:
+            raise ValidationError('Content-Range does not match Content-Length')
+    else:
+        try:
+            offset = int(request.GET.get('offset', 0))
+        except ValueError:
+            raise ValidationError('Invalid offset')
+
+    if length <= 0:
+        raise ValidationError('Empty chunk')
+    if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+        raise ValidationError(f'Chunk is larger than {settings.UPLOAD_CHUNK_MAX_SIZE} bytes')
+    if offset < 0 or offset + length > size:
+        raise ValidationError('Chunk is outside of the upload')
+    return offset, length
+
+
+def allocate_blob(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+
+def write_chunk(path, offset, length, stream):
+    """Copy ``length`` bytes of ``stream`` into ``path`` at ``offset``; returns bytes written."""
+    written = 0
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        while written < length:
+            data = stream.read(min(settings.DOWNLOAD_CHUNK_SIZE, length - written))
+            if not data:
+                break
+            f.write(data)
+            written += len(data)
+    return written
+
+
+def expire_sessions(max_age_days=None):
+    """
+    Remove upload sessions that received no chunk for ``max_age_days`` days, by default
+    ``UPLOAD_SESSION_MAX_AGE_DAYS``, together with their blobs; returns how many were removed.
+    """
+    if max_age_days is None:
+        max_age_days = settings.UPLOAD_SESSION_MAX_AGE_DAYS
+    cutoff = timezone.now() - timedelta(days=max_age_days)
+    removed, _ = UploadSession.objects.filter(updated_at__lt=cutoff).delete()
+    return removed
+
+
+def record_chunk(session, offset, length, written):
+    """Add a written chunk to the received ranges of ``session``; raises if it was cut short."""
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if written:
+            session.received = merge_ranges(session.received + [[offset, offset + written]])
+            session.save(update_fields=['received', 'updated_at'])
+
+    if written < length:
+        raise ValidationError(f'Chunk is incomplete: {written} of {length} bytes received')
+    return session
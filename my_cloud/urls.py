@@ -1,6 +1,6 @@
 from django.urls import path, include
 
-from .views import UserView, FileView, UserSettingsView
+from .views import UserView, FileView, UploadView, UserSettingsView
 
 urlpatterns = [
     path('user', UserView.as_view({
@@ -16,11 +16,39 @@ urlpatterns = [
         'get': 'file_list',
         'post': 'file_create'
     })),
+    path('file/search', FileView.as_view({
+        'get': 'file_search',
+    })),
+    path('file/archive', FileView.as_view({
+        'get': 'file_archive',
+    })),
+    path('file/bulk', FileView.as_view({
+        'patch': 'file_bulk_update',
+        'delete': 'file_bulk_destroy',
+    })),
+    path('file/bulk/link', FileView.as_view({
+        'post': 'file_bulk_link',
+        'delete': 'file_bulk_unlink',
+    })),
     path('file/<pk>', FileView.as_view({
         'get': 'file_list',
         'patch': 'file_update',
         'delete': 'file_destroy'
     })),
+    path('file/<pk>/preview', FileView.as_view({
+        'get': 'file_preview',
+    }), name='file-preview'),
+    path('upload', UploadView.as_view({
+        'post': 'upload_create',
+    })),
+    path('upload/<uuid:pk>', UploadView.as_view({
+        'get': 'upload_status',
+        'put': 'upload_chunk',
+        'delete': 'upload_destroy',
+    })),
+    path('upload/<uuid:pk>/commit', UploadView.as_view({
+        'post': 'upload_commit',
+    })),
     path('settings', UserSettingsView.as_view({
         'get': 'settings_list',
         'patch': 'settings_update',
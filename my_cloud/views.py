@@ -1,20 +1,44 @@
+import asyncio
 import logging
+import os
+from functools import wraps
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
+from django.core import signing
+from django.db import transaction
 from django.http import HttpResponse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.exceptions import PermissionDenied, ValidationError, AuthenticationFailed
+from rest_framework.exceptions import APIException, PermissionDenied, ValidationError, AuthenticationFailed
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 from rest_framework.utils import json
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.authtoken.models import Token
 
-from .models import File, UserSettings
+from .archives import archive_response
+from .authentication import CachedTokenAuthentication
+from .bulk import BULK_MAX_ITEMS, delete_files, parse_ids, share_files, unshare_files, update_files
+from .caching import conditional_list, file_scope, settings_scope, touch_settings, user_scope
+from .compression import compression_for
+from .counters import arecord_download, record_download
+from .downloads import download_response, is_download_start, requests_start
+from .links import LinkExpired, count_download, link_file, load_link, refund_download, revoke_links, sign_link
+from .models import File, UploadSession, UserSettings
+from .pagination import KeysetPagination, RankedPagination, order_queryset
+from .previews import get_preview, preview_response
+from .search import search_files
+from .quotas import QuotaExceeded, check_quota, request_body_size
 from .permissions import IsOwner, IsSuperuser, IsUserRegistration, IsUserUpdate
-from .serializers import UserSerializer, FileSerializer, UserSettingsSerializer, IssueTokenRequestSerializer
+from .serializers import UserSerializer, FileSerializer, UploadSessionSerializer, UserSettingsSerializer, \
+    IssueTokenRequestSerializer
+from .throttling import DownloadLimited, archive_throttles, download_throttle
+from .tiering import promote_on_access
+from .uploads import allocate_blob, parse_content_range, record_chunk, write_chunk
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(message)s')
 logger = logging.getLogger(__name__)
 
 
@@ -25,20 +49,17 @@ def front(request):
 
 
 def log_request(func):
+    @wraps(func)
     def wrapper(self, request, *args, **kwargs):
-        logger.debug(f"{request.user} {request.method} {request.get_full_path()}")
-
         try:
-            result = func(self, request, *args, **kwargs)
-            logger.info(f"{request.user} {request.method} {request.get_full_path()} OK")
-            return result
-        except (PermissionDenied, ValidationError) as e:
-            logger.error(f'{e.status_code} | {e.detail}')
+            return func(self, request, *args, **kwargs)
+        except (PermissionDenied, ValidationError, QuotaExceeded) as e:
+            logger.info('%s | %s', e.status_code, e.detail)
             return HttpResponse(json.dumps({'error': e.detail}, ensure_ascii=False),
                                 status=e.status_code,
                                 content_type='application/json')
-        except (File.DoesNotExist, User.DoesNotExist) as e:
-            logger.error(f'{status.HTTP_404_NOT_FOUND} | {e}')
+        except (File.DoesNotExist, User.DoesNotExist, UploadSession.DoesNotExist) as e:
+            logger.info('%s | %s', status.HTTP_404_NOT_FOUND, e)
             return HttpResponse(json.dumps({'error': str(e)}),
                                 status=status.HTTP_404_NOT_FOUND,
                                 content_type='application/json')
@@ -48,42 +69,25 @@ def log_request(func):
             else:
                 message = str(e);
 
-            logger.error(f'{type(e)} {message}')
+            logger.exception('%s %s', type(e), message)
             return HttpResponse(json.dumps({'error': message}),
                                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
                                 content_type='application/json')
     return wrapper
 
 
-def log_issue_link(func):
-    def wrapper(request, *callback_args, **callback_kwargs):
-        logger.debug(f"{request.user} {request.method} {request.get_full_path()}")
-
-        response = func(request, *callback_args, **callback_kwargs)
-
-        if status.is_success(response.status_code):
-            logger.info(f"{request.user} {request.method} {request.get_full_path()} OK")
-        else:
-            logger.error(f"{response.status_code}")
-
-        return response
-
-    return wrapper
-
-
 def log_issue_set_request_user(func):
+    @wraps(func)
     def wrapper(request, *callback_args, **callback_kwargs):
-        token = request.headers.get('Authorization', 'Token None').split()[1]
-        if token == 'None':
-            pass
-            # user = 'AnonymousUser'
-        else:
-            try:
-                token_obj = Token.objects.get(key=token)
-                user = token_obj.user
-            except Token.DoesNotExist:
-                raise AuthenticationFailed("Invalid token")
-            request.user = user
+        try:
+            result = CachedTokenAuthentication().authenticate(request)
+        except AuthenticationFailed as e:
+            logger.info('%s | %s', e.status_code, e.detail)
+            return HttpResponse(json.dumps({'error': e.detail}),
+                                status=e.status_code,
+                                content_type='application/json')
+        if result is not None:
+            request.user, request.auth = result
 
         return func(request, *callback_args, **callback_kwargs)
 
@@ -114,6 +118,9 @@ class CheckInstanceFromDataPermission:
 class UserView(ModelViewSet, CheckInstanceFromDataPermission):
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    pagination_class = KeysetPagination
+    ordering_fields = ['id', 'username', 'date_joined']
+    default_ordering = 'id'
     permission_classes = [IsAuthenticated & IsSuperuser | IsAuthenticated & IsUserUpdate | IsUserRegistration]
 
     def get_queryset(self):
@@ -128,9 +135,13 @@ class UserView(ModelViewSet, CheckInstanceFromDataPermission):
         if not request_user.is_superuser:
             queryset = queryset & self.queryset.filter(id=request_user.id)
 
-        return queryset
+        return queryset.select_related('usage')
+
+    def filter_queryset(self, queryset):
+        return order_queryset(queryset, self.request, self)
 
     @log_request
+    @conditional_list(user_scope)
     def user_list(self, request, *args, **kwargs):
         return super(UserView, self).list(request, *args, **kwargs)
 
@@ -154,6 +165,9 @@ class FileView(ModelViewSet, CheckInstanceFromDataPermission):
     queryset = File.objects.all()
     serializer_class = FileSerializer
     permission_classes = [IsAuthenticated, IsSuperuser | IsOwner]
+    pagination_class = KeysetPagination
+    ordering_fields = ['created_at', 'updated_at', 'size', 'title', 'id']
+    default_ordering = 'created_at'
 
     def get_queryset(self):
         file_id = self.request.GET.get('file_id', None)
@@ -173,31 +187,217 @@ class FileView(ModelViewSet, CheckInstanceFromDataPermission):
 
         return queryset
 
+    def filter_queryset(self, queryset):
+        return order_queryset(queryset.filter(**self.get_filters()), self.request, self)
+
+    def get_filters(self):
+        from django.utils.dateparse import parse_datetime
+
+        params = self.request.GET
+        request_filter = {}
+
+        extension = params.get('extension', None)
+        if extension is not None:
+            request_filter['extension__in'] = extension.split(',')
+
+        for param, lookup in (('size_min', 'size__gte'), ('size_max', 'size__lte')):
+            if param in params:
+                try:
+                    request_filter[lookup] = int(params[param])
+                except ValueError:
+                    raise ValidationError({param: 'Expected an integer'})
+
+        for param, lookup in (('created_after', 'created_at__gte'), ('created_before', 'created_at__lt')):
+            if param in params:
+                value = parse_datetime(params[param].replace(' ', '+'))
+                if value is None:
+                    raise ValidationError({param: 'Expected an ISO 8601 datetime'})
+                request_filter[lookup] = value
+
+        shared = params.get('shared', None)
+        if shared is not None:
+            request_filter['token__isnull'] = shared.lower() not in ('1', 'true', 'yes')
+
+        return request_filter
+
     @log_request
+    @conditional_list(file_scope)
     def file_list(self, request, *args, **kwargs):
         return super(FileView, self).list(request, *args, **kwargs)
 
+    @log_request
+    def file_search(self, request, *args, **kwargs):
+        text = request.GET.get('q', '').strip()
+        if not text or len(text) > 200:
+            raise ValidationError({'q': 'Expected a search query of up to 200 characters'})
+
+        queryset = search_files(self.get_queryset().filter(**self.get_filters()), text)
+        paginator = RankedPagination()
+        page = paginator.paginate_queryset(queryset, request, self)
+        return paginator.get_paginated_response(self.get_serializer(page, many=True).data)
+
     @log_request
     def file_create(self, request, *args, **kwargs):
+        check_quota(request.user.id, request_body_size(request))
         self.check_instance_from_data_permission(request)
         return super(FileView, self).create(request, *args, **kwargs)
 
+    def perform_create(self, serializer):
+        # The body size checked up front is missing for chunked requests and tiny for uploads by digest
+        owner = serializer.validated_data['user'].id
+        digest = self.request.data.get('digest', None)
+        if digest is None or self.request.data.get('handle'):
+            check_quota(owner, serializer.validated_data.get('size', 0))
+            serializer.save()
+            return
+
+        # Instant upload: reuse a blob the user already stores instead of receiving the body again
+        if not settings.STORAGE_DEDUPLICATE:
+            raise ValidationError('Upload by digest is not enabled')
+        storage = File.handle.field.storage
+        digest = str(digest).lower()
+        stored = self.queryset.filter(user_id=self.request.user.id, handle__in=storage.content_names(digest)) \
+            .values('handle', 'size', 'compression', 'stored_size', 'tier').first()
+        if stored is not None:
+            try:
+                storage.reuse_content(stored['handle'])
+            except FileNotFoundError:
+                stored = None
+        if stored is None:
+            raise ValidationError('Unknown digest, the file has to be uploaded')
+        check_quota(owner, stored['size'])
+        serializer.save(checksum=digest, **stored)
+
     @log_request
     def file_update(self, request, pk, **kwargs):
         self.check_instance_from_data_permission(request, pk)
         return super(FileView, self).partial_update(request, pk, **kwargs)
 
+    def perform_update(self, serializer):
+        # Only growth is charged: metadata changes cost nothing and a new blob replaces the old one
+        instance, data = serializer.instance, serializer.validated_data
+        handle = data.get('handle')
+        size = data.get('size', handle.size if handle else instance.size)
+        owner = data['user'].id if 'user' in data else instance.user_id
+        growth = size - instance.size if owner == instance.user_id else size
+        if growth > 0:
+            check_quota(owner, growth)
+        serializer.save()
+
     @log_request
     def file_destroy(self, request, pk, **kwargs):
         self.check_instance_from_data_permission(request, pk)
         return super(FileView, self).destroy(request, pk, **kwargs)
 
+    @log_request
+    def file_preview(self, request, pk, **kwargs):
+        file = self.get_queryset().get(pk=pk)
+        try:
+            path, kind = get_preview(file, int(request.GET.get('size') or 0))
+        except ValueError as e:
+            raise ValidationError({'size': str(e)})
+        if path is None:
+            raise File.DoesNotExist('File has no preview')
+        return preview_response(request, file, path, kind)
+
+    @log_request
+    def file_archive(self, request, *args, **kwargs):
+        ids = parse_ids({'ids': [pk for pk in request.GET.get('ids', '').split(',') if pk]})
+        files = {file.pk: file for file in self.get_queryset().filter(pk__in=ids).exclude(handle='')}
+        missing = [pk for pk in ids if pk not in files]
+        if missing:
+            raise File.DoesNotExist(f'Files not found: {", ".join(map(str, missing))}')
+        return archive_response([files[pk] for pk in ids], asynchronous=settings.ASYNC_VIEWS)
+
+    @log_request
+    def file_bulk_update(self, request, *args, **kwargs):
+        return Response(update_files(request.user, parse_ids(request.data), request.data))
+
+    @log_request
+    def file_bulk_destroy(self, request, *args, **kwargs):
+        return Response(delete_files(request.user, parse_ids(request.data)))
+
+    @log_request
+    def file_bulk_link(self, request, *args, **kwargs):
+        return Response(share_files(request.user, parse_ids(request.data), request.build_absolute_uri))
+
+    @log_request
+    def file_bulk_unlink(self, request, *args, **kwargs):
+        return Response(unshare_files(request.user, parse_ids(request.data)))
+
+
+class UploadView(ModelViewSet):
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated, IsOwner]
+
+    def get_queryset(self):
+        return self.queryset.filter(user_id=self.request.user.id)
+
+    def get_session(self, pk, for_update=False):
+        queryset = self.get_queryset()
+        if for_update:
+            queryset = queryset.select_for_update()
+        return queryset.get(pk=pk)
+
+    @log_request
+    def upload_create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        check_quota(request.user.id, serializer.validated_data.get('size', 0))
+
+        storage = File.handle.field.storage
+        name = storage.get_available_name(serializer.validated_data.get('filename', ''))
+        session = serializer.save(user=request.user, name=name)
+        allocate_blob(session.path, session.size)
+        return Response(self.get_serializer(session).data, status=status.HTTP_201_CREATED)
+
+    @log_request
+    def upload_status(self, request, pk, **kwargs):
+        return Response(self.get_serializer(self.get_session(pk)).data)
+
+    @log_request
+    def upload_chunk(self, request, pk, **kwargs):
+        session = self.get_session(pk)
+        offset, length = parse_content_range(request, session.size)
+        written = write_chunk(session.path, offset, length, request.stream)
+        session = record_chunk(session, offset, length, written)
+        return Response(self.get_serializer(session).data)
+
+    @log_request
+    def upload_commit(self, request, pk, **kwargs):
+        with transaction.atomic():
+            session = self.get_session(pk, for_update=True)
+            if not session.is_complete:
+                raise ValidationError({'received': session.received})
+            check_quota(session.user_id, session.size)
+
+            storage = File.handle.field.storage
+            name, checksum, compression, stored_size = storage.commit_upload(
+                session.name, compression_for(session.extension))
+            file = File.objects.create(title=session.title, filename=session.filename,
+                                       extension=session.extension, size=session.size,
+                                       description=session.description, handle=name, checksum=checksum,
+                                       compression=compression, stored_size=stored_size,
+                                       tier=storage.tier_of(name), user=session.user)
+            session.name = ''
+            session.delete()
+
+        return Response(FileSerializer(file, context=self.get_serializer_context()).data,
+                        status=status.HTTP_201_CREATED)
+
+    @log_request
+    def upload_destroy(self, request, pk, **kwargs):
+        self.get_session(pk).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
 class UserSettingsView(ModelViewSet, CheckInstanceFromDataPermission):
     queryset = UserSettings.objects.all()
     serializer_class = UserSettingsSerializer
 
     @log_request
+    @conditional_list(settings_scope)
     def settings_list(self, request, *args, **kwargs):
         instance = self.queryset.get(pk=self.request.user.id)
         from django.http import JsonResponse
@@ -232,14 +432,13 @@ class UserSettingsView(ModelViewSet, CheckInstanceFromDataPermission):
         #     error = u'Token receipt error'
         #     status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         #
-        self.queryset.filter(user_id=request.user.id).update(**request.data)
+        self.queryset.filter(user_id=request.user.id).update(**request.data, updated_at=timezone.now())
+        touch_settings(request.user.id)
         instance = self.queryset.get(user_id=request.user.id)
         return JsonResponse(model_to_dict(instance))
 
 
 def issue_token(request):
-    logger.debug(f"{request.user} {request.method} {request.get_full_path()}")
-
     body_unicode = request.body.decode('utf-8')
     body = json.loads(body_unicode)
     serializer = IssueTokenRequestSerializer(data=body)
@@ -269,19 +468,28 @@ def issue_token(request):
                 'is_superuser': authenticated_user.is_superuser,
                 'token': token.key,
             })
-            logger.info(f"{request.user} {request.method} {request.get_full_path()} OK")
         else:
-            logger.error(f'{status_code} | {error}')
+            logger.info('%s | %s', status_code, error)
             result = json.dumps({'error': error}, ensure_ascii=False)
 
         return HttpResponse(result, status=status_code)
     else:
-        logger.error(f'{status.HTTP_400_BAD_REQUEST} | {serializer.errors}')
+        logger.info('%s | %s', status.HTTP_400_BAD_REQUEST, serializer.errors)
         return HttpResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 @log_issue_set_request_user
-@log_issue_link
+def revoke_token(request, *callback_args, **callback_kwargs):
+    if request.method != 'POST':
+        return HttpResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    if not request.user.is_authenticated:
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+
+    Token.objects.filter(user=request.user).delete()
+    return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+
+@log_issue_set_request_user
 def issue_link_generation(request, *callback_args, **callback_kwargs):
     match request.method:
         case 'POST':
@@ -292,12 +500,12 @@ def issue_link_generation(request, *callback_args, **callback_kwargs):
 
             if pk is None:
                 return HttpResponse(status=status.HTTP_400_BAD_REQUEST)
+            elif settings.DOWNLOAD_SIGNED_LINKS:
+                return issue_signed_link(request, pk, body)
             else:
                 from django.db import utils
                 from uuid import uuid4
 
-                http_host = request.scheme + '://' + request.META['HTTP_HOST']
-
                 try_count = 0
                 while True:
                     try:
@@ -305,9 +513,10 @@ def issue_link_generation(request, *callback_args, **callback_kwargs):
                         file = view.queryset.get(pk=pk)
                         view.check_object_permissions(request, file)
 
-                        url = http_host + '/download/' + str(uuid4())
-                        file.url = url
-                        file.save()
+                        file.token = uuid4()
+                        # Other fields of this instance may be stale by now, e.g. after tiering moved the blob
+                        file.save(update_fields=['token'])
+                        url = request.build_absolute_uri(file.get_download_path())
                         return HttpResponse(json.dumps({'url': url}),
                                             status=status.HTTP_200_OK,
                                             content_type='application/json')
@@ -334,9 +543,9 @@ def issue_link_generation(request, *callback_args, **callback_kwargs):
                     file = view.queryset.get(pk=pk)
                     view.check_object_permissions(request, file)
 
-                    file = File.objects.get(pk=pk)
-                    file.url = None
-                    file.save()
+                    file.token = None
+                    file.save(update_fields=['token'])
+                    revoke_links(file.pk)
                     return HttpResponse(status=status.HTTP_200_OK)
                 except File.DoesNotExist:
                     return HttpResponse(status=status.HTTP_404_NOT_FOUND)
@@ -346,33 +555,236 @@ def issue_link_generation(request, *callback_args, **callback_kwargs):
     return HttpResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
-@log_issue_link
+def positive_int(value):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise ValueError(f'Expected a positive integer: {value!r}')
+    return value
+
+
+def issue_signed_link(request, pk, body):
+    """Answer a link generation request with a signed link, valid for ``expires_in`` seconds and ``max_downloads``."""
+    try:
+        expires_in = positive_int(body.get('expires_in', None))
+        max_downloads = positive_int(body.get('max_downloads', None))
+    except ValueError as e:
+        return HttpResponse(json.dumps({'error': str(e)}), status=status.HTTP_400_BAD_REQUEST,
+                            content_type='application/json')
+    if expires_in and settings.DOWNLOAD_LINK_MAX_AGE and expires_in > settings.DOWNLOAD_LINK_MAX_AGE:
+        error = f'Links expire after {settings.DOWNLOAD_LINK_MAX_AGE} seconds at most'
+        return HttpResponse(json.dumps({'error': error}), status=status.HTTP_400_BAD_REQUEST,
+                            content_type='application/json')
+
+    view = FileView()
+    try:
+        file = view.queryset.get(pk=pk)
+        view.check_object_permissions(request, file)
+    except File.DoesNotExist:
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+    except APIException:
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    if not file.handle:
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+
+    url = request.build_absolute_uri(sign_link(file, expires_in, max_downloads))
+    return HttpResponse(json.dumps({'url': url}), status=status.HTTP_200_OK, content_type='application/json')
+
+
 def issue_link_download(request, *callback_args, **callback_kwargs):
     match request.method:
-        case 'GET':
+        case 'GET' | 'HEAD':
             uuid = callback_kwargs.get('uuid', None)
 
             if uuid is None:
                 return HttpResponse(status=status.HTTP_400_BAD_REQUEST)
             else:
-                http_host = request.scheme + '://' + request.META['HTTP_HOST']
-                url = http_host + '/download/' + uuid
-
                 try:
-                    from django.utils import timezone
-                    import datetime
+                    file = File.objects.get(token=uuid)
+                    if not file.handle:
+                        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
 
-                    file = File.objects.get(url=url)
-                    file.download_count = file.download_count + 1
-                    file.download_at = datetime.datetime.now(tz=timezone.timezone.utc)
-                    file.save()
+                    response = download_response(request, file, throttle=download_throttle(file))
+
+                    if is_download_start(request, response):
+                        record_download(file.pk, file.user_id)
+                        promote_on_access(file)
 
-                    response = HttpResponse(file.handle.read(),
-                                            status=status.HTTP_200_OK,
-                                            content_type='application/octet-stream')
-                    response['Content-Disposition'] = f'attachment; filename={file.filename}'
                     return response
-                except File.DoesNotExist:
+                except (File.DoesNotExist, FileNotFoundError):
                     return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+                except DownloadLimited as e:
+                    return e.response()
                 # except:
                 #     return HttpResponse(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return HttpResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+def issue_link_download_archive(request, *callback_args, **callback_kwargs):
+    from django.core.exceptions import ValidationError as DjangoValidationError
+
+    if request.method != 'GET':
+        return HttpResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    tokens = list(dict.fromkeys(token for token in request.GET.get('tokens', '').split(',') if token))
+    if not tokens or len(tokens) > BULK_MAX_ITEMS:
+        return HttpResponse(status=status.HTTP_400_BAD_REQUEST)
+    try:
+        files = {str(file.token): file for file in File.objects.filter(token__in=tokens).exclude(handle='')}
+    except DjangoValidationError:
+        return HttpResponse(status=status.HTTP_400_BAD_REQUEST)
+    if len(files) != len(tokens):
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+
+    members = [files[token] for token in tokens]
+    try:
+        throttles = archive_throttles(members)
+    except DownloadLimited as e:
+        return e.response()
+
+    for file in members:
+        record_download(file.pk, file.user_id)
+        promote_on_access(file)
+    return archive_response(members, asynchronous=settings.ASYNC_VIEWS, throttles=throttles)
+
+
+async def issue_link_download_async(request, *callback_args, **callback_kwargs):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    try:
+        file = await File.objects.aget(token=callback_kwargs.get('uuid', None))
+        if not file.handle:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+
+        throttle = await sync_to_async(download_throttle)(file)
+        response = await sync_to_async(download_response, thread_sensitive=False)(request, file, asynchronous=True,
+                                                                                   throttle=throttle)
+    except (File.DoesNotExist, FileNotFoundError):
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+    except DownloadLimited as e:
+        return e.response()
+
+    if is_download_start(request, response):
+        await arecord_download(file.pk, file.user_id)
+        promote_on_access(file)
+
+    return response
+
+
+def check_signed_link(request, signed):
+    """
+    Return ``(link, throttle, counted, None)`` for a signed link that may be served, otherwise
+    ``(None, None, False, error response)``.
+
+    A GET from the first byte reserves one download of a limited link (``counted``); it is
+    given back by ``settle_signed_download`` when no body is sent after all (304, 416, errors).
+    """
+    try:
+        link = load_link(signed)
+        throttle = download_throttle(link_file(link))
+    except signing.BadSignature:
+        return None, None, False, HttpResponse(status=status.HTTP_404_NOT_FOUND)
+    except LinkExpired:
+        return None, None, False, HttpResponse(status=status.HTTP_410_GONE)
+    except DownloadLimited as e:
+        return None, None, False, e.response()
+    counted = request.method == 'GET' and requests_start(request)
+    if counted and not count_download(signed, link):
+        if throttle is not None:
+            throttle.release()
+        return None, None, False, HttpResponse(status=status.HTTP_410_GONE)
+    return link, throttle, counted, None
+
+
+def settle_signed_download(request, signed, link, counted, file, response):
+    """Record a signed download that started, or give back the download reserved for the request."""
+    if response is not None and is_download_start(request, response):
+        record_download(file.pk, file.user_id, deferred=True)
+        promote_on_access(file)
+    elif counted:
+        refund_download(signed, link)
+
+
+def signed_link_download(request, signed, *callback_args, **callback_kwargs):
+    """
+    Serve a signed link straight from the storage key it carries.
+
+    The file is only looked up when its blob has moved since the link was issued
+    (tiering, resharding); downloads are counted through the buffer.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    link, throttle, counted, error = check_signed_link(request, signed)
+    if error is not None:
+        return error
+    file = link_file(link)
+    response = None
+    try:
+        if not os.path.exists(file.handle.path):
+            file = File.objects.filter(pk=link['i'], link_revision=link['r']).first()
+            if file is None or not file.handle:
+                if throttle is not None:
+                    throttle.release()
+                return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+        response = download_response(request, file, throttle=throttle)
+    except FileNotFoundError:
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+    finally:
+        settle_signed_download(request, signed, link, counted, file, response)
+    return response
+
+
+async def signed_link_download_async(request, signed, *callback_args, **callback_kwargs):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    link, throttle, counted, error = await sync_to_async(check_signed_link)(request, signed)
+    if error is not None:
+        return error
+    file = link_file(link)
+    response = None
+    try:
+        if not await asyncio.to_thread(os.path.exists, file.handle.path):
+            file = await File.objects.filter(pk=link['i'], link_revision=link['r']).afirst()
+            if file is None or not file.handle:
+                if throttle is not None:
+                    await sync_to_async(throttle.release)()
+                return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+        response = await sync_to_async(download_response, thread_sensitive=False)(request, file, asynchronous=True,
+                                                                                   throttle=throttle)
+    except FileNotFoundError:
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+    finally:
+        await sync_to_async(settle_signed_download)(request, signed, link, counted, file, response)
+    return response
+
+
+async def upload_chunk_async(request, pk, *callback_args, **callback_kwargs):
+    from django.http import JsonResponse
+
+    if request.method != 'PUT':
+        return HttpResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    try:
+        result = await sync_to_async(CachedTokenAuthentication().authenticate)(request)
+        if result is None:
+            raise AuthenticationFailed('Authentication credentials were not provided.')
+        user, _ = result
+
+        session = await UploadSession.objects.aget(pk=pk, user_id=user.id)
+        offset, length = parse_content_range(request, session.size)
+        written = await asyncio.to_thread(write_chunk, session.path, offset, length, request)
+        session = await sync_to_async(record_chunk)(session, offset, length, written)
+    except UploadSession.DoesNotExist as e:
+        return HttpResponse(json.dumps({'error': str(e)}),
+                            status=status.HTTP_404_NOT_FOUND,
+                            content_type='application/json')
+    except (AuthenticationFailed, ValidationError) as e:
+        return HttpResponse(json.dumps({'error': e.detail}, ensure_ascii=False),
+                            status=e.status_code,
+                            content_type='application/json')
+
+    return JsonResponse(UploadSessionSerializer(session).data)